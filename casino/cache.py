@@ -1,7 +1,9 @@
-from typing import Dict, Optional
+import heapq
+import time
+from typing import Dict, List, Optional, Tuple
 
 import discord
-from redbot.core import Config
+from redbot.core import Config, bank
 
 
 class OldMessageTypeManager:
@@ -28,3 +30,208 @@ class OldMessageTypeManager:
         else:
             await self._config.guild_from_id(gid).use_old_style.clear()
             self._cached_guild[gid] = self._config.defaults["GUILD"]["use_old_style"]
+
+
+class SettingsCache:
+    """Caches the casino mode and the settings tree of each casino.
+
+    The settings tree is everything stored at the casino's scope (Settings, Games,
+    Memberships, ...), keyed by guild id, or None for the global casino. Entries only
+    change through casinoset and the reset/mode commands, which must call `invalidate`.
+    Every invalidation bumps a version, so a read that was in flight while the settings
+    changed is returned to its caller but never cached over the newer value.
+
+    Returned trees are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, config: Config, enable_cache: bool = True):
+        self._config: Config = config
+        self.enable_cache = enable_cache
+        self._global: Optional[bool] = None
+        self._cached_settings: Dict[Optional[int], dict] = {}
+        self._versions: Dict[Optional[int], int] = {}
+        self._epoch: int = 0
+
+    async def is_global(self) -> bool:
+        if self.enable_cache and self._global is not None:
+            return self._global
+        epoch = self._epoch
+        ret = await self._config.Settings.Global()
+        if epoch == self._epoch:
+            self._global = ret
+        return ret
+
+    async def get(self, guild: discord.Guild) -> dict:
+        """Returns the settings tree of the guild's casino, or of the global casino in global mode."""
+        key = None if await self.is_global() else guild.id
+        if self.enable_cache and key in self._cached_settings:
+            return self._cached_settings[key]
+
+        version = self._version(key)
+        group = self._config if key is None else self._config.guild_from_id(key)
+        ret = await group.all()
+        if version == self._version(key):
+            self._cached_settings[key] = ret
+        return ret
+
+    def invalidate(self, guild: Optional[discord.Guild] = None) -> None:
+        """Drops the cached settings of a guild, or everything (including the mode) when no guild is given.
+
+        The global casino is dropped along with the guild, since a command run in a guild
+        edits whichever of the two is active.
+        """
+        if guild is None:
+            self._epoch += 1
+            self._global = None
+            self._cached_settings.clear()
+            return
+        for key in (guild.id, None):
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._cached_settings.pop(key, None)
+
+    def _version(self, key: Optional[int]):
+        return self._epoch, self._versions.get(key, 0)
+
+
+LEADERBOARD_SIZE = 10
+MIN_RATE_PLAYS = 20  # games a player needs before they rank by win rate
+METRICS = ("won", "played", "winrate")
+
+
+class CasinoStats:
+    """Played/Won aggregates for one casino: per game totals and per player totals.
+
+    Leaderboards are computed on first use and then patched as stats come in. Played and
+    Won only ever grow, so a changed player either enters the cached board or is already
+    placed correctly; only a falling win rate inside the board needs a recount.
+    """
+
+    __slots__ = ("played", "won", "players", "_boards")
+
+    def __init__(self):
+        self.played: Dict[str, int] = {}
+        self.won: Dict[str, int] = {}
+        self.players: Dict[int, List[int]] = {}  # player id -> [played, won]
+        self._boards: Dict[str, List[int]] = {}
+
+    @classmethod
+    def from_players(cls, players: dict) -> "CasinoStats":
+        stats = cls()
+        for player_id, data in players.items():
+            totals = stats.players[player_id] = [sum(data["Played"].values()), sum(data["Won"].values())]
+            if not totals[0]:
+                del stats.players[player_id]
+            for game, count in data["Played"].items():
+                stats.played[game] = stats.played.get(game, 0) + count
+            for game, count in data["Won"].items():
+                stats.won[game] = stats.won.get(game, 0) + count
+        return stats
+
+    def record(self, player_id: int, game: str, stat: str) -> None:
+        totals = self.players.setdefault(player_id, [0, 0])
+        if stat == "Played":
+            self.played[game] = self.played.get(game, 0) + 1
+            totals[0] += 1
+        else:
+            self.won[game] = self.won.get(game, 0) + 1
+            totals[1] += 1
+
+        for metric, board in list(self._boards.items()):
+            score = self.score(player_id, metric)
+            if player_id in board:
+                if metric == "winrate" and stat == "Played":
+                    del self._boards[metric]
+                    continue
+                board.sort(key=lambda x: self.score(x, metric), reverse=True)
+            elif score is not None and (len(board) < LEADERBOARD_SIZE or score > self.score(board[-1], metric)):
+                board.append(player_id)
+                board.sort(key=lambda x: self.score(x, metric), reverse=True)
+                del board[LEADERBOARD_SIZE:]
+
+    def score(self, player_id: int, metric: str):
+        played, won = self.players.get(player_id, (0, 0))
+        if metric == "won":
+            return won
+        elif metric == "played":
+            return played
+        return won / played if played >= MIN_RATE_PLAYS else None
+
+    def leaderboard(self, metric: str) -> List[int]:
+        """Returns the ids of the top players for a metric, best first."""
+        board = self._boards.get(metric)
+        if board is None:
+            ranked = ((self.score(x, metric), x) for x in self.players)
+            board = [x for score, x in heapq.nlargest(LEADERBOARD_SIZE, (r for r in ranked if r[0] is not None))]
+            self._boards[metric] = board
+        return board
+
+
+class StatsIndex:
+    """Keeps a CasinoStats per casino, keyed like SettingsCache (None for the global casino).
+
+    A casino is built from one scan of its players the first time it is asked for, and
+    kept current afterwards through `record`. Resets that touch Played/Won must call
+    `invalidate` so the next request rescans.
+    """
+
+    def __init__(self, config: Config):
+        self._config: Config = config
+        self._casinos: Dict[Optional[int], CasinoStats] = {}
+        self._pending: Dict[Optional[int], list] = {}  # records that arrived during a scan
+
+    async def get(self, guild: Optional[discord.Guild], is_global: bool) -> CasinoStats:
+        key = None if is_global else guild.id
+        stats = self._casinos.get(key)
+        if stats is not None:
+            return stats
+
+        self._pending.setdefault(key, [])
+        try:
+            if is_global:
+                players = await self._config.all_users()
+            else:
+                players = await self._config.all_members(guild)
+            stats = CasinoStats.from_players(players)
+            for record in self._pending[key]:
+                stats.record(*record)
+        finally:
+            self._pending.pop(key, None)
+        self._casinos[key] = stats
+        return stats
+
+    def record(self, key: Optional[int], player_id: int, game: str, stat: str) -> None:
+        """Counts one Played or Won for a player. Casinos that were never requested are skipped."""
+        if key in self._casinos:
+            self._casinos[key].record(player_id, game, stat)
+        elif key in self._pending:
+            self._pending[key].append((player_id, game, stat))
+
+    def invalidate(self, guild: Optional[discord.Guild] = None) -> None:
+        if guild is None:
+            self._casinos.clear()
+            return
+        self._casinos.pop(guild.id, None)
+        self._casinos.pop(None, None)
+
+
+CURRENCY_TTL = 300
+
+
+class CurrencyCache:
+    """Caches the bank currency name of each guild.
+
+    Red has no event for currency changes, so a name is only trusted for `ttl` seconds.
+    """
+
+    def __init__(self, ttl: int = CURRENCY_TTL):
+        self.ttl = ttl
+        self._cached: Dict[int, Tuple[float, str]] = {}
+
+    async def get(self, guild: discord.Guild) -> str:
+        now = time.monotonic()
+        cached = self._cached.get(guild.id)
+        if cached is not None and now - cached[0] < self.ttl:
+            return cached[1]
+        ret = await bank.get_currency_name(guild)
+        self._cached[guild.id] = (now, ret)
+        return ret
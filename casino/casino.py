@@ -5,13 +5,16 @@ import asyncio
 import calendar
 import logging
 import re
+from functools import partial
 from typing import Union, Final, Literal
 from operator import itemgetter
 
 
 # Casino
-from . import utils
+from . import simulator, utils
+from .cache import METRICS
 from .data import Database
+from .deck import Deck
 from .games import Core, Blackjack, Double, War
 from .utils import is_input_unsupported
 
@@ -61,6 +64,7 @@ class Casino(Database, commands.Cog):
         async for guild_id, guild_data in AsyncIter(all_members.items(), steps=100):
             if user_id in guild_data:
                 await super().config.member_from_ids(guild_id, user_id).clear()
+        self.stats_index.invalidate()
 
     # --------------------------------------------------------------------------------------------------
 
@@ -168,8 +172,11 @@ class Casino(Database, commands.Cog):
         Example: [p]bjmock 50 :clubs: 10, :diamonds: 10 | :clubs: Ace, :clubs: Queen
         """
         ph, dh = hands.split(" | ")
-        ph = [(x[0], int(x[2:])) if x[2:].isdigit() else (x[0], x[2:]) for x in ph.split(", ")]
-        dh = [(x[0], int(x[2:])) if x[2:].isdigit() else (x[0], x[2:]) for x in dh.split(", ")]
+        try:
+            ph = [Deck.parse_card(x) for x in ph.split(", ")]
+            dh = [Deck.parse_card(x) for x in dh.split(", ")]
+        except ValueError as e:
+            return await ctx.send(str(e))
         await Blackjack(self.old_message_cache).mock(ctx, bet, ph, dh)
 
     # --------------------------------------------------------------------------------------------------
@@ -310,14 +317,13 @@ class Casino(Database, commands.Cog):
     @casino.command()
     @checks.admin_or_permissions(administrator=True)
     async def resetinstance(self, ctx: commands.Context):
-        """Reset global/server cooldowns, settings, memberships, or everything."""
+        """Reset global/server cooldowns, stats, settings, memberships, or everything."""
         if await super().casino_is_global() and not await ctx.bot.is_owner(ctx.author):
             return await ctx.send(_("While the casino is in global mode, only the bot owner may use this command."))
 
-        options = (_("settings"), _("games"), _("cooldowns"), _("memberships"), _("all"))
+        options = (_("settings"), _("games"), _("cooldowns"), _("stats"), _("memberships"), _("all"))
         await ctx.send(_("What would you like to reset?\n`{}`.").format(utils.fmt_join(options)))
         pred = MessagePredicate.lower_contained_in(options, ctx=ctx)
-        await ctx.send(_("What would you like to reset?\n`{}`.").format(utils.fmt_join(options)))
 
         try:
             choice = await ctx.bot.wait_for("message", timeout=25.0, check=pred)
@@ -326,6 +332,8 @@ class Casino(Database, commands.Cog):
 
         if choice.content.lower() == _("cooldowns"):
             await super()._reset_cooldowns(ctx)
+        elif choice.content.lower() == _("stats"):
+            await super()._reset_stats(ctx)
         elif choice.content.lower() == _("settings"):
             await super()._reset_settings(ctx)
         elif choice.content.lower() == _("games"):
@@ -470,9 +478,16 @@ class Casino(Database, commands.Cog):
 
     @casino.command()
     async def stats(
-        self, ctx: commands.Context, player: Union[discord.Member, discord.User] = None
+        self,
+        ctx: commands.Context,
+        player: Union[discord.Member, discord.User, Literal["--global"]] = None,
     ):
-        """Shows your play statistics for Casino"""
+        """Shows your play statistics for Casino
+
+        Use `--global` instead of a player to see the totals for the whole casino.
+        """
+        if player == "--global":
+            return await self.casino_stats(ctx)
         if player is None:
             player = ctx.author
 
@@ -489,6 +504,9 @@ class Casino(Database, commands.Cog):
         played = [y for x, y in sorted(player_data["Played"].items(), key=itemgetter(0))]
         won = [y for x, y in sorted(player_data["Won"].items(), key=itemgetter(0))]
         cool_items = [y for x, y in sorted(player_data["Cooldowns"].items(), key=itemgetter(0))]
+        if player_data["Cooldown_Epoch"] != await casino.Settings.Cooldown_Epoch():
+            # Reset for the whole casino since they were set.
+            cool_items = [0] * len(cool_items)
 
         reduction = perks["Reduction"]
         fmt_reduct = utils.cooldown_formatter(reduction)
@@ -510,6 +528,53 @@ class Casino(Database, commands.Cog):
         embed.set_footer(text=disclaimer)
         await ctx.send(embed=embed)
 
+    async def casino_stats(self, ctx: commands.Context):
+        settings = await self.settings_cache.get(ctx.guild)
+        index = await self.stats_index.get(ctx.guild, await super().casino_is_global())
+
+        rows = [(game, index.played.get(game, 0), index.won.get(game, 0)) for game in sorted(settings["Games"])]
+        rows.append((_("Total"), sum(index.played.values()), sum(index.won.values())))
+        table = [
+            (name, humanize_number(played), humanize_number(won), "{:.1%}".format(won / played) if played else "-")
+            for name, played, won in rows
+        ]
+
+        headers = (_("Games"), _("Played"), _("Won"), _("Win Rate"))
+        msg = _("{} Casino | {} players\n\n{}").format(
+            settings["Settings"]["Casino_Name"], humanize_number(len(index.players)), tabulate(table, headers=headers)
+        )
+        await ctx.send(box(msg, lang="md"))
+
+    @casino.command()
+    async def leaderboard(self, ctx: commands.Context, metric: str = "won"):
+        """Shows the top casino players.
+
+        Players can be ranked by games `won` (default), games `played`, or `winrate`.
+        Win rates only rank players with at least 20 games played.
+        """
+        metric = metric.lower().replace(" ", "")
+        if metric not in METRICS:
+            return await ctx.send(_("Rank by one of the following:\n`{}`.").format(utils.fmt_join(METRICS)))
+
+        is_global = await super().casino_is_global()
+        index = await self.stats_index.get(ctx.guild, is_global)
+        board = index.leaderboard(metric)
+        if not board:
+            return await ctx.send(_("Nobody has made the leaderboard yet."))
+
+        table = []
+        for rank, player_id in enumerate(board, 1):
+            player = self.bot.get_user(player_id) if is_global else ctx.guild.get_member(player_id)
+            played, won = index.players[player_id]
+            rate = "{:.1%}".format(won / played)
+            name = player.display_name if player else player_id
+            table.append((rank, name, humanize_number(played), humanize_number(won), rate))
+
+        headers = ("#", _("Player"), _("Played"), _("Won"), _("Win Rate"))
+        casino_name = (await self.settings_cache.get(ctx.guild))["Settings"]["Casino_Name"]
+        msg = _("{} Casino Leaderboard\n\n{}").format(casino_name, tabulate(table, headers=headers))
+        await ctx.send(box(msg, lang="md"))
+
     @casino.command()
     @commands.max_concurrency(1, commands.BucketType.guild)
     @checks.admin_or_permissions(administrator=True)
@@ -535,7 +600,7 @@ class Casino(Database, commands.Cog):
     # --------------------------------------------------------------------------------------------------
 
     async def global_casino_only(ctx):
-        if await ctx.cog.config.Settings.Global() and not await ctx.bot.is_owner(ctx.author):
+        if await ctx.cog.settings_cache.is_global() and not await ctx.bot.is_owner(ctx.author):
             return False
         else:
             return True
@@ -625,6 +690,7 @@ class Casino(Database, commands.Cog):
 
         settings = await super().get_data(ctx)
         await settings.Settings.Payout_Limit.set(limit)
+        self.settings_cache.invalidate(ctx.guild)
         msg = _("{0.name} ({0.id}) set the payout limit to {1}.").format(ctx.author, limit)
         await ctx.send(msg)
 
@@ -638,6 +704,7 @@ class Casino(Database, commands.Cog):
         settings = await super().get_data(ctx)
         status = await settings.Settings.Payout_Switch()
         await settings.Settings.Payout_Switch.set(not status)
+        self.settings_cache.invalidate(ctx.guild)
         msg = _("{0.name} ({0.id}) turned the payout limit {1}.").format(ctx.author, "OFF" if status else "ON")
         await ctx.send(msg)
 
@@ -652,6 +719,7 @@ class Casino(Database, commands.Cog):
 
         status = await settings.Settings.Casino_Open()
         await settings.Settings.Casino_Open.set(not status)
+        self.settings_cache.invalidate(ctx.guild)
         msg = _("{0.name} ({0.id}) {2} the {1} Casino.").format(ctx.author, name, "closed" if status else "opened")
         await ctx.send(msg)
 
@@ -666,6 +734,7 @@ class Casino(Database, commands.Cog):
 
         settings = await super().get_data(ctx)
         await settings.Settings.Casino_Name.set(name)
+        self.settings_cache.invalidate(ctx.guild)
         msg = _("{0.name} ({0.id}) set the casino name to {1}.").format(ctx.author, name)
         await ctx.send(msg)
 
@@ -685,6 +754,7 @@ class Casino(Database, commands.Cog):
             return
 
         await settings.Games.set_raw(game.title(), "Multiplier", value=multiplier)
+        self.settings_cache.invalidate(ctx.guild)
         msg = _("{0.name} ({0.id}) set {1}'s multiplier to {2}.").format(ctx.author, game.title(), multiplier)
         if multiplier == 0:
             msg += _(
@@ -717,6 +787,7 @@ class Casino(Database, commands.Cog):
             )
 
         await settings.Games.set_raw(game.title(), "Cooldown", value=seconds)
+        self.settings_cache.invalidate(ctx.guild)
         cool = utils.cooldown_formatter(seconds)
         msg = _("{0.name} ({0.id}) set {1}'s cooldown to {2}.").format(ctx.author, game.title(), cool)
         await ctx.send(msg)
@@ -740,6 +811,7 @@ class Casino(Database, commands.Cog):
             return await ctx.send(_("You can't set a minimum higher than the game's maximum bid."))
 
         await settings.Games.set_raw(game.title(), "Min", value=minimum)
+        self.settings_cache.invalidate(ctx.guild)
         msg = _("{0.name} ({0.id}) set {1}'s minimum bid to {2}.").format(ctx.author, game.title(), minimum)
         await ctx.send(msg)
 
@@ -762,6 +834,7 @@ class Casino(Database, commands.Cog):
             return await ctx.send(_("You can't set a maximum lower than the game's minimum bid."))
 
         await settings.Games.set_raw(game.title(), "Max", value=maximum)
+        self.settings_cache.invalidate(ctx.guild)
         msg = _("{0.name} ({0.id}) set {1}'s maximum bid to {2}.").format(ctx.author, game.title(), maximum)
         await ctx.send(msg)
 
@@ -781,6 +854,7 @@ class Casino(Database, commands.Cog):
             return await ctx.send(_("Go home. You're drunk."))
 
         await data.Games.set_raw(game.title(), "Access", value=access)
+        self.settings_cache.invalidate(ctx.guild)
         msg = _("{0.name} ({0.id}) changed the access level for {1} to {2}.").format(ctx.author, game, access)
         await ctx.send(msg)
 
@@ -794,9 +868,59 @@ class Casino(Database, commands.Cog):
 
         status = await instance.Games.get_raw(game.title(), "Open")
         await instance.Games.set_raw(game.title(), "Open", value=(not status))
+        self.settings_cache.invalidate(ctx.guild)
         msg = _("{0.name} ({0.id}) {2} the game {1}.").format(ctx.author, game, "closed" if status else "opened")
         await ctx.send(msg)
 
+    @casinoset.command()
+    async def simulate(self, ctx: commands.Context, game: str, rounds: int = 100_000, bonus: float = 1.0):
+        """Simulates a game to estimate its odds and house edge.
+
+        Plays the given number of rounds for every player choice that changes the odds,
+        and shows the expected return per bet at the current multiplier, along with the
+        multiplier that would break even. A negative return means the casino wins over time.
+        Use bonus to see the return for a membership's bonus multiplier.
+        """
+        settings = await self.settings_cache.get(ctx.guild)
+        games = settings["Games"]
+        if not await self.basic_check(ctx, game, games, rounds):
+            return
+
+        if not 1 <= rounds <= simulator.MAX_ROUNDS:
+            return await ctx.send(_("Rounds must be between 1 and {}.").format(humanize_number(simulator.MAX_ROUNDS)))
+
+        if bonus <= 0 or is_input_unsupported(bonus):
+            return await ctx.send(_("Go home. You're drunk."))
+
+        game = game.title()
+        async with ctx.typing():
+            outcomes = await self.bot.loop.run_in_executor(
+                None, partial(simulator.simulate_variants, game, rounds)
+            )
+
+        multiplier = games[game]["Multiplier"]
+        table = []
+        for outcome in outcomes:
+            break_even = outcome.break_even(bonus)
+            table.append(
+                [
+                    outcome.describe(),
+                    "{:.2%}".format(outcome.win_rate),
+                    "{:+.2%}".format(outcome.expected_return(multiplier, bonus)),
+                    "-" if break_even is None else "{:.2f}x".format(break_even),
+                ]
+            )
+
+        headers = (_("Variant"), _("Win Rate"), _("Return"), _("Break Even"))
+        if game in simulator.FIXED_PAYOUT:
+            payout = _("Payout set by the player")
+        else:
+            payout = _("Multiplier: {}x, Bonus: {}x").format(multiplier, bonus)
+        msg = _("{} | {} rounds per variant | {}\n\n{}").format(
+            game, humanize_number(rounds), payout, tabulate(table, headers=headers)
+        )
+        await ctx.send(box(msg, lang="cpp"))
+
     # --------------------------------------------------------------------------------------------------
 
     async def membership_updater(self):
@@ -813,99 +937,116 @@ class Casino(Database, commands.Cog):
             log.error("Casino error in membership_updater:\n", exc_info=True)
 
     async def global_updater(self):
-        while True:
-            users = await self.config.all_users()
+        users = await self.config.all_users()
+        if not users:
+            return
+        memberships = (await self.settings_cache.get(None))["Memberships"]
+        balances = await self.bulk_balances()
+        if balances is None:
+            return
+        default = await bank.get_default_balance()
+
+        changes = {}
+        async for user_id, user_data in AsyncIter(users.items(), steps=100):
+            user_obj = self.bot.get_user(user_id)
+            if not user_obj:
+                # user isn't in the cache so we can probably
+                # ignore them without issue
+                continue
+            balance = balances.get(user_id, default)
+            change = self.membership_change(memberships, user_data["Membership"], user_obj, balance, _global=True)
+            if change is not None:
+                changes[user_id] = (user_data["Membership"], change)
+        await self.write_memberships(changes)
+
+    async def local_updater(self):
+        guilds = await self.config.all_guilds()
+        for guild in guilds:
+            guild_obj = self.bot.get_guild(guild)
+            if not guild_obj:
+                continue
+            users = await self.config.all_members(guild_obj)
             if not users:
-                break
-            memberships = await self.config.Memberships.all()
-            if not memberships:
-                break
-            for user in users:
-                user_obj = self.bot.get_user(user)
+                continue
+            memberships = (await self.settings_cache.get(guild_obj))["Memberships"]
+            balances = await self.bulk_balances(guild_obj)
+            if balances is None:
+                continue
+            default = await bank.get_default_balance(guild_obj)
+
+            changes = {}
+            async for user_id, user_data in AsyncIter(users.items(), steps=100):
+                user_obj = guild_obj.get_member(user_id)
                 if not user_obj:
-                    # user isn't in the cache so we can probably
-                    # ignore them without issue
                     continue
-                async with self.config.user(user_obj).Membership() as user_data:
-                    if user_data["Name"] not in memberships:
-                        user_data["Name"] = "Basic"
-                        user_data["Assigned"] = False
-                await self.process_user(memberships, user_obj, _global=True)
-            break
+                balance = balances.get(user_id, default)
+                change = self.membership_change(memberships, user_data["Membership"], user_obj, balance)
+                if change is not None:
+                    changes[user_id] = (user_data["Membership"], change)
+            await self.write_memberships(changes, guild=guild_obj)
 
-    async def local_updater(self):
-        while True:
-            guilds = await self.config.all_guilds()
-            if not guilds:
-                break
-            for guild in guilds:
-                guild_obj = self.bot.get_guild(guild)
-                if not guild_obj:
-                    continue
-                users = await self.config.all_members(guild_obj)
-                if not users:
-                    continue
-                memberships = await self.config.guild(guild_obj).Memberships.all()
-                if not memberships:
-                    continue
-                for user in users:
-                    user_obj = guild_obj.get_member(user)
-                    if not user_obj:
-                        continue
-                    async with self.config.member(user_obj).Membership() as user_data:
-                        if user_data["Name"] not in memberships:
-                            user_data["Name"] = "Basic"
-                            user_data["Assigned"] = False
-                    await self.process_user(memberships, user_obj)
-            break
-
-    async def process_user(self, memberships, user, _global=False):
-        qualified = []
+    @staticmethod
+    async def bulk_balances(guild=None):
+        """Returns every bank balance for the guild (or the global bank) from a single read."""
         try:
-            bal = await bank.get_balance(user)
-        except AttributeError:
+            accounts = await bank.get_leaderboard(guild=guild)
+        except TypeError:
             log.error(
                 "Casino is in global mode, while economy is in local mode. "
                 "Economy must be global if Casino is global. Either change casino "
                 "back to local with the casinoset mode command or make your economy "
                 "global with the bankset toggleglobal command."
             )
-            return
+            return None
+        return {user_id: account["balance"] for user_id, account in accounts}
+
+    def membership_change(self, memberships, current, user, balance, _global=False):
+        """Returns the membership a player should now have, or None if it is unchanged.
+
+        Manually assigned memberships are left alone for as long as they exist, and
+        memberships that were deleted fall back to whatever the player qualifies for.
+        """
+        if current["Assigned"] and current["Name"] in memberships:
+            return None
+        membership = {"Name": self.qualify(memberships, user, balance, _global=_global), "Assigned": False}
+        return None if membership == current else membership
+
+    @staticmethod
+    def qualify(memberships, user, balance, _global=False):
+        """Returns the highest access membership the user meets every requirement for."""
+        joined = user.created_at if _global else user.joined_at
+        days = (discord.utils.utcnow() - joined).days if joined else 0
+        role_list = None
+        qualified = []
         for name, requirements in memberships.items():
-            if _global:
-                if requirements["Credits"] and bal < requirements["Credits"]:
-                    continue
-                elif (
-                    requirements["DOS"]
-                    and requirements["DOS"] > (user.created_at.now() - user.created_at).days
-                ):
-                    continue
-                else:
-                    qualified.append((name, requirements["Access"]))
-            else:
-                role_list = [x.name for x in user.roles]
-                role_list += [x.mention for x in user.roles]
-                if requirements["Credits"] and bal < requirements["Credits"]:
-                    continue
-                elif requirements["Role"] and requirements["Role"] not in role_list:
-                    continue
-                elif (
-                    requirements["DOS"]
-                    and requirements["DOS"] > (user.joined_at.now() - user.joined_at).days
-                ):
+            if requirements["Credits"] and balance < requirements["Credits"]:
+                continue
+            elif requirements["DOS"] and requirements["DOS"] > days:
+                continue
+            elif not _global and requirements["Role"]:
+                if role_list is None:
+                    role_list = {x.name for x in user.roles} | {x.mention for x in user.roles}
+                if requirements["Role"] not in role_list:
                     continue
-                else:
-                    qualified.append((name, requirements["Access"]))
+            qualified.append((name, requirements["Access"]))
 
-        membership = max(qualified, key=itemgetter(1))[0] if qualified else "Basic"
-        if _global:
-            async with self.config.user(user).Membership() as data:
-                data["Name"] = membership
-                data["Assigned"] = False
-        else:
-            async with self.config.member(user).Membership() as data:
-                data["Name"] = membership
-                data["Assigned"] = False
+        return max(qualified, key=itemgetter(1))[0] if qualified else "Basic"
+
+    async def write_memberships(self, changes, guild=None):
+        """Writes back the changed memberships, given as user id -> (old, new) membership.
+
+        Each player is written through their own group, under the lock a game takes to
+        commit its changes, and only if their membership is still the one the change was
+        worked out from, so plays and manual assignments made meanwhile are kept.
+        """
+        for user_id, (current, membership) in changes.items():
+            if guild is None:
+                group = self.config.user_from_id(user_id)
+            else:
+                group = self.config.member_from_ids(guild.id, user_id)
+            async with group.all() as data:
+                if data["Membership"] == current:
+                    data["Membership"] = membership
 
     @staticmethod
     async def basic_check(ctx, game, games, base):
@@ -990,6 +1131,8 @@ class Membership(Database):
             await self.timeout
         except ExitProcess:
             await self.ctx.send(_("Process exited."))
+        finally:
+            self.settings_cache.invalidate(self.ctx.guild)
 
     async def delete(self):
         memberships = await self.coro.all()
@@ -1,16 +1,18 @@
 import asyncio
 import logging
+import time
 from copy import deepcopy
 
 import discord
 from redbot.core import Config, bank
 from collections import namedtuple
 
-from .cache import OldMessageTypeManager
+from .cache import CurrencyCache, OldMessageTypeManager, SettingsCache, StatsIndex
 from .utils import is_input_unsupported, min_int, max_int
 
 user_defaults = {
     "Pending_Credits": 0,
+    "Cooldown_Epoch": 0,
     "Membership": {"Name": "Basic", "Assigned": False},
     "Played": {
         "Allin": 0,
@@ -56,6 +58,7 @@ guild_defaults = {
         "Casino_Open": True,
         "Payout_Switch": False,
         "Payout_Limit": 10000,
+        "Cooldown_Epoch": 0,
     },
     "Games": {
         "Allin": {
@@ -126,6 +129,8 @@ guild_defaults = {
     },
 }
 
+BASIC_PERKS = {"Reduction": 0, "Access": 0, "Color": "grey", "Bonus": 1}
+
 member_defaults = deepcopy(user_defaults)
 global_defaults = deepcopy(guild_defaults)
 global_defaults["Settings"]["Global"] = True
@@ -137,85 +142,127 @@ _DataObj = _DataNamedTuple(foo=None)
 
 log = logging.getLogger("red.jumper-plugins.casino")
 
+MIGRATION_CHUNK = 100  # guilds migrated between progress saves
+
 
 class Database:
 
     config: Config = Config.get_conf(_DataObj, 5074395001, force_registration=True)
+    # Shared by the cog, every GameEngine and every Membership process.
+    old_message_cache = OldMessageTypeManager(config=config, enable_cache=True)
+    settings_cache = SettingsCache(config=config, enable_cache=True)
+    stats_index = StatsIndex(config=config)
+    currency_cache = CurrencyCache()
 
     def __init__(self):
         self.config.register_guild(**guild_defaults)
-        self.config.register_global(schema_version=1, **global_defaults)
+        self.config.register_global(schema_version=1, migration_progress={}, **global_defaults)
         self.config.register_member(**member_defaults)
         self.config.register_user(**user_defaults)
-        self.old_message_cache = OldMessageTypeManager(config=self.config, enable_cache=True)
         self.migration_task: asyncio.Task = None
         self.cog_ready_event: asyncio.Event = asyncio.Event()
 
     async def data_schema_migration(self, from_version: int, to_version: int):
-        if from_version == to_version:
-            self.cog_ready_event.set()
-            return
-        if from_version < 2 <= to_version:
-            try:
-                async with self.config.all() as casino_data:
-                    temp = deepcopy(casino_data)
-                    global_payout = casino_data["Settings"]["Payout_Limit"]
-                    if is_input_unsupported(global_payout):
-                        casino_data["Settings"]["Payout_Limit"] = await bank.get_max_balance()
-                    for g, g_data in temp["Games"].items():
-                        for g_data_key, g_data_value in g_data.items():
-                            if g_data_key in ["Access", "Cooldown", "Max", "Min", "Multiplier"]:
-                                if is_input_unsupported(g_data_value):
-                                    if g_data_value < min_int:
-                                        g_data_value_new = min_int
-                                    else:
-                                        g_data_value_new = max_int
-                                    casino_data["Games"][g][g_data_key] = g_data_value_new
-                async with self.config._get_base_group(self.config.GUILD).all() as casino_data:
-                    temp = deepcopy(casino_data)
-                    for guild_id, guild_data in temp.items():
-                        if (
-                            "Settings" in temp[guild_id]
-                            and "Payout_Limit" in temp[guild_id]["Settings"]
-                        ):
-                            guild_payout = casino_data[guild_id]["Settings"]["Payout_Limit"]
-                            if is_input_unsupported(guild_payout):
-                                casino_data[guild_id]["Settings"][
-                                    "Payout_Limit"
-                                ] = await bank.get_max_balance(
-                                    guild_payout, guild=discord.Object(id=int(guild_id))
-                                )
-                        if "Games" in temp[guild_id]:
-                            for g, g_data in temp[guild_id]["Games"].items():
-                                for g_data_key, g_data_value in g_data.items():
-                                    if g_data_key in [
-                                        "Access",
-                                        "Cooldown",
-                                        "Max",
-                                        "Min",
-                                        "Multiplier",
-                                    ]:
-                                        if is_input_unsupported(g_data_value):
-                                            if g_data_value < min_int:
-                                                g_data_value_new = min_int
-                                            else:
-                                                g_data_value_new = max_int
-                                            casino_data[guild_id]["Games"][g][
-                                                g_data_key
-                                            ] = g_data_value_new
-                await self.config.schema_version.set(2)
-            except Exception as e:
-                log.exception(
-                    "Fatal Exception during Data migration to Scheme 2, Casino cog will not be loaded.",
-                    exc_info=e,
-                )
-                raise
+        """
+
+        :param from_version: The schema version the stored data is at.
+        :param to_version: The schema version this version of casino expects.
+        :return: None
+
+        Runs every migration between the two versions in order. Each one is applied to the
+        global casino and then to each guild's casino separately, so only one guild's data
+        is held at a time. Progress is saved after every chunk of guilds, and a migration
+        that was interrupted picks up after the last saved guild on the next load.
+        """
+        migrations = {2: self._migrate_unsupported_values}
+        try:
+            for version in range(from_version + 1, to_version + 1):
+                if version in migrations:
+                    await self._run_migration(version, migrations[version])
+                await self.config.schema_version.set(version)
+        except Exception as e:
+            log.exception(
+                "Fatal Exception during Data migration to Scheme {}, Casino cog will not be loaded.".format(to_version),
+                exc_info=e,
+            )
+            raise
         self.cog_ready_event.set()
 
+    async def _run_migration(self, version, step):
+        start = time.perf_counter()
+        progress = await self.config.migration_progress()
+        if progress.get("version") == version:
+            last_guild = progress["last_guild"]
+            log.info("Resuming casino migration to schema %s after guild %s.", version, last_guild)
+        else:
+            last_guild = None
+            await step(self.config, None)
+            await self.config.migration_progress.set({"version": version, "last_guild": 0})
+
+        guild_ids = await self._stored_guild_ids()
+        if last_guild:
+            guild_ids = [x for x in guild_ids if x > last_guild]
+
+        updated = 0
+        for idx in range(0, len(guild_ids), MIGRATION_CHUNK):
+            chunk = guild_ids[idx : idx + MIGRATION_CHUNK]
+            for guild_id in chunk:
+                updated += await step(self.config.guild_from_id(guild_id), guild_id)
+            await self.config.migration_progress.set({"version": version, "last_guild": chunk[-1]})
+            await asyncio.sleep(0)
+
+        await self.config.migration_progress.clear()
+        log.info(
+            "Casino data migrated to schema %s in %.2f seconds (%s guilds checked, %s updated).",
+            version,
+            time.perf_counter() - start,
+            len(guild_ids),
+            updated,
+        )
+
+    async def _stored_guild_ids(self):
+        """
+
+        :return: The sorted ids of every guild with stored casino data.
+
+        Config can't list the stored guilds without reading their data, so the guild tree is
+        read once here and only its keys outlive this call. Each guild's data is read
+        again, on its own, when it is migrated.
+        """
+        return sorted(int(x) for x in await self.config._get_base_group(self.config.GUILD).all())
+
+    @staticmethod
+    async def _migrate_unsupported_values(group, guild_id):
+        """
+
+        :param group: The global config or a guild's config group.
+        :param guild_id: The guild id, None for the global casino.
+        :return: True if anything was changed.
+
+        Schema 2: clamps the payout limit and game settings that are too large to store.
+        """
+        changed = False
+        payout = await group.Settings.Payout_Limit()
+        if is_input_unsupported(payout):
+            guild = None if guild_id is None else discord.Object(id=guild_id)
+            await group.Settings.Payout_Limit.set(await bank.get_max_balance(guild=guild))
+            changed = True
+
+        games = await group.Games()
+        games_changed = False
+        for game_data in games.values():
+            for key, value in game_data.items():
+                if key in ("Access", "Cooldown", "Max", "Min", "Multiplier") and is_input_unsupported(value):
+                    game_data[key] = min_int if value < min_int else max_int
+                    games_changed = True
+        if games_changed:
+            await group.Games.set(games)
+        return changed or games_changed
+
     async def casino_is_global(self):
         """Checks to see if the casino is storing data on
            a per server basis or globally."""
-        return await self.config.Settings.Global()
+        return await self.settings_cache.is_global()
 
     async def get_data(self, ctx, player=None):
         """
@@ -248,9 +295,25 @@ class Database:
         Returns a dictionary representation of casino's settings data
         and the player data.
         """
-        settings = await self.get_data(ctx)
-        player_data = await self.get_data(ctx, player=player)
-        return await settings.all(), await player_data.all()
+        _player_group, settings, player_data = await self.get_snapshot(ctx, player)
+        return settings, player_data
+
+    async def get_snapshot(self, ctx, player):
+        """
+
+        :param ctx: Context Object
+        :param player: Member or user object
+        :return: Tuple of the player's config group, the settings data and the player data.
+
+        Settings come from the settings cache and must not be mutated. The player's
+        group is returned so changes made to the snapshot can be written back.
+        """
+        settings = await self.settings_cache.get(ctx.guild)
+        if await self.casino_is_global():
+            player_group = self.config.user(player)
+        else:
+            player_group = self.config.member(player)
+        return player_group, settings, await player_group.all()
 
     async def _wipe_casino(self, ctx):
         """
@@ -262,6 +325,8 @@ class Database:
         This wipes everything, including member/user data.
         """
         await self.config.clear_all()
+        self.settings_cache.invalidate()
+        self.stats_index.invalidate()
         msg = "{0.name} ({0.id}) wiped all casino data.".format(ctx.author)
         await ctx.send(msg)
 
@@ -271,6 +336,7 @@ class Database:
         """
         data = await self.get_data(ctx)
         await data.Settings.clear()
+        self.settings_cache.invalidate()
         msg = ("{0.name} ({0.id}) reset all casino settings.").format(ctx.author)
         await ctx.send(msg)
 
@@ -280,6 +346,7 @@ class Database:
         """
         data = await self.get_data(ctx)
         await data.Memberships.clear()
+        self.settings_cache.invalidate()
         msg = ("{0.name} ({0.id}) cleared all casino memberships.").format(ctx.author)
         await ctx.send(msg)
 
@@ -289,6 +356,7 @@ class Database:
         """
         data = await self.get_data(ctx)
         await data.Games.clear()
+        self.settings_cache.invalidate()
         msg = ("{0.name} ({0.id}) restored casino games to default settings.").format(ctx.author)
         await ctx.send(msg)
 
@@ -311,8 +379,10 @@ class Database:
 
         """
         data = await self.get_data(ctx, player=player)
-        await data.Played.clear()
-        await data.Won.clear()
+        async with data.all() as player_data:
+            player_data.pop("Played", None)
+            player_data.pop("Won", None)
+        self.stats_index.invalidate(ctx.guild)
 
         msg = ("{0.name} ({0.id}) reset all stats for {1.name} ({1.id}).").format(ctx.author, player)
         await ctx.send(msg)
@@ -328,6 +398,7 @@ class Database:
         """
         data = await self.get_data(ctx, player=player)
         await data.clear()
+        self.stats_index.invalidate(ctx.guild)
 
         msg = ("{0.name} ({0.id}) reset all data for {1.name} ({1.id}).").format(ctx.author, player)
         await ctx.send(msg)
@@ -350,20 +421,60 @@ class Database:
     async def _reset_cooldowns(self, ctx):
         """
         Resets all game cooldowns for every player in the database.
+
+        Only the casino's cooldown epoch is bumped, in a single write. Cooldowns a player
+        picked up under an older epoch are treated as expired from then on.
         """
+        settings = await self.get_data(ctx)
+        async with settings.Settings.Cooldown_Epoch.get_lock():
+            await settings.Settings.Cooldown_Epoch.set(await settings.Settings.Cooldown_Epoch() + 1)
+        self.settings_cache.invalidate(ctx.guild)
+
         if await self.casino_is_global():
-            for player in await self.config.all_users():
-                user = discord.Object(id=player)
-                await self.config.user(user).Cooldowns.clear()
             msg = ("{0.name} ({0.id}) reset all global cooldowns.").format(ctx.author)
         else:
-            for player in await self.config.all_members(ctx.guild):
-                user = discord.Object(id=player)
-                await self.config.member(user).Cooldowns.clear()
             msg = ("{0.name} ({0.id}) reset all cooldowns on {1.name}.").format(ctx.author, ctx.guild)
 
         await ctx.send(msg)
 
+    async def _reset_stats(self, ctx):
+        """
+        Resets the win / played stats of every player in the database.
+        """
+        if await self._bulk_clear(ctx, "Played", "Won"):
+            msg = ("{0.name} ({0.id}) reset all global stats.").format(ctx.author)
+        else:
+            msg = ("{0.name} ({0.id}) reset all stats on {1.name}.").format(ctx.author, ctx.guild)
+        self.stats_index.invalidate(ctx.guild)
+
+        await ctx.send(msg)
+
+    async def _bulk_clear(self, ctx, *keys):
+        """
+
+        :param ctx: context object
+        :param keys: Top level player keys to reset to their defaults.
+        :return: True if the global casino was reset, False for the guild's casino.
+
+        Clears the keys for every player of the casino. Each player is written through
+        their own group, under the lock a game takes to commit its changes, so a play
+        that finishes during the reset can't write back the old values.
+        """
+        is_global = await self.casino_is_global()
+        if is_global:
+            table = self.config._get_base_group(self.config.USER)
+        else:
+            table = self.config._get_base_group(self.config.MEMBER, str(ctx.guild.id))
+        for player_id in sorted(int(x) for x in await table.all()):
+            if is_global:
+                group = self.config.user_from_id(player_id)
+            else:
+                group = self.config.member_from_ids(ctx.guild.id, player_id)
+            async with group.all() as player_data:
+                for key in keys:
+                    player_data.pop(key, None)
+        return is_global
+
     async def change_mode(self, mode):
         """
 
@@ -381,6 +492,8 @@ class Database:
             await self.config.clear_all_users()
             await self.config.clear_all_globals()
             await self.config.Settings.Global.set(False)
+        self.settings_cache.invalidate()
+        self.stats_index.invalidate()
 
     async def _update_cooldown(self, ctx, game, time):
         player_data = await self.get_data(ctx, player=ctx.author)
@@ -398,14 +511,13 @@ class Database:
         default basic membership. It will also set their new membership to the
         default.
         """
-        basic = {"Reduction": 0, "Access": 0, "Color": "grey", "Bonus": 1}
+        basic = dict(BASIC_PERKS)
         player_data = await self.get_data(ctx, player=player)
         name = await player_data.Membership.Name()
         if name == "Basic":
             return name, basic
 
-        data = await self.get_data(ctx)
-        memberships = await data.Memberships.all()
+        memberships = (await self.settings_cache.get(ctx.guild))["Memberships"]
         try:
             return name, memberships[name]
         except KeyError:
@@ -1,117 +1,146 @@
 import random
-from collections import deque
-from itertools import product, chain
+from array import array
+
+SUITS = (":clubs:", ":diamonds:", ":hearts:", ":spades:")
+RANKS = (2, 3, 4, 5, 6, 7, 8, 9, 10, "Jack", "Queen", "King", "Ace")
+ACE = RANKS.index("Ace")
+# Values by rank index, a card's rank index is card % 13 and its suit index is card // 13.
+BJ_RANK_VALUES = tuple(rank if isinstance(rank, int) else 10 for rank in RANKS[:ACE]) + (1,)
+WAR_RANK_VALUES = tuple(range(2, 15))
+
+DECK_SIZE = len(SUITS) * len(RANKS)
+CARD_NAMES = tuple("{} {}".format(RANKS[card % 13], SUITS[card // 13]) for card in range(DECK_SIZE))
+BJ_VALUES = tuple(BJ_RANK_VALUES[card % 13] for card in range(DECK_SIZE))
+WAR_VALUES = tuple(WAR_RANK_VALUES[card % 13] for card in range(DECK_SIZE))
+SUIT_ALIASES = {"♣": 0, "♦": 1, "♥": 2, "♠": 3}
 
 
 class Deck:
-    """Creates a Deck of playing cards."""
+    """Creates a shoe of one or more decks of playing cards.
+
+    Cards are integers from 0 to 51 (suit * 13 + rank index) and are valued and
+    formatted through lookup tables. The shoe is shuffled once up front and dealt by
+    moving an index, so dealing and burning never move cards around. Once
+    `penetration` (a fraction of the shoe) has been dealt, the next deal reshuffles.
+    """
 
-    suites = (":clubs:", ":diamonds:", ":hearts:", ":spades:")
+    suites = SUITS
     face_cards = ("King", "Queen", "Jack", "Ace")
-    bj_vals = {"Jack": 10, "Queen": 10, "King": 10, "Ace": 1}
-    war_values = {"Jack": 11, "Queen": 12, "King": 13, "Ace": 14}
 
-    def __init__(self):
-        self._deck = deque()
+    def __init__(self, decks=1, penetration=1.0):
+        self.decks = decks
+        self.penetration = penetration
+        self._shoe = array("B", list(range(DECK_SIZE)) * decks)
+        self._cut = max(1, int(len(self._shoe) * penetration))
+        self._top = self._end = 0  # nothing to deal until the first shuffle
 
     def __len__(self):
-        return len(self._deck)
+        return self._end - self._top
 
     def __str__(self):
-        return "Standard deck of cards with {} cards remaining.".format(len(self._deck))
+        return "Shoe of {} deck(s) with {} cards remaining.".format(self.decks, len(self))
 
     def __repr__(self):
-        return "Deck{!r}".format(self._deck)
+        return "Deck{!r}".format(self.deck)
 
     @property
     def deck(self):
-        if len(self._deck) < 1:
+        if len(self) < 1:
             self.new()
-        return self._deck
+        return [CARD_NAMES[card] for card in self._shoe[self._top : self._end]]
 
     def shuffle(self):
-        random.shuffle(self._deck)
+        remaining = self._shoe[self._top : self._end]
+        random.shuffle(remaining)
+        self._shoe[self._top : self._end] = remaining
 
-    def war_count(self, card):
-        try:
-            return self.war_values[card[1]]
-        except KeyError:
-            return card[1]
+    @staticmethod
+    def war_count(card):
+        return WAR_VALUES[card]
 
-    def bj_count(self, hand: list, hole=False):
-        hand = self._hand_type(hand)
+    @staticmethod
+    def bj_count(hand: list, hole=False):
         if hole:
-            card = hand[0][1]
-            count = self.bj_vals[card] if isinstance(card, str) else card
+            count = BJ_VALUES[hand[0]]
             return count if count > 1 else 11
 
-        count = sum([self.bj_vals[y] if isinstance(y, str) else y for x, y in hand])
-        if any("Ace" in pair for pair in hand) and count <= 11:
+        count = sum(BJ_VALUES[card] for card in hand)
+        if count <= 11 and any(card % 13 == ACE for card in hand):
             count += 10
         return count
 
     @staticmethod
     def fmt_hand(hand: list):
-        return ["{} {}".format(y, x) for x, y in hand]
+        return [CARD_NAMES[card] for card in hand]
 
     @staticmethod
     def fmt_card(card):
-        return "{1} {0}".format(*card)
+        return CARD_NAMES[card]
 
     @staticmethod
     def hand_check(hand: list, card):
-        return any(x[1] == card for x in hand)
-
-    def split(self, position: int):
-        self._deck.rotate(-position)
+        return any(RANKS[x % 13] == card for x in hand)
 
     @staticmethod
-    def _true_hand(hand: list):
-        return [x.split(" ") for x in hand]
+    def parse_card(text: str):
+        """Parses a card written as `<suit> <rank>`, e.g. `:clubs: 10` or `♠ Ace`."""
+        try:
+            suit, rank = text.split()
+        except ValueError:
+            raise ValueError("Invalid card: {}".format(text))
+        suit = suit.strip("\ufe0f")
+        if suit in SUIT_ALIASES:
+            suit_index = SUIT_ALIASES[suit]
+        elif suit in SUITS:
+            suit_index = SUITS.index(suit)
+        else:
+            raise ValueError("Invalid suit: {}".format(suit))
+        rank = int(rank) if rank.isdigit() else rank.title()
+        if rank not in RANKS:
+            raise ValueError("Invalid rank: {}".format(rank))
+        return suit_index * 13 + RANKS.index(rank)
+
+    def split(self, position: int):
+        remaining = self._shoe[self._top : self._end]
+        position %= len(remaining) or 1
+        self._shoe[self._top : self._end] = remaining[position:] + remaining[:position]
 
     def draw(self, top=True):
         self._check()
 
         if top:
-            card = self._deck.popleft()
+            card = self._shoe[self._top]
+            self._top += 1
         else:
-            card = self._deck.pop()
+            self._end -= 1
+            card = self._shoe[self._end]
         return card
 
     def _check(self, num=1):
-        if num > 52:
+        if num > len(self._shoe):
             raise ValueError("Can not exceed deck limit.")
-        if len(self._deck) < num:
+        dealt = self._top + len(self._shoe) - self._end
+        if len(self) < num or dealt >= self._cut:
             self.new()
 
-    def _hand_type(self, hand: list):
-        if isinstance(hand[0], tuple):
-            return hand
-
-        try:
-            return self._true_hand(hand)
-        except ValueError:
-            raise ValueError("Invalid hand input.")
-
     def deal(self, num=1, top=True, hand=None):
         self._check(num=num)
 
         if hand is None:
             hand = []
-        for x in range(0, num):
-            if top:
-                hand.append(self._deck.popleft())
-            else:
-                hand.append(self._deck.pop())
+        if top:
+            hand.extend(self._shoe[self._top : self._top + num])
+            self._top += num
+        else:
+            hand.extend(reversed(self._shoe[self._end - num : self._end]))
+            self._end -= num
 
         return hand
 
     def burn(self, num):
         self._check(num=num)
-        for x in range(0, num):
-            del self._deck[0]
+        self._top += num
 
     def new(self):
-        cards = product(self.suites, chain(range(2, 11), ("King", "Queen", "Jack", "Ace")))
-        self._deck = deque(cards)
+        self._top, self._end = 0, len(self._shoe)
         self.shuffle()
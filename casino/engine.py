@@ -3,12 +3,12 @@ import calendar
 from functools import wraps
 
 # Casino
-from typing import Optional
+from typing import Optional, Set, Tuple
 
 from redbot.core.utils.chat_formatting import humanize_number
 
 from . import utils
-from .data import Database
+from .data import BASIC_PERKS, Database
 
 # Red
 from redbot.core import bank
@@ -30,9 +30,24 @@ def game_engine(name=None, choice=None, choices=None):
             except IndexError:
                 user_choice = None
             engine = GameEngine(name, user_choice, choice, args[1], args[2])
-            if await engine.check_conditions():
-                result = await coro(*args, **kwargs)
-                await engine.game_teardown(result)
+            # Games that take more credits mid game (a double down) withdraw them through the engine.
+            args[0].engine = engine
+            if not await engine.acquire():
+                return await engine.ctx.send(
+                    _("{} You already have a game in progress. Finish it before starting another.").format(
+                        engine.player.mention
+                    )
+                )
+            try:
+                if await engine.check_conditions():
+                    try:
+                        result = await coro(*args, **kwargs)
+                    except Exception:
+                        await engine.refund()
+                        raise
+                    await engine.game_teardown(result)
+            finally:
+                engine.release()
 
         return wrapped
 
@@ -72,7 +87,27 @@ class GameEngine(Database):
 
     """
 
-    __slots__ = ("game", "choice", "choices", "ctx", "bet", "player", "guild")
+    __slots__ = (
+        "game",
+        "choice",
+        "choices",
+        "ctx",
+        "bet",
+        "player",
+        "guild",
+        "player_group",
+        "settings",
+        "player_data",
+        "changes",
+        "stats",
+        "scope",
+        "withdrawn",
+    )
+
+    # (scope, player id) of players with a game between check_conditions and game_teardown,
+    # the scope being None for the global casino. Checked and claimed without awaiting in
+    # between, so it serializes plays per player and casino on the event loop.
+    _in_progress: Set[Tuple[Optional[int], int]] = set()
 
     def __init__(self, game, choice, choices, ctx, bet):
         self.game = game
@@ -82,8 +117,42 @@ class GameEngine(Database):
         self.ctx = ctx
         self.player = ctx.author
         self.guild = ctx.guild
+        self.player_group = None
+        self.settings = None
+        self.player_data = None
+        self.changes = {}
+        self.stats = []
+        self.scope = None
+        self.withdrawn = 0
         super().__init__()
 
+    async def acquire(self):
+        """Claims the player for this game, returning False if they are already playing one in this casino."""
+        self.scope = None if await super().casino_is_global() else self.guild.id
+        if (self.scope, self.player.id) in self._in_progress:
+            return False
+        self._in_progress.add((self.scope, self.player.id))
+        return True
+
+    def release(self):
+        self._in_progress.discard((self.scope, self.player.id))
+
+    async def withdraw(self, amount):
+        """Takes credits from the player for this game, so that a failed game can refund them.
+
+        :param amount: The amount to withdraw.
+        :raises ValueError: If the player can't cover the amount.
+        """
+        await bank.withdraw_credits(self.player, amount)
+        self.withdrawn += amount
+
+    async def refund(self):
+        """Returns everything withdrawn for the game after it failed before it could be settled."""
+        try:
+            await bank.deposit_credits(self.player, self.withdrawn)
+        except BalanceTooHigh as e:
+            await bank.set_balance(self.player, e.max_balance)
+
     async def check_conditions(self):
         """
 
@@ -95,138 +164,194 @@ class GameEngine(Database):
         - Checking to see if the player has a high enough access level to play the game.
         - Validating that the player's choice is in the list of declared choices.
         - Checking that the bet is within the range of the set min and max.
-        - Checking to see that has enough currency in the bank account to cover the bet.
         - Checking to see if the game is on cooldown.
+        - Checking to see that has enough currency in the bank account to cover the bet.
 
-        Cooldowns must be checked last so that the game doesn't trigger a cooldown if another
-        condition has failed.
+        The settings and player data are read once into a snapshot that the rest of the play
+        works from. The bet is only withdrawn once every other check has passed, so a failed
+        condition never starts a cooldown. The cooldown and Played stat of a game that starts
+        stay staged until game_teardown commits them along with its result, so a game that
+        fails is refunded without having counted.
 
 
         """
-        settings, player_data = await super().get_all(self.ctx, self.player)
-        access = self.access_calculator(settings["Memberships"], player_data["Membership"]["Name"])
+        self.player_group, self.settings, self.player_data = await super().get_snapshot(self.ctx, self.player)
+        self.expire_cooldowns()
+        game_data = self.settings["Games"][self.game]
+        _name, perks = self.membership()
 
-        if not settings["Settings"]["Casino_Open"]:
+        if not self.settings["Settings"]["Casino_Open"]:
             error = _("The Casino is closed.")
 
-        elif not settings["Games"][self.game]["Open"]:
+        elif not game_data["Open"]:
             error = _("{} is closed.".format(self.game))
 
-        elif settings["Games"][self.game]["Access"] > access:
+        elif game_data["Access"] > perks["Access"]:
             error = _(
                 "{} requires an access level of {}. Your current access level is {}. Obtain "
                 "a higher membership to play this game."
-            ).format(self.game, settings["Games"][self.game]["Access"], access)
+            ).format(self.game, game_data["Access"], perks["Access"])
 
         elif self.choices is not None and self.choice not in self.choices:
             error = _("Incorrect response. Accepted responses are:\n{}.").format(utils.fmt_join(self.choices))
 
-        elif not self.bet_in_range(
-            settings["Games"][self.game]["Min"], settings["Games"][self.game]["Max"]
-        ):
+        elif not self.bet_in_range(game_data["Min"], game_data["Max"]):
             error = _(
                 "Your bet must be between "
-                "{} and {}.".format(
-                    settings["Games"][self.game]["Min"], settings["Games"][self.game]["Max"]
-                )
+                "{} and {}.".format(game_data["Min"], game_data["Max"])
             )
 
-        elif not await bank.can_spend(self.player, self.bet):
-            error = _("You do not have enough credits to cover the bet.")
-
         else:
-            error = await self.check_cooldown(settings["Games"][self.game], player_data)
+            error = self.check_cooldown(game_data, perks["Reduction"])
+
+        if not error:
+            try:
+                await self.withdraw(self.bet)
+            except ValueError:
+                error = _("You do not have enough credits to cover the bet.")
 
         if error:
+            await self.commit()
             await self.ctx.send(error)
             return False
         else:
-            await bank.withdraw_credits(self.player, self.bet)
-            await self.update_stats(stat="Played")
+            now = calendar.timegm(self.ctx.message.created_at.utctimetuple())
+            self.stage("Cooldowns", self.game, value=now + game_data["Cooldown"])
+            self.update_stats(stat="Played")
             return True
 
-    async def update_stats(self, stat: str):
+    def membership(self):
+        """
+
+        :return: Membership name and a dictionary with the perks
+
+        Looks up the player's membership in the snapshot. A membership that has since been
+        deleted falls back to Basic, and the player is moved to Basic on the next commit.
+        """
+        name = self.player_data["Membership"]["Name"]
+        if name != "Basic":
+            try:
+                return name, self.settings["Memberships"][name]
+            except KeyError:
+                self.stage("Membership", value={"Name": "Basic", "Assigned": False})
+        return "Basic", dict(BASIC_PERKS)
+
+    def expire_cooldowns(self):
+        """
+
+        :return: None
+
+        Stages the player's cooldowns as expired when the casino reset every cooldown after
+        they were set, and moves the player to the casino's current cooldown epoch.
+        """
+        epoch = self.settings["Settings"]["Cooldown_Epoch"]
+        if self.player_data["Cooldown_Epoch"] != epoch:
+            self.stage("Cooldowns", value={game: 0 for game in self.player_data["Cooldowns"]})
+            self.stage("Cooldown_Epoch", value=epoch)
+
+    def stage(self, *path, value):
+        """
+
+        :param path: Keys leading to the value, starting from the player data.
+        :param value: The new value.
+        :return: None
+
+        Applies a change to the player snapshot and queues it for the next commit.
+        """
+        data = self.player_data
+        for key in path[:-1]:
+            data = data[key]
+        data[path[-1]] = value
+        self.changes[path] = value
+
+    async def commit(self):
+        """Writes every staged change to the player's data in a single write, then counts the staged stats."""
+        if not self.changes:
+            return
+        changes, self.changes = self.changes, {}
+        async with self.player_group.all() as data:
+            for path, value in changes.items():
+                target = data
+                for key in path[:-1]:
+                    target = target.setdefault(key, {})
+                target[path[-1]] = value
+        stats, self.stats = self.stats, []
+        for stat in stats:
+            self.stats_index.record(self.scope, self.player.id, self.game, stat)
+
+    def update_stats(self, stat: str):
         """
 
         :param stat: string
             Must be Played or Won
         :return: None
 
-        Updates either a player's win or played stat.
+        Stages an increment of either a player's win or played stat, which is counted in the
+        stats index once it is committed.
         """
-        instance = await self.get_data(self.ctx, player=self.player)
-        current = await instance.get_raw(stat, self.game)
-        await instance.set_raw(stat, self.game, value=current + 1)
+        self.stage(stat, self.game, value=self.player_data[stat][self.game] + 1)
+        self.stats.append(stat)
 
-    async def check_cooldown(self, game_data, player_data):
+    def check_cooldown(self, game_data, reduction):
         """
 
         :param game_data: Dictionary
             Contains all the data pertaining to a particular game.
-        :param player_data: Object
-            User or member Object
+        :param reduction: int
+            The cooldown reduction granted by the player's membership.
         :return: String or None
             Returns a string when a cooldown is remaining on a game, otherwise it will
             return None
 
         Checks the time a player last played a game, and compares it with the set cooldown
         for that game. If a user is still on cooldown, then a string detailing the time
-        remaining will be returned. Otherwise this will update their cooldown, and return None.
+        remaining will be returned.
 
         """
-        user_time = player_data["Cooldowns"][self.game]
+        user_time = self.player_data["Cooldowns"][self.game]
         now = calendar.timegm(self.ctx.message.created_at.utctimetuple())
-        base = game_data["Cooldown"]
-        membership = await super()._get_player_membership(self.ctx, self.player)
-        reduction = membership[1]["Reduction"]
-        if now >= user_time - reduction:
-            await super()._update_cooldown(self.ctx, self.game, now + base)
-        else:
+        if now < user_time - reduction:
             seconds = int((user_time + reduction - now))
             remaining = utils.time_formatter(seconds)
             msg = _("{} is still on a cooldown. You still have: {} remaining.").format(self.game, remaining)
             return msg
 
     async def game_teardown(self, result):
-        data = await super().get_data(self.ctx)
-        settings = await data.all()
         message_obj: Optional[discord.Message]
 
         win, amount, msg, message_obj = result
 
         if not win:
-            embed = await self.build_embed(msg, settings, win, total=amount, bonus="(+0)")
-            if (not await self.old_message_cache.get_guild(self.ctx.guild)) and message_obj:
-                return await message_obj.edit(content=self.player.mention, embed=embed)
-            else:
-                return await self.ctx.send(self.player.mention, embed=embed)
+            await self.commit()
+            embed = await self.build_embed(msg, win, total=amount, bonus="(+0)")
+            return await self.send_result(embed, message_obj)
 
-        player_data = await super().get_data(self.ctx, player=self.player)
-        await self.update_stats(stat="Won")
-        if self.limit_check(settings, amount):
-            embed = await self.build_embed(msg, settings, win, total=amount, bonus="(+0)")
+        self.update_stats(stat="Won")
+        if self.limit_check(self.settings, amount):
+            embed = await self.build_embed(msg, win, total=amount, bonus="(+0)")
             return await self.limit_handler(
                 embed,
                 amount,
-                player_data,
-                settings["Settings"]["Payout_Limit"],
+                self.settings["Settings"]["Payout_Limit"],
                 message=message_obj,
             )
 
-        total, bonus = await self.deposit_winnings(amount, player_data, settings)
-        embed = await self.build_embed(msg, settings, win, total=total, bonus=bonus)
-        if (not await self.old_message_cache.get_guild(self.ctx.guild)) and message_obj:
-            return await message_obj.edit(content=self.player.mention, embed=embed)
+        await self.commit()
+        total, bonus = await self.deposit_winnings(amount)
+        embed = await self.build_embed(msg, win, total=total, bonus=bonus)
+        return await self.send_result(embed, message_obj)
+
+    async def send_result(self, embed, message):
+        if (not await self.old_message_cache.get_guild(self.ctx.guild)) and message:
+            return await message.edit(content=self.player.mention, embed=embed)
         else:
             return await self.ctx.send(self.player.mention, embed=embed)
 
-    async def limit_handler(self, embed, amount, player_instance, limit, message):
-        await player_instance.Pending_Credits.set(int(amount))
+    async def limit_handler(self, embed, amount, limit, message):
+        self.stage("Pending_Credits", value=int(amount))
+        await self.commit()
 
-        if (not await self.old_message_cache.get_guild(self.ctx.guild)) and message:
-            await message.edit(content=self.player.mention, embed=embed)
-        else:
-            await self.ctx.send(self.player.mention, embed=embed)
+        await self.send_result(embed, message)
         msg = _(
             "{} Your winnings exceeded the maximum credit limit allowed ({}). The amount "
             "of {} credits will be pending on your account until reviewed. Until an "
@@ -238,8 +363,8 @@ class GameEngine(Database):
 
         await self.player.send(msg)
 
-    async def deposit_winnings(self, amount, player_instance, settings):
-        multiplier = settings["Games"][self.game]["Multiplier"]
+    async def deposit_winnings(self, amount):
+        multiplier = self.settings["Games"][self.game]["Multiplier"]
         if self.game == "Allin" or self.game == "Double":
             try:
                 await bank.deposit_credits(self.player, amount)
@@ -248,7 +373,7 @@ class GameEngine(Database):
                 return await bank.set_balance(self.player, e.max_balance), "(+0)"
 
         initial = round(amount * multiplier)
-        total, amt, msg = await self.calculate_bonus(initial, player_instance, settings)
+        total, amt, msg = self.calculate_bonus(initial, self.membership()[1])
         try:
             await bank.deposit_credits(self.player, total)
         except BalanceTooHigh as e:
@@ -264,12 +389,12 @@ class GameEngine(Database):
         else:
             return False
 
-    async def build_embed(self, msg, settings, win, total, bonus):
+    async def build_embed(self, msg, win, total, bonus):
         balance = await bank.get_balance(self.player)
-        currency = await bank.get_currency_name(self.guild)
+        currency = await self.currency_cache.get(self.guild)
         bal_msg = _("**Remaining Balance:** {} {}").format(humanize_number(balance), currency)
         embed = discord.Embed()
-        embed.title = _("{} Casino | {}").format(settings["Settings"]["Casino_Name"], self.game)
+        embed.title = _("{} Casino | {}").format(self.settings["Settings"]["Casino_Name"], self.game)
 
         if isinstance(msg, discord.Embed):
             for field in msg.fields:
@@ -289,24 +414,8 @@ class GameEngine(Database):
         return embed
 
     @staticmethod
-    def access_calculator(memberships, user_membership):
-        if user_membership == "Basic":
-            return 0
-
-        try:
-            access = memberships[user_membership]["Access"]
-        except KeyError:
-            return 0
-        else:
-            return access
-
-    @staticmethod
-    async def calculate_bonus(amount, player_instance, settings):
-        membership = await player_instance.Membership.Name()
-        try:
-            bonus_multiplier = settings["Memberships"][membership]["Bonus"]
-        except KeyError:
-            bonus_multiplier = 1
+    def calculate_bonus(amount, perks):
+        bonus_multiplier = perks["Bonus"]
         total = round(amount * bonus_multiplier)
         bonus = total - amount
         return total, amount, "(+{})".format(humanize_number(bonus) if bonus_multiplier > 1 else 0)
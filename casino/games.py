@@ -162,7 +162,8 @@ class Blackjack:
     """A simple class to hold the game logic for Blackjack.
 
     Blackjack requires inheritance from data to verify the user
-    can double down.
+    can double down. The second bet of a double down is withdrawn through the
+    game's engine, so it is refunded if the game fails.
     """
 
     def __init__(self, old_message_cache):
@@ -206,15 +207,15 @@ class Blackjack:
             return ph, dh, amount, msg
 
         if choice.content.lower() == _("double"):
-            return await self.double_down(ctx, ph, dh, amount, condition2, message=msg)
+            return await self.double_down(ctx, ph, dh, amount, condition2, message=msg, embed=embed)
         else:
-            ph, dh, message = await self.bj_loop(ctx, ph, dh, ph_count, condition2, message=msg)
+            ph, dh, message = await self.bj_loop(ctx, ph, dh, ph_count, condition2, message=msg, embed=embed)
             dh = self.dealer(dh)
             return ph, dh, amount, msg
 
-    async def double_down(self, ctx, ph, dh, amount, condition2, message):
+    async def double_down(self, ctx, ph, dh, amount, condition2, message, embed=None):
         try:
-            await bank.withdraw_credits(ctx.author, amount)
+            await self.engine.withdraw(amount)
         except ValueError:
             await ctx.send(_("{} You can not cover the bet. Please choose hit or stay.").format(ctx.author.mention))
 
@@ -228,7 +229,7 @@ class Blackjack:
                 return ph, dh, amount, message
             elif choice2.content.lower() == _("hit"):
                 ph, dh, message = await self.bj_loop(
-                    ctx, ph, dh, deck.bj_count(ph), condition2, message=message
+                    ctx, ph, dh, deck.bj_count(ph), condition2, message=message, embed=embed
                 )
                 dh = self.dealer(dh)
                 return ph, dh, amount, message
@@ -261,16 +262,20 @@ class Blackjack:
         embed = self.bj_embed(ctx, ph, dh, pc, outcome=outcome)
         return result, amount, embed, message
 
-    async def bj_loop(self, ctx, ph, dh, count, condition2, message: discord.Message):
+    async def bj_loop(self, ctx, ph, dh, count, condition2, message: discord.Message, embed=None):
         while count < 21:
             ph = deck.deal(hand=ph)
             count = deck.bj_count(hand=ph)
 
             if count >= 21:
                 break
-            embed = self.bj_embed(ctx, ph, dh, count)
+            if embed is None:
+                embed = self.bj_embed(ctx, ph, dh, count)
+            else:
+                self.bj_update(ctx, embed, ph, count)
             if not await self.old_message_cache.get_guild(ctx.guild):
-                await message.edit(content=ctx.author.mention, embed=embed)
+                # The mention is already on the message, only the embed changes.
+                await message.edit(embed=embed)
             else:
                 await ctx.send(content=ctx.author.mention, embed=embed)
             try:
@@ -293,6 +298,20 @@ class Blackjack:
             count = deck.bj_count(dh)
         return dh
 
+    @staticmethod
+    def bj_update(ctx, embed, ph, count):
+        """Patches a hand in progress into its embed: the player's hand, options, and deck size.
+
+        The dealer's hand only shows the hole card until the outcome, so it is left alone.
+        """
+        hand = _("{}\n**Score:** {}")
+        embed.set_field_at(
+            0, name=_("{}'s Hand").format(ctx.author.name), value=hand.format(", ".join(deck.fmt_hand(ph)), count)
+        )
+        embed.set_field_at(2, name="\u200b", value=_("**Options:** hit or stay"), inline=False)
+        embed.set_footer(text=_("Cards in Deck: {}").format(len(deck)))
+        return embed
+
     @staticmethod
     def bj_embed(ctx, ph, dh, count1, initial=False, outcome=None):
         hand = _("{}\n**Score:** {}")
@@ -439,6 +458,7 @@ class Double:
     async def double_game(self, ctx, bet):
         count = 0
         message = None
+        embed = None
         while bet > 0:
             count += 1
 
@@ -453,9 +473,12 @@ class Double:
 
             pred = MessagePredicate.lower_contained_in((_("double"), _("cash out")), ctx=ctx)
 
-            embed = self.double_embed(ctx, count, bet)
+            if embed is None:
+                embed = self.double_embed(ctx, count, bet)
+            else:
+                self.double_update(ctx, embed, count, bet)
             if (not await self.old_message_cache.get_guild(ctx.guild)) and message:
-                await message.edit(content=ctx.author.mention, embed=embed)
+                await message.edit(embed=embed)
             else:
                 message = await ctx.send(ctx.author.mention, embed=embed)
             try:
@@ -479,6 +502,14 @@ class Double:
         embed = self.double_embed(ctx, count, amount, outcome=outcome)
         return result, amount, embed, message
 
+    @staticmethod
+    def double_update(ctx, embed, count, amount):
+        """Patches the new score into a game in progress, the only field that changes between doubles."""
+        embed.set_field_at(
+            0, name=_("{}'s Score").format(ctx.author.name), value=_("{}\n**DOUBLE!:** x{}").format(amount, count)
+        )
+        return embed
+
     @staticmethod
     def double_embed(ctx, count, amount, outcome=None):
         double = _("{}\n**DOUBLE!:** x{}")
@@ -0,0 +1,348 @@
+"""Monte Carlo estimates of the return on each casino game.
+
+Every game is played with the same rules as games.py: blackjack against a dealer
+standing on 17, the single point roll of craps, war ties going to war or
+surrendering, and so on. Cards come from a freshly shuffled deck each round.
+Results are in units of the bet, before the game's multiplier is applied, so one
+simulation covers every multiplier and membership bonus.
+
+NumPy is used when it is installed, otherwise the rounds are played one at a time
+with the random module, which is a lot slower but gives the same statistics.
+
+Usage (from the repo root):
+    python -m casino.simulator --rounds 1000000 --games Blackjack,War
+"""
+# Standard Library
+import argparse
+import json
+import random
+import sys
+import time
+from typing import List, NamedTuple, Optional
+
+# Casino
+from .data import guild_defaults
+from .deck import ACE, BJ_RANK_VALUES, DECK_SIZE
+
+# Third-Party Libraries
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHUNK = 50_000  # rounds simulated per vectorized batch
+MAX_ROUNDS = 5_000_000 if np is not None else 200_000  # per variant, from the simulate command
+BJ_CARDS = 24  # enough cards for the longest possible player and dealer hands
+WAR_CARDS = 7  # two cards, three burned, two more
+
+# Payouts for these games are deposited as is, without the game multiplier or bonus.
+FIXED_PAYOUT = ("Allin", "Double")
+
+VARIANTS = {
+    "Allin": [{"multiplier": 2}, {"multiplier": 5}, {"multiplier": 10}],
+    "Blackjack": [{"stand_on": 17}, {"stand_on": 15}, {"stand_on": 12}],
+    "Coin": [{}],
+    "Craps": [{}],
+    "Cups": [{}],
+    "Dice": [{}],
+    "Double": [{"cash_out": 1}, {"cash_out": 2}, {"cash_out": 3}],
+    "Hilo": [{"choice": "low"}, {"choice": "high"}, {"choice": "seven"}],
+    "War": [{"tie": "war"}, {"tie": "surrender"}],
+}
+
+
+class Outcome(NamedTuple):
+    """Aggregated results of simulating one game variant.
+
+    `payout` is the mean amount won per round in units of the bet (a craps 7 pays 1.5,
+    a hilo seven pays 5), and `refund` is the mean amount handed back on pushes.
+    """
+
+    game: str
+    options: dict
+    rounds: int
+    win_rate: float
+    payout: float
+    refund: float
+    seconds: float
+
+    def expected_return(self, multiplier: Optional[float] = None, bonus: float = 1.0) -> float:
+        """Mean net result per unit bet, -0.05 being a 5% house edge."""
+        if self.game in FIXED_PAYOUT:
+            return self.payout + self.refund - 1
+        return self.payout * multiplier * bonus + self.refund - 1
+
+    def break_even(self, bonus: float = 1.0) -> Optional[float]:
+        """The multiplier at which the game neither gains nor loses money on average."""
+        if self.game in FIXED_PAYOUT or not self.payout:
+            return None
+        return (1 - self.refund) / (self.payout * bonus)
+
+    def describe(self) -> str:
+        return ", ".join("{}={}".format(key, value) for key, value in self.options.items()) or "-"
+
+
+def simulate(game: str, rounds: int, seed: Optional[int] = None, **options) -> Outcome:
+    """Play `rounds` rounds of a game and aggregate the results."""
+    start = time.perf_counter()
+    wins = payout = refund = 0
+    if np is not None:
+        rng = np.random.default_rng(seed)
+        for done in range(0, rounds, CHUNK):
+            won, paid, refunded = NUMPY_GAMES[game](rng, min(CHUNK, rounds - done), **options)
+            wins += int(np.count_nonzero(won))
+            payout += float(paid.sum())
+            refund += float(refunded.sum())
+    else:
+        rng = random.Random(seed)
+        play = PYTHON_GAMES[game]
+        for _ in range(rounds):
+            paid, refunded = play(rng, **options)
+            wins += paid > 0
+            payout += paid
+            refund += refunded
+    return Outcome(
+        game, options, rounds, wins / rounds, payout / rounds, refund / rounds, time.perf_counter() - start
+    )
+
+
+def simulate_variants(game: str, rounds: int, seed: Optional[int] = None) -> List[Outcome]:
+    return [simulate(game, rounds, seed, **options) for options in VARIANTS[game]]
+
+
+# --------------------------------------------------------------------------------------------------
+# Vectorized games, each returns (won, payout, refund) arrays for n rounds.
+
+
+def _np_deal(rng, n, cards):
+    """The rank indexes of the top `cards` cards of n shuffled decks."""
+    return np.argsort(rng.random((n, DECK_SIZE)), axis=1)[:, :cards] % 13
+
+
+def _np_dice(rng, n):
+    return rng.integers(1, 7, n) + rng.integers(1, 7, n)
+
+
+def _np_allin(rng, n, multiplier=2):
+    won = rng.integers(0, multiplier + 2, n) == 0
+    return won, won * float(multiplier), np.zeros(n)
+
+
+def _np_coin(rng, n):
+    won = rng.integers(0, 2, n) == 0
+    return won, won * 1.0, np.zeros(n)
+
+
+def _np_cups(rng, n):
+    won = rng.integers(1, 4, n) == 1
+    return won, won * 1.0, np.zeros(n)
+
+
+def _np_dice_game(rng, n):
+    won = np.isin(_np_dice(rng, n), (2, 7, 11, 12))
+    return won, won * 1.0, np.zeros(n)
+
+
+def _np_hilo(rng, n, choice="low"):
+    result = _np_dice(rng, n)
+    if choice == "low":
+        won = result < 7
+    elif choice == "high":
+        won = result > 7
+    else:
+        won = result == 7
+    return won, won * (5.0 if choice == "seven" else 1.0), np.zeros(n)
+
+
+def _np_craps(rng, n):
+    comeout, point = _np_dice(rng, n), _np_dice(rng, n)
+    established = ~np.isin(comeout, (2, 3, 7, 11, 12))
+    payout = (comeout == 7) * 1.5 + (comeout == 11) + (established & (point == comeout))
+    return payout > 0, payout, np.zeros(n)
+
+
+def _np_double(rng, n, cash_out=1):
+    won = rng.integers(0, 2, (n, cash_out)).all(axis=1)
+    return won, won * float(2 ** cash_out), np.zeros(n)
+
+
+def _np_war(rng, n, tie="war"):
+    cards = _np_deal(rng, n, WAR_CARDS)
+    first, second = cards[:, 0], cards[:, 1]
+    won = first > second
+    if tie == "war":
+        won |= (first == second) & (cards[:, 5] >= cards[:, 6])
+    return won, won * 1.0, np.zeros(n)
+
+
+def _np_blackjack(rng, n, stand_on=17):
+    cards = _np_deal(rng, n, BJ_CARDS)
+    values = np.asarray(BJ_RANK_VALUES)[cards]
+    aces = cards == ACE
+    rows = np.arange(n)
+
+    def count(hard, soft):
+        return np.where(soft & (hard <= 11), hard + 10, hard)
+
+    player, player_ace = values[:, 0] + values[:, 1], aces[:, 0] | aces[:, 1]
+    dealer, dealer_ace = values[:, 2] + values[:, 3], aces[:, 2] | aces[:, 3]
+    natural = count(player, player_ace) == 21
+    position = np.full(n, 4)
+
+    # The player hits until reaching `stand_on`, the dealer then draws to 17.
+    for hard, soft, target in ((player, player_ace, min(stand_on, 21)), (dealer, dealer_ace, 17)):
+        drawing = ~natural & (count(hard, soft) < target)
+        while drawing.any():
+            idx = rows[drawing]
+            hard[idx] += values[idx, position[idx]]
+            soft[idx] |= aces[idx, position[idx]]
+            position[idx] += 1
+            drawing[idx] = count(hard[idx], soft[idx]) < target
+
+    pc, dc = count(player, player_ace), count(dealer, dealer_ace)
+    won = ((dc > 21) & (pc <= 21)) | ((dc < pc) & (pc <= 21))
+    pushed = ~won & (dc == pc) & (pc <= 21)
+    return won, won * 1.0, pushed * 1.0
+
+
+NUMPY_GAMES = {
+    "Allin": _np_allin,
+    "Blackjack": _np_blackjack,
+    "Coin": _np_coin,
+    "Craps": _np_craps,
+    "Cups": _np_cups,
+    "Dice": _np_dice_game,
+    "Double": _np_double,
+    "Hilo": _np_hilo,
+    "War": _np_war,
+}
+
+
+# --------------------------------------------------------------------------------------------------
+# Round by round games, each returns (payout, refund) for a single round.
+
+
+def _py_deal(rng, cards):
+    return [card % 13 for card in rng.sample(range(DECK_SIZE), cards)]
+
+
+def _py_dice(rng):
+    return rng.randint(1, 6) + rng.randint(1, 6)
+
+
+def _py_allin(rng, multiplier=2):
+    return (multiplier if rng.randint(0, multiplier + 1) == 0 else 0), 0
+
+
+def _py_coin(rng):
+    return rng.randint(0, 1), 0
+
+
+def _py_cups(rng):
+    return int(rng.randint(1, 3) == 1), 0
+
+
+def _py_dice_game(rng):
+    return int(_py_dice(rng) in (2, 7, 11, 12)), 0
+
+
+def _py_hilo(rng, choice="low"):
+    result = _py_dice(rng)
+    if choice == "low":
+        return int(result < 7), 0
+    elif choice == "high":
+        return int(result > 7), 0
+    return (5 if result == 7 else 0), 0
+
+
+def _py_craps(rng):
+    comeout = _py_dice(rng)
+    if comeout == 7:
+        return 1.5, 0
+    elif comeout == 11:
+        return 1, 0
+    elif comeout in (2, 3, 12):
+        return 0, 0
+    return int(_py_dice(rng) == comeout), 0
+
+
+def _py_double(rng, cash_out=1):
+    return (2 ** cash_out if all(rng.randint(0, 1) for _ in range(cash_out)) else 0), 0
+
+
+def _py_war(rng, tie="war"):
+    cards = _py_deal(rng, WAR_CARDS)
+    if cards[0] != cards[1]:
+        return int(cards[0] > cards[1]), 0
+    return int(tie == "war" and cards[5] >= cards[6]), 0
+
+
+def _py_blackjack(rng, stand_on=17):
+    cards = iter(_py_deal(rng, BJ_CARDS))
+    player, dealer = [next(cards), next(cards)], [next(cards), next(cards)]
+
+    def count(hand):
+        total = sum(BJ_RANK_VALUES[card] for card in hand)
+        return total + 10 if ACE in hand and total <= 11 else total
+
+    if count(player) != 21:
+        while count(player) < min(stand_on, 21):
+            player.append(next(cards))
+        while count(dealer) < 17:
+            dealer.append(next(cards))
+
+    pc, dc = count(player), count(dealer)
+    if dc > 21 >= pc or dc < pc <= 21:
+        return 1, 0
+    return 0, int(dc == pc <= 21)
+
+
+PYTHON_GAMES = {
+    "Allin": _py_allin,
+    "Blackjack": _py_blackjack,
+    "Coin": _py_coin,
+    "Craps": _py_craps,
+    "Cups": _py_cups,
+    "Dice": _py_dice_game,
+    "Double": _py_double,
+    "Hilo": _py_hilo,
+    "War": _py_war,
+}
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=1_000_000, help="rounds per game variant")
+    parser.add_argument("--games", type=lambda s: [x.title() for x in s.split(",")], default=list(VARIANTS))
+    parser.add_argument("--bonus", type=float, default=1.0, help="membership bonus multiplier")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    args = parser.parse_args(argv)
+
+    results = []
+    for game in args.games:
+        multiplier = guild_defaults["Games"][game]["Multiplier"]
+        for outcome in simulate_variants(game, args.rounds, args.seed):
+            results.append(
+                {
+                    "game": game,
+                    "options": outcome.options,
+                    "rounds": outcome.rounds,
+                    "win_rate": round(outcome.win_rate, 6),
+                    "default_multiplier": multiplier,
+                    "expected_return": round(outcome.expected_return(multiplier, args.bonus), 6),
+                    "break_even_multiplier": outcome.break_even(args.bonus),
+                    "seconds": round(outcome.seconds, 6),
+                    "rounds_per_second": round(outcome.rounds / outcome.seconds, 1),
+                }
+            )
+    report = {"numpy": np is not None, "bonus": args.bonus, "seed": args.seed, "results": results}
+    json.dump(report, args.output, indent=2)
+    args.output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Benchmarks for the markov chain engine, no Discord connection needed.
+
+Builds a synthetic corpus, then times tokenizing, ingesting (what on_message does per
+message), compacting and generating text in natural and forced-length modes for every
+mode/depth combination. Results are printed as JSON. Stored model sizes are reported next to the
+size of the same messages in the old `chains` layout. Compaction is checked to
+honour the transition cap, and the run fails if it doesn't.
+
+Usage (from the repo root):
+    python -m markov.bench --messages 20000 --modes word,chunk3 --depths 1,2,3
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import tracemalloc
+from itertools import accumulate
+from typing import Callable, Dict, List
+
+from .markov import Markov
+from .model import CONTROL_TOKEN, TokenModel
+from .sampler import Sampler
+
+PUNCTUATION = [",", ".", "!", "?", "...", " -", ":)"]
+
+
+def build_corpus(messages: int, vocabulary: int, seed: int) -> List[str]:
+    """Zipf-distributed words in sentences of 3-25 words, with some punctuation."""
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = ["".join(rng.choices(letters, k=rng.randint(2, 9))) for _ in range(vocabulary)]
+    cumulative = list(accumulate(1 / rank for rank in range(1, vocabulary + 1)))
+
+    corpus = []
+    for _ in range(messages):
+        parts = []
+        for word in rng.choices(words, cum_weights=cumulative, k=rng.randint(3, 25)):
+            parts.append(word)
+            if rng.random() < 0.08:
+                parts[-1] += rng.choice(PUNCTUATION)
+        corpus.append(" ".join(parts).capitalize())
+    return corpus
+
+
+def summarize(phase: str, timings: List[float], **extra) -> Dict:
+    timings.sort()
+    seconds = sum(timings)
+    return {
+        "phase": phase,
+        "ops": len(timings),
+        "seconds": round(seconds, 6),
+        "throughput": round(len(timings) / seconds, 1) if seconds else None,
+        "p50_us": round(timings[len(timings) // 2] * 1e6, 2),
+        "p99_us": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1e6, 2),
+        **extra,
+    }
+
+
+def timed(func: Callable, items) -> List[float]:
+    timings = []
+    clock = time.perf_counter
+    for item in items:
+        start = clock()
+        func(item)
+        timings.append(clock() - start)
+    return timings
+
+
+def peak_memory(tokenized: List[List[str]], depth: int) -> int:
+    """Peak bytes allocated while building a model from scratch."""
+    tracemalloc.start()
+    try:
+        model = TokenModel(depth)
+        for tokens in tokenized:
+            model.learn(tokens)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def legacy_bytes(tokenized: List[List[str]], depth: int) -> int:
+    """Bytes the same messages took in the old string-keyed `chains` layout at one depth."""
+    model: Dict[str, Dict[str, int]] = {}
+    for tokens in tokenized:
+        tokens = tokens + [CONTROL_TOKEN]
+        state = CONTROL_TOKEN
+        for idx, gram in enumerate(tokens):
+            weights = model.setdefault(state, {})
+            weights[gram] = weights.get(gram, 0) + 1
+            start = 1 + idx - depth if idx >= depth else 0
+            state = "".join(tokens[start : idx + 1])
+    return len(json.dumps({f"mode-{depth}": model}))
+
+
+def compact_check(model: TokenModel, mode: str, depth: int) -> Dict:
+    """Compact a copy of the model down to half its transitions and check the cap holds.
+
+    Every transition of the synthetic corpus is seen on the same day, so the ranking is
+    full of ties, which is where a cap that keeps everything tied at the cut fails.
+    """
+    copy = TokenModel.from_json(model.to_json())
+    cap = max(1, model.transitions // 2)
+    start = time.perf_counter()
+    for _ in copy.compact(len(copy.states), cap):
+        pass
+    elapsed = time.perf_counter() - start
+    kept = sum(map(len, copy.grams))
+    if kept > cap:
+        raise AssertionError(f"compaction kept {kept} transitions with a cap of {cap} ({mode}, depth {depth})")
+    return summarize("compact", [elapsed], mode=mode, depth=depth, cap=cap, transitions=kept)
+
+
+async def run(args) -> Dict:
+    #the engine methods never touch Config or the bot, so skip Cog initialisation
+    cog = Markov.__new__(Markov)
+    corpus = build_corpus(args.messages, args.vocabulary, args.seed)
+    random.seed(args.seed)
+    results = []
+
+    for mode in args.modes:
+        def tokenize(content: str, mode=mode):
+            return cog._tokenize(content.replace("`", "").strip(), cog._get_tokenizer(mode))
+
+        timings = timed(tokenize, corpus)
+        results.append(summarize("tokenize", timings, mode=mode))
+        tokenized = [tokens for tokens in map(tokenize, corpus) if tokens]
+
+        for depth in args.depths:
+            model = TokenModel(depth)
+            sampler = Sampler(model)
+            timings = timed(lambda tokens: model.learn(tokens, sampler.touched), tokenized)
+            stored = len(json.dumps(model.to_json()))
+            legacy = legacy_bytes(tokenized, depth)
+            results.append(summarize(
+                "ingest", timings, mode=mode, depth=depth, states=len(model.states),
+                transitions=model.transitions, stored_bytes=stored, legacy_bytes=legacy,
+                stored_ratio=round(stored / legacy, 3),
+                peak_bytes=None if args.no_memory else peak_memory(tokenized, depth),
+            ))
+
+            results.append(compact_check(model, mode, depth))
+
+            for phase, length in (("generate", None), ("generate_forced", args.forced_length)):
+                timings = []
+                for _ in range(args.samples):
+                    start = time.perf_counter()
+                    await cog.generate_text(sampler, depth, mode, forced_length=length)
+                    timings.append(time.perf_counter() - start)
+                results.append(summarize(phase, timings, mode=mode, depth=depth))
+
+    return {"config": {key: value for key, value in vars(args).items() if key != "output"}, "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10_000, help="synthetic messages to ingest")
+    parser.add_argument("--vocabulary", type=int, default=5_000, help="distinct words in the corpus")
+    parser.add_argument("--modes", type=lambda s: s.split(","), default=["word", "chunk3"])
+    parser.add_argument("--depths", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 3])
+    parser.add_argument("--samples", type=int, default=500, help="generations per mode/depth")
+    parser.add_argument("--forced-length", type=int, default=25)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    json.dump(report, args.output, indent=2)
+    args.output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from functools import partial
+from typing import Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from redbot.core import Config
+
+from .model import MULTI_ORDER_FORMAT, LegacyModel, State, TokenModel
+from .sampler import BlendedSampler, Sampler
+
+log = logging.getLogger("red.cbd-cogs.markov")
+
+Chains = Dict[str, TokenModel]  # mode -> model
+
+#budget is counted in stored transitions, they dominate the footprint of a model
+DEFAULT_BUDGET = 500_000
+DEFAULT_FLUSH_INTERVAL = 120
+MAX_BLENDS = 16
+
+
+class UserSettings(NamedTuple):
+    enabled: bool
+    depth: int
+    mode: str
+
+
+class SettingsCache:
+    """In-memory copy of the settings the listener checks for every message.
+
+    Guild channel allowlists and the set of enabled users are loaded up front, so
+    messages from anyone else are rejected without touching Config. Depth and mode
+    are read the first time an enabled user is seen. All writes go through here.
+    """
+
+    def __init__(self, config: Config):
+        self._config = config
+        self._channels: Dict[int, Set[int]] = {}
+        self._enabled: Set[int] = set()
+        self._users: Dict[int, UserSettings] = {}
+
+    async def load(self):
+        all_guilds = await self._config.all_guilds()
+        self._channels = {guild_id: set(data["channels"]) for guild_id, data in all_guilds.items() if data["channels"]}
+
+        if not await self._config.enabled_indexed():
+            #one-off scan so the enabled set can be kept in a single global value from now on
+            all_users = await self._config.all_users()
+            await self._config.enabled_users.set([user_id for user_id, data in all_users.items() if data["enabled"]])
+            await self._config.enabled_indexed.set(True)
+        self._enabled = set(await self._config.enabled_users())
+
+    def channel_allowed(self, guild_id: int, channel_id: int) -> bool:
+        channels = self._channels.get(guild_id)
+        return not channels or channel_id in channels
+
+    def channels(self, guild_id: int) -> Set[int]:
+        return set(self._channels.get(guild_id, ()))
+
+    def is_enabled(self, user_id: int) -> bool:
+        return user_id in self._enabled
+
+    def enabled(self) -> Set[int]:
+        return set(self._enabled)
+
+    async def user(self, user_id: int) -> UserSettings:
+        settings = self._users.get(user_id)
+        if settings is None:
+            user_config = self._config.user_from_id(user_id)
+            settings = self._users[user_id] = UserSettings(
+                enabled=user_id in self._enabled,
+                depth=await user_config.chain_depth() or 1,
+                mode=(await user_config.mode() or "word").lower(),
+            )
+        return settings
+
+    async def set_enabled(self, user_id: int, enabled: bool):
+        await self._config.user_from_id(user_id).enabled.set(enabled)
+        if enabled:
+            self._enabled.add(user_id)
+        else:
+            self._enabled.discard(user_id)
+        await self._config.enabled_users.set(list(self._enabled))
+        self._users.pop(user_id, None)
+
+    async def set_depth(self, user_id: int, depth: int):
+        await self._config.user_from_id(user_id).chain_depth.set(depth)
+        self._users.pop(user_id, None)
+
+    async def set_mode(self, user_id: int, mode: str):
+        await self._config.user_from_id(user_id).mode.set(mode)
+        self._users.pop(user_id, None)
+
+    async def set_channels(self, guild_id: int, channels: Iterable[int]):
+        channels = set(channels)
+        await self._config.guild_from_id(guild_id).channels.set(list(channels))
+        if channels:
+            self._channels[guild_id] = channels
+        else:
+            self._channels.pop(guild_id, None)
+
+
+class ChainCache:
+    """Per-user chain cache with write-behind persistence.
+
+    Chains are loaded from Config the first time a user is seen (converting any
+    models still in an older layout), mutated in place by the listener,
+    and written back on a timer, on eviction or at unload.
+    Least recently used users are evicted once the transition budget is exceeded.
+    """
+
+    def __init__(self, config: Config, budget: int = DEFAULT_BUDGET, flush_interval: int = DEFAULT_FLUSH_INTERVAL):
+        self._config = config
+        self.budget = budget
+        self.flush_interval = flush_interval
+        self._chains: "OrderedDict[int, Chains]" = OrderedDict()
+        self._weights: Dict[int, int] = {}
+        self._total = 0
+        self._dirty: Set[int] = set()
+        self._samplers: Dict[int, Dict[str, Sampler]] = {}
+        self._blends: "OrderedDict[Tuple[str, FrozenSet[int]], BlendedSampler]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._evicting: Set[int] = set()
+        self._compacting: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def get(self, user_id: int, keep: Iterable[int] = ()) -> Chains:
+        """Return the live chains for a user, loading them on first access.
+
+        Loading may evict other users to stay within budget, but never the users in `keep`.
+        """
+        chains = self._chains.get(user_id)
+        if chains is not None:
+            self._chains.move_to_end(user_id)
+            return chains
+
+        pending = self._loading.get(user_id)
+        if pending is not None:
+            return await pending
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        try:
+            chains = await self._load(user_id)
+        except Exception as e:
+            future.set_exception(e)
+            #nobody else may be waiting on it
+            future.exception()
+            raise
+        finally:
+            del self._loading[user_id]
+
+        self._chains[user_id] = chains
+        self._reweigh(user_id, chains)
+        future.set_result(chains)
+        await self._evict(keep={user_id, *keep})
+        return chains
+
+    async def sampler(self, user_id: int, mode: str) -> Optional[Sampler]:
+        """Return the compiled sampler for one of a user's models, building it if needed."""
+        model = (await self.get(user_id)).get(mode)
+        if not model:
+            return None
+        samplers = self._samplers.setdefault(user_id, {})
+        sampler = samplers.get(mode)
+        if sampler is None or sampler.model is not model:
+            sampler = samplers[mode] = Sampler(model)
+        return sampler
+
+    async def blend(self, user_ids: Iterable[int], mode: str) -> Optional[BlendedSampler]:
+        """Return a sampler over several users' models, reusing the cached blend when it is current."""
+        members = frozenset(user_ids)
+        models = []
+        for user_id in sorted(members):
+            #loading one member must not evict another, or the blend would never stay cached
+            model = (await self.get(user_id, keep=members)).get(mode)
+            if model:
+                models.append(model)
+        if not models:
+            return None
+
+        key = (mode, members)
+        blend = self._blends.get(key)
+        if blend is None or len(blend.models) != len(models) or any(a is not b for a, b in zip(blend.models, models)):
+            blend = self._blends[key] = BlendedSampler(models)
+            if len(self._blends) > MAX_BLENDS:
+                self._blends.popitem(last=False)
+        self._blends.move_to_end(key)
+        return blend
+
+    def touched(self, user_id: int, mode: str) -> Optional[Callable[[State], None]]:
+        """Return a callback that drops compiled rows depending on one of a user's models."""
+        model = self._chains.get(user_id, {}).get(mode)
+        callbacks = []
+        sampler = self._samplers.get(user_id, {}).get(mode)
+        if sampler is not None and sampler.model is model:
+            callbacks.append(sampler.touched)
+        for (blend_mode, members), blend in self._blends.items():
+            if blend_mode == mode and user_id in members:
+                callbacks.append(partial(blend.touched_in, model))
+
+        if not callbacks:
+            return None
+
+        def touched(state: State):
+            for callback in callbacks:
+                callback(state)
+        return touched
+
+    def loaded(self) -> List[int]:
+        """Ids of the users whose chains are currently in memory."""
+        return list(self._chains)
+
+    async def compact(self, user_id: int, max_states: int, max_transitions: int, prune_days: int, half_life: int):
+        """Compact each of a user's models, yielding to the event loop between chunks.
+
+        Loaded models are compacted in place. Models that aren't loaded are read from Config,
+        compacted and written back, unless the cache saved the user in the meantime.
+        """
+        chains = self._chains.get(user_id)
+        stored = chains is None
+        if stored:
+            self._compacting.add(user_id)
+        try:
+            if stored:
+                chains = await self._load(user_id)
+            changed = False
+            for model in list(chains.values()):
+                before = (model.transitions, len(model.states), len(model.tokens), model.decayed)
+                for _ in model.compact(max_states, max_transitions, prune_days, half_life):
+                    await asyncio.sleep(0)
+                changed = changed or before != (model.transitions, len(model.states), len(model.tokens), model.decayed)
+            if not changed:
+                return
+            if not stored:
+                self._drop_compiled(user_id)
+                self.mark_dirty(user_id)
+            elif user_id in self._compacting and user_id not in self._chains and user_id not in self._loading:
+                self._compacting.discard(user_id)
+                await self._config.user_from_id(user_id).models.set(
+                    {mode: model.to_json() for mode, model in chains.items()}
+                )
+        finally:
+            if stored:
+                self._compacting.discard(user_id)
+
+    def mark_dirty(self, user_id: int):
+        """Flag a user's chains for the next flush."""
+        chains = self._chains.get(user_id)
+        if chains is None:
+            return
+        self._dirty.add(user_id)
+        self._reweigh(user_id, chains)
+
+    async def replace(self, user_id: int, chains: Chains):
+        """Swap a user's chains wholesale and persist them immediately.
+
+        A load already in flight is waited for, so it can't install the old chains over
+        the new ones, and chains still in the old layout are cleared so they are never
+        converted back in.
+        """
+        while user_id in self._loading:
+            try:
+                await self._loading[user_id]
+            except Exception:
+                pass
+        self._forget(user_id)
+        self._chains[user_id] = chains
+        await self._config.user_from_id(user_id).chains.clear()
+        await self.save(user_id)
+
+    async def save(self, user_id: int):
+        """Write one user's chains to Config now."""
+        chains = self._chains.get(user_id)
+        if chains is None:
+            return
+        self._dirty.discard(user_id)
+        #a compaction of the stored copy must not overwrite this
+        self._compacting.discard(user_id)
+        self._reweigh(user_id, chains)
+        await self._config.user_from_id(user_id).models.set(
+            {mode: model.to_json() for mode, model in chains.items()}
+        )
+
+    async def flush(self):
+        """Write every dirty user's chains to Config."""
+        for user_id in list(self._dirty):
+            try:
+                await self.save(user_id)
+            except Exception:
+                log.exception("Failed to persist markov chains for user %s", user_id)
+
+    async def _load(self, user_id: int) -> Chains:
+        user_config = self._config.user_from_id(user_id)
+        stored = await user_config.models()
+        chains = {
+            mode: TokenModel.from_json(data)
+            for mode, data in stored.items()
+            if data.get("format", 1) >= MULTI_ORDER_FORMAT
+        }
+
+        legacy = await user_config.chains()
+        outdated = {model_key: data for model_key, data in stored.items() if model_key not in chains}
+        if legacy or outdated:
+            converted = await asyncio.to_thread(self._convert, outdated, legacy)
+            for mode, model in converted.items():
+                chains.setdefault(mode, model)
+            await user_config.models.set({mode: model.to_json() for mode, model in chains.items()})
+            await user_config.chains.clear()
+            log.info("Converted %s old markov models for user %s", len(outdated) + len(legacy), user_id)
+        return chains
+
+    @staticmethod
+    def _convert(outdated: Dict[str, dict], legacy: Dict[str, LegacyModel]) -> Chains:
+        """Merge old f"{mode}-{depth}" models into one multi-order model per mode."""
+        by_mode: Dict[str, List[Tuple[int, TokenModel]]] = {}
+        for model_key in [*outdated, *legacy]:
+            try:
+                mode, depth = model_key.rsplit("-", 1)
+                depth = int(depth)
+            except ValueError:
+                log.warning("Skipping old markov model with unexpected key '%s'", model_key)
+                continue
+            if model_key in outdated:
+                model = TokenModel.from_json(outdated[model_key])
+            else:
+                model = TokenModel.from_legacy(legacy[model_key], depth)
+            by_mode.setdefault(mode, []).append((depth, model))
+        return {mode: TokenModel.from_depth_models(models) for mode, models in by_mode.items()}
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def _evict(self, keep: Set[int]):
+        while self._total > self.budget:
+            #another eviction may be saving a user already; two must never drop the same one
+            candidates = (user_id for user_id in self._chains if user_id not in keep and user_id not in self._evicting)
+            user_id = next(candidates, None)
+            if user_id is None:
+                return
+            self._evicting.add(user_id)
+            try:
+                if user_id in self._dirty:
+                    await self.save(user_id)
+                #learning while the save was in flight dirties the user again, and makes it recently used
+                if user_id not in self._dirty:
+                    self._forget(user_id)
+            finally:
+                self._evicting.discard(user_id)
+
+    def _forget(self, user_id: int):
+        self._chains.pop(user_id, None)
+        self._dirty.discard(user_id)
+        self._drop_compiled(user_id)
+        self._total -= self._weights.pop(user_id, 0)
+
+    def _drop_compiled(self, user_id: int):
+        self._samplers.pop(user_id, None)
+        for key in [key for key in self._blends if user_id in key[1]]:
+            del self._blends[key]
+
+    def _reweigh(self, user_id: int, chains: Chains):
+        weight = sum(model.transitions for model in chains.values())
+        self._total += weight - self._weights.get(user_id, 0)
+        self._weights[user_id] = weight
@@ -1,26 +1,53 @@
+import asyncio
 import discord
 import logging
-import random
-import re
-from typing import Callable, Dict, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 from redbot.core import checks, Config, commands
 
+from .cache import ChainCache, SettingsCache
+from .model import CONTROL_ID, START_STATE, UNIQUE_ID, State, TokenModel
+from .sampler import Sampler
+from .tokenizer import Tokenizer, get_tokenizer
+
 log = logging.getLogger("red.cbd-cogs.markov")
 
-UNIQUE_ID = 0x6D61726B6F76
-CONTROL_TOKEN = f"{UNIQUE_ID}"
-WORD_TOKENIZER = re.compile(r"(\W+)")
+MAX_BLEND_USERS = 20           # models merged into one blended generation
+
+COMPACT_INTERVAL = 6 * 60 * 60   # seconds between compactions of loaded and enabled users' models
 
-Model = Dict[str, Dict[str, int]]          # state -> (gram -> weight)
-AllUserChains = Dict[str, Model]           # f"{mode}-{depth}" -> model
+BACKFILL_CONCURRENCY = 2       # backfills running at once per guild
+BACKFILL_BATCH = 500           # messages tokenized per worker call
+BACKFILL_CHECKPOINT = 2000     # messages merged and saved at a time
+BACKFILL_PROGRESS = 5000       # scanned messages between progress updates
+
+AllUserChains = Dict[str, TokenModel]      # mode -> model
 class Markov(commands.Cog):
     """A markov-chain-based text generator cog."""
     def __init__(self, bot):
         self.bot = bot
         self.conf = Config.get_conf(self, identifier=UNIQUE_ID, force_registration=True)
-        self.conf.register_user(chains={}, chain_depth=1, mode="word", enabled=False)
+        self.conf.register_user(
+            chains={}, models={}, backfill={}, chain_depth=1, mode="word", enabled=False, max_states=None, max_transitions=None)
         self.conf.register_guild(channels=[])
+        self.conf.register_global(
+            enabled_users=[], enabled_indexed=False, max_states=100_000, max_transitions=400_000, prune_days=90, decay_half_life=0)
+        self.settings = SettingsCache(self.conf)
+        self.chain_cache = ChainCache(self.conf)
+        self._backfill_limits: Dict[int, asyncio.Semaphore] = {}
+        self._backfills: Set[Tuple[int, int]] = set()
+        self._live_channels: Set[Tuple[int, str, int]] = set()
+        self.compaction_task: Optional[asyncio.Task] = None
+
+    async def cog_load(self):
+        await self.settings.load()
+        self.chain_cache.start()
+        self.compaction_task = asyncio.create_task(self._compaction_loop())
+
+    async def cog_unload(self):
+        if self.compaction_task is not None:
+            self.compaction_task.cancel()
+        await self.chain_cache.close()
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
@@ -33,42 +60,35 @@ class Markov(commands.Cog):
         if not message.content[0].isalnum():
             return
 
-        if message.guild is not None:
-            enabled_channels = await self.conf.guild(message.guild).channels()
-            if enabled_channels and message.channel.id not in enabled_channels:
-                return
+        if message.guild is not None and not self.settings.channel_allowed(message.guild.id, message.channel.id):
+            return
+        if not self.settings.is_enabled(message.author.id):
+            return
 
         enabled, chains, depth, mode = await self.get_user_config(message.author)
 															
         if not enabled:
             return
 
-        tokenizer, cleaner = self._get_tokenizer(mode)
+        tokenizer = self._get_tokenizer(mode)
 
         content = message.content.replace("`", "").strip()
         if not content:
             return
 
-        tokens = self._tokenize(content, tokenizer, cleaner)
+        tokens = self._tokenize(content, tokenizer)
         if not tokens:
             return
 
-        model_key = f"{mode}-{depth}"
-        model = chains.get(model_key, {})
-
-        state = CONTROL_TOKEN												
-        tokens.append(CONTROL_TOKEN)
-
-        for idx, gram in enumerate(tokens):
-																
-            next_weights = model.setdefault(state, {})
-            next_weights[gram] = next_weights.get(gram, 0) + 1
+        model = chains.get(mode)
+        if model is None:
+            model = chains[mode] = TokenModel(depth)
+        elif model.order < depth:
+            model.order = depth
 
-            start = 1 + idx - depth if idx >= depth else 0
-            state = "".join(cleaner(x) for x in tokens[start : idx + 1])
-
-        chains[model_key] = model
-        await self.conf.user(message.author).chains.set(chains)
+        model.learn(tokens, self.chain_cache.touched(message.author.id, mode))
+        self.chain_cache.mark_dirty(message.author.id)
+        await self._note_live(message.author.id, mode, message.channel.id, message.id)
 
     @commands.group()
     async def markov(self, ctx: commands.Context):
@@ -96,9 +116,54 @@ class Markov(commands.Cog):
             await ctx.send(f"Sorry, {user} won't let me model their speech")
             return
 
+        sampler = await self.chain_cache.sampler(user.id, mode)
+
+        #try a few times to avoid unlucky dead-ends
+        for attempt in range(1, 5):
+            text = await self.generate_text(sampler, depth, mode, forced_length=length)
+            if text:
+                await ctx.send(text[:2000])
+                return
+
+        await ctx.send("I tried to generate text 4 times and couldn't get anything usable.")
+
+    @commands.guild_only()
+    @markov.command()
+    async def blend(self, ctx: commands.Context, length: Optional[int] = None, *users: discord.Member):
+        """
+        Generate text from several users' models blended together.
+
+        Without any users, the people in this channel who enabled modeling are blended.
+        Your own token mode and depth are used.
+
+        Usage:
+        - ;markov blend
+        - ;markov blend <length 1-50>
+        - ;markov blend <length 1-50> @user @user
+        """
+        if length is not None:
+            length = max(1, min(50, int(length)))
+
+        _, _, depth, mode = await self.get_user_config(ctx.author, lazy=False)
+        candidates = users or ctx.channel.members
+        user_ids = []
+        for member in candidates:
+            if member.bot or member.id in user_ids:
+                continue
+            if self.settings.is_enabled(member.id):
+                user_ids.append(member.id)
+                if len(user_ids) >= MAX_BLEND_USERS:
+                    break
+
+        if not user_ids:
+            await ctx.send("Nobody here lets me model their speech.")
+            return
+
+        sampler = await self.chain_cache.blend(user_ids, mode)
+
         #try a few times to avoid unlucky dead-ends
         for attempt in range(1, 5):
-            text = await self.generate_text(chains, depth, mode, forced_length=length)
+            text = await self.generate_text(sampler, depth, mode, forced_length=length)
             if text:
                 await ctx.send(text[:2000])
                 return
@@ -108,13 +173,13 @@ class Markov(commands.Cog):
     @markov.command()
     async def enable(self, ctx: commands.Context):
         """Allow the bot to model your messages and generate text based on that."""
-        await self.conf.user(ctx.author).enabled.set(True)
+        await self.settings.set_enabled(ctx.author.id, True)
         await ctx.send("Markov modeling enabled!")
 
     @markov.command()
     async def disable(self, ctx: commands.Context):
         """Disallow the bot from modeling your message or generating text based on your models."""
-        await self.conf.user(ctx.author).enabled.set(False)
+        await self.settings.set_enabled(ctx.author.id, False)
         await ctx.send("Markov text generation is now disabled for your user.\n"
             "I will stop updating your language models, but they are still stored.\n"
             "You may want to use `[p]markov reset` to delete them.\n")
@@ -126,14 +191,14 @@ class Markov(commands.Cog):
         - word
         - chunk / chunk5 / chunk10 (etc.)																			  
         """
-        await self.conf.user(ctx.author).mode.set(mode)
+        await self.settings.set_mode(ctx.author.id, mode)
         await ctx.send(f"Token mode set to '{mode}'.")
 
     @markov.command()
     async def depth(self, ctx: commands.Context, depth: int):
         """Set the modeling depth (the 'n' in 'ngrams')."""
         depth = max(1, min(10, int(depth)))  # small sanity clamp
-        await self.conf.user(ctx.author).chain_depth.set(depth)
+        await self.settings.set_depth(ctx.author.id, depth)
         await ctx.send(f"Ngram modeling depth set to {depth}.")
 
     @markov.command()
@@ -141,7 +206,7 @@ class Markov(commands.Cog):
         """Show your current settings and models, or those of another user."""
         user = user or ctx.author
         enabled, chains, depth, mode = await self.get_user_config(user, lazy=False)
-        models = "\n".join(chains.keys()) if chains else "(none)"
+        models = "\n".join(f"{name} (depth 1-{model.order})" for name, model in chains.items()) if chains else "(none)"
         await ctx.send(f"**Enabled:** {enabled}\n"
             f"**Chain Depth:** {depth}\n"
             f"**Token Mode:** {mode}\n"
@@ -149,11 +214,12 @@ class Markov(commands.Cog):
 
     @markov.command()
     async def delete(self, ctx: commands.Context, model: str):
-        """Delete a specific model from your profile (e.g. 'word-2', 'chunk5-3')."""
-        chains = await self.conf.user(ctx.author).chains() or {}
+        """Delete a specific model from your profile (e.g. 'word', 'chunk5')."""
+        chains = await self.chain_cache.get(ctx.author.id)
         if model in chains:
             del chains[model]
-            await self.conf.user(ctx.author).chains.set(chains)
+            await self.chain_cache.save(ctx.author.id)
+            await self.conf.user(ctx.author).backfill.clear_raw(model)
             await ctx.send("Deleted model.")
         else:
             await ctx.send("Model not found.")
@@ -161,9 +227,96 @@ class Markov(commands.Cog):
     @markov.command()
     async def reset(self, ctx: commands.Context):
         """Remove all language models from your profile."""
-        await self.conf.user(ctx.author).chains.set({})
+        await self.chain_cache.replace(ctx.author.id, {})
+        await self.conf.user(ctx.author).backfill.clear()
+        self._live_channels = {key for key in self._live_channels if key[0] != ctx.author.id}
         await ctx.send("All models deleted.")
 
+    @commands.guild_only()
+    @markov.command()
+    async def backfill(self, ctx: commands.Context):
+        """Learn from your past messages in this server's modeled channels.
+
+        Progress is saved as it goes, so running it again resumes where it stopped.
+        """
+        enabled, chains, depth, mode = await self.get_user_config(ctx.author)
+        if not enabled:
+            await ctx.send("You need to `enable` markov modeling first.")
+            return
+
+        channels = [ctx.guild.get_channel(channel_id) for channel_id in self.settings.channels(ctx.guild.id)]
+        channels = [channel for channel in channels if isinstance(channel, discord.TextChannel)]
+        if not channels:
+            await ctx.send("No channels are enabled for modeling here. An admin can add some with `channelmode`.")
+            return
+
+        key = (ctx.guild.id, ctx.author.id)
+        if key in self._backfills:
+            await ctx.send("Your backfill is already running.")
+            return
+
+        limit = self._backfill_limits.setdefault(ctx.guild.id, asyncio.Semaphore(BACKFILL_CONCURRENCY))
+        if limit.locked():
+            await ctx.send("Other backfills are running on this server, yours will start when one finishes.")
+
+        self._backfills.add(key)
+        try:
+            async with limit:
+                await self._backfill(ctx, channels, depth, mode)
+        finally:
+            self._backfills.discard(key)
+
+    @checks.is_owner()
+    @markov.group(invoke_without_command=True)
+    async def limits(self, ctx: commands.Context):
+        """Show or configure model size caps, pruning and decay."""
+        settings = await self.conf.all()
+        await ctx.send(f"**Max states per model:** {settings['max_states']}\n"
+            f"**Max transitions per model:** {settings['max_transitions']}\n"
+            f"**Prune single-use transitions after:** {settings['prune_days'] or 'never'} days\n"
+            f"**Count half-life:** {settings['decay_half_life'] or 'no decay'} days")
+
+    @limits.command(name="states")
+    async def limits_states(self, ctx: commands.Context, count: int, user: discord.User = None):
+        """Cap the states kept per model, for everyone or for one user (0 resets a user to the default)."""
+        if user is None:
+            await self.conf.max_states.set(max(1, count))
+            await ctx.send(f"Models are now capped at {max(1, count)} states.")
+        else:
+            await self.conf.user(user).max_states.set(max(0, count) or None)
+            await ctx.send(f"State cap for {user} set to {max(0, count) or 'the default'}.")
+
+    @limits.command(name="transitions")
+    async def limits_transitions(self, ctx: commands.Context, count: int, user: discord.User = None):
+        """Cap the transitions kept per model, for everyone or for one user (0 resets a user to the default)."""
+        if user is None:
+            await self.conf.max_transitions.set(max(1, count))
+            await ctx.send(f"Models are now capped at {max(1, count)} transitions.")
+        else:
+            await self.conf.user(user).max_transitions.set(max(0, count) or None)
+            await ctx.send(f"Transition cap for {user} set to {max(0, count) or 'the default'}.")
+
+    @limits.command(name="age")
+    async def limits_age(self, ctx: commands.Context, days: int):
+        """Drop transitions seen only once if they are older than this many days (0 to never prune)."""
+        await self.conf.prune_days.set(max(0, days))
+        await ctx.send(f"Single-use transitions are now pruned after {max(0, days) or 'never'} days.")
+
+    @limits.command(name="decay")
+    async def limits_decay(self, ctx: commands.Context, half_life: int):
+        """Halve counts every this many days so models keep a recent style (0 to disable)."""
+        await self.conf.decay_half_life.set(max(0, half_life))
+        await ctx.send(f"Count half-life set to {max(0, half_life) or 'no decay'} days.")
+
+    @limits.command(name="compact")
+    async def limits_compact(self, ctx: commands.Context, user: discord.User):
+        """Compact a user's models right now."""
+        await self.chain_cache.get(user.id)
+        async with ctx.typing():
+            await self.compact_user(user.id)
+            await self.chain_cache.save(user.id)
+        await ctx.send(f"Compacted the models of {user}.")
+
     @checks.admin_or_permissions(manage_guild=True)
     @commands.guild_only()
     @markov.command()
@@ -174,12 +327,12 @@ class Markov(commands.Cog):
         - disable
         """
         channel = channel or ctx.channel
-        enabled_channels = await self.conf.guild(ctx.guild).channels()
+        enabled_channels = self.settings.channels(ctx.guild.id)
 
         mode_l = mode.lower()
         if mode_l == "enable":
             if channel.id not in enabled_channels:
-                enabled_channels.append(channel.id)
+                enabled_channels.add(channel.id)
                 await ctx.send(f"Modeling enabled for {channel.mention}.")
             else:
                 await ctx.send(f"Modeling already enabled for {channel.mention}.")
@@ -193,14 +346,14 @@ class Markov(commands.Cog):
             await ctx.send("Invalid mode. Please use `enable` or `disable`.")
             return
 
-        await self.conf.guild(ctx.guild).channels.set(enabled_channels)
+        await self.settings.set_channels(ctx.guild.id, enabled_channels)
 
     @checks.admin_or_permissions(manage_guild=True)
     @commands.guild_only()
     @markov.command()
     async def channelstatus(self, ctx: commands.Context):
         """Display the status of all channels in terms of modeling."""
-        enabled_channel_ids = set(await self.conf.guild(ctx.guild).channels())
+        enabled_channel_ids = self.settings.channels(ctx.guild.id)
         enabled_lines = [f"{ch.name}: On" for ch in ctx.guild.text_channels if ch.id in enabled_channel_ids]
 
         status_output = "\n".join(enabled_lines) if enabled_lines else "(none)"
@@ -208,17 +361,126 @@ class Markov(commands.Cog):
 
     async def get_user_config(self, user: discord.abc.User, lazy: bool = True) -> Tuple[bool, AllUserChains, int, str]:
         """Get a user config, optionally short-circuiting if not enabled."""
-        user_config = self.conf.user(user)
-        enabled = await user_config.enabled()
-        if lazy and not enabled:
+        if lazy and not self.settings.is_enabled(user.id):
             return (False,) * 4
 
-        chains: AllUserChains = await user_config.chains() or {}
-        depth = await user_config.chain_depth() or 1
-        mode = (await user_config.mode() or "word").lower()
+        enabled, depth, mode = await self.settings.user(user.id)
+        chains: AllUserChains = await self.chain_cache.get(user.id)
         return enabled, chains, depth, mode
 
-    async def generate_text(self, chains: AllUserChains, depth: int, mode: str, forced_length: Optional[int] = None) -> Optional[str]:
+    async def _backfill(self, ctx: commands.Context, channels: List[discord.TextChannel], depth: int, mode: str):
+        """Walk channel history backwards, learning the author's messages in worker-thread batches."""
+        progress = (await self.conf.user(ctx.author).backfill()).get(mode, {})
+        status = await ctx.send(f"Backfilling your `{mode}` model from {len(channels)} channel(s)...")
+        scanned = learned = 0
+        skipped = []
+
+        for channel in channels:
+            cursor = progress.get(str(channel.id), {})
+            if cursor.get("done"):
+                continue
+
+            if cursor.get("before"):
+                before = discord.Object(id=cursor["before"])
+            elif cursor.get("live_from"):
+                #everything from the first message learned live onwards is in the model already
+                before = discord.Object(id=min(cursor["live_from"], ctx.message.id))
+            else:
+                before = ctx.message
+            pending = TokenModel(depth)
+            batch: List[Tuple[str, int]] = []
+            unsaved = 0
+            done = True
+            try:
+                async for message in channel.history(limit=None, before=before):
+                    scanned += 1
+                    before = message
+                    if message.author.id == ctx.author.id and message.content[:1].isalnum():
+                        batch.append((message.content, int(message.created_at.timestamp() // 86400)))
+
+                    if len(batch) >= BACKFILL_BATCH:
+                        await asyncio.to_thread(self._learn_batch, pending, batch, mode)
+                        learned += len(batch)
+                        unsaved += len(batch)
+                        batch = []
+
+                    if unsaved >= BACKFILL_CHECKPOINT:
+                        await self._commit_backfill(ctx.author, mode, pending, channel, before, done=False)
+                        pending = TokenModel(depth)
+                        unsaved = 0
+
+                    if scanned % BACKFILL_PROGRESS == 0:
+                        await status.edit(content=f"Backfilling {channel.mention}: scanned {scanned} messages, learned {learned}.")
+            except discord.Forbidden:
+                skipped.append(channel.mention)
+                done = False
+
+            if batch:
+                await asyncio.to_thread(self._learn_batch, pending, batch, mode)
+                learned += len(batch)
+            await self._commit_backfill(ctx.author, mode, pending, channel, before, done=done)
+
+        summary = f"Backfill complete: scanned {scanned} messages and learned {learned} of yours."
+        if skipped:
+            summary += f"\nI couldn't read the history of {', '.join(skipped)}."
+        await status.edit(content=summary)
+
+    async def _commit_backfill(
+        self, user: discord.abc.User, mode: str, pending: TokenModel, channel: discord.TextChannel, before: discord.abc.Snowflake, done: bool):
+        """Merge backfilled counts into the live model and save them along with the resume point."""
+        chains = await self.chain_cache.get(user.id)
+        model = chains.get(mode)
+        if model is None:
+            model = chains[mode] = TokenModel(pending.order)
+
+        model.merge(pending, self.chain_cache.touched(user.id, mode))
+        await self.chain_cache.save(user.id)
+        backfill = self.conf.user(user).backfill
+        await backfill.set_raw(mode, str(channel.id), "before", value=before.id)
+        await backfill.set_raw(mode, str(channel.id), "done", value=done)
+
+    async def _note_live(self, user_id: int, mode: str, channel_id: int, message_id: int):
+        """Remember the first message of a channel learned live, so a backfill stops short of it."""
+        key = (user_id, mode, channel_id)
+        if key in self._live_channels:
+            return
+        self._live_channels.add(key)
+        backfill = self.conf.user_from_id(user_id).backfill
+        if await backfill.get_raw(mode, str(channel_id), "live_from", default=None) is None:
+            await backfill.set_raw(mode, str(channel_id), "live_from", value=message_id)
+
+    def _learn_batch(self, model: TokenModel, contents: List[Tuple[str, int]], mode: str):
+        """Tokenize a batch of (content, day) messages into a private model, meant to run in a worker thread."""
+        tokenizer = self._get_tokenizer(mode)
+        for content, day in contents:
+            content = content.replace("`", "").strip()
+            tokens = self._tokenize(content, tokenizer) if content else None
+            if tokens:
+                model.learn(tokens, day=day)
+
+    async def _compaction_loop(self):
+        while True:
+            await asyncio.sleep(COMPACT_INTERVAL)
+            #users that were evicted between runs would otherwise never be compacted
+            for user_id in sorted(set(self.chain_cache.loaded()) | self.settings.enabled()):
+                try:
+                    await self.compact_user(user_id)
+                except Exception:
+                    log.exception("Failed to compact markov models for user %s", user_id)
+
+    async def compact_user(self, user_id: int):
+        """Apply the global pruning settings and the user's (or default) caps to their models."""
+        defaults = await self.conf.all()
+        user_config = self.conf.user_from_id(user_id)
+        await self.chain_cache.compact(
+            user_id,
+            max_states=await user_config.max_states() or defaults["max_states"],
+            max_transitions=await user_config.max_transitions() or defaults["max_transitions"],
+            prune_days=defaults["prune_days"],
+            half_life=defaults["decay_half_life"],
+        )
+
+    async def generate_text(self, sampler: Optional[Sampler], depth: int, mode: str, forced_length: Optional[int] = None) -> Optional[str]:
         """Generate text based on the appropriate model for user settings.
         If forced_length is provided, tries to output exactly that many grams (skipping CONTROL_TOKEN).
         """
@@ -227,31 +489,25 @@ class Markov(commands.Cog):
         if generator is None:
             return f"Sorry, I don't have a text generator for token mode '{mode}'"
 
-        model_key = f"{mode}-{depth}"
-        model = chains.get(model_key)
-        if not model:
+        if sampler is None:
             return "Sorry, I can't find a model to use."
 
         output_parts = []
-        state = CONTROL_TOKEN
+        history: List[int] = [CONTROL_ID]
+        state = START_STATE
 
         if forced_length is None:
             #Natural mode: stop when we hit CONTROL_TOKEN
-            last_gram = ""
-            steps = 0
-            while last_gram.strip() != CONTROL_TOKEN and steps < 500:
-                last_gram = await generator(model, state)
-                output_parts.append(last_gram)
+            while len(history) <= 500:
+                gram, text = await generator(sampler, state)
+                if gram == CONTROL_ID:
+                    break
 
-                steps += 1
-                start = max(0, steps - depth)
-                state = "".join(output_parts[start:steps])
+                output_parts.append(text)
+                history.append(gram)
+                state = tuple(history[-depth:])
 
-            if not output_parts:
-                return None
-
-            #drop trailing control token
-            return "".join(output_parts[:-1]).strip() or None
+            return "".join(output_parts).strip() or None
 
         #Forced-length mode: produce exactly N grams, skipping CONTROL_TOKEN
         target = max(1, min(50, forced_length))
@@ -260,102 +516,70 @@ class Markov(commands.Cog):
 
         #allow extra sampling in case we hit CONTROL_TOKEN or dead-ends
         while produced < target and safety_steps < target * 25:
-            gram = await generator(model, state)
+            gram, text = await generator(sampler, state)
             safety_steps += 1
-            
-            if gram.strip() == CONTROL_TOKEN:
+
+            if gram == CONTROL_ID:
                 #Treat forced boundary as a soft sentence break, pop a cheeky space in there
                 if output_parts and not output_parts[-1].endswith(" "):
                     output_parts.append(" ")
-                state = CONTROL_TOKEN
+                history = [CONTROL_ID]
+                state = START_STATE
                 continue
 
-            output_parts.append(gram)
+            output_parts.append(text)
 
             #only count "words" (tokens containing any alphanumeric), not raw punctuation
             #(had an issue where I was getting 5-10 less per request)
-            if any(ch.isalnum() for ch in gram):
+            if any(ch.isalnum() for ch in text):
                 produced += 1
 
             #maintain state window
-            start = max(0, len(output_parts) - depth)
-            state = "".join(output_parts[start:])
+            history.append(gram)
+            state = tuple(history[-depth:])
 
         text = "".join(output_parts).strip()
         return text or None
 
-    def _get_generator(self, mode: str) -> Optional[Callable[[Model, str], "commands.Coroutine"]]:
+    def _get_generator(self, mode: str) -> Optional[Callable[[Sampler, State], "commands.Coroutine"]]:
         if mode == "word":
             return self.generate_word_gram
         if mode.startswith("chunk"):
             return self.generate_chunk_gram
         return None
 
-    def _get_tokenizer(self, mode: str):
-        """Return (tokenizer_regex, cleaner_callable)."""
-        if mode == "word":
-            return WORD_TOKENIZER, (lambda s: s.strip())
+    def _get_tokenizer(self, mode: str) -> Tokenizer:
+        """Return the cached tokenizer for a token mode."""
+        return get_tokenizer(mode)
 
-        if mode.startswith("chunk"):
-            #mode can be "chunk" or "chunk5", etc.
-            raw_len = mode[5:]  # "" if exactly "chunk"
-            chunk_len = 3 if raw_len == "" else int(raw_len)
-            chunk_len = max(1, min(50, chunk_len))
-            return re.compile(fr"(.{{{chunk_len}}})"), (lambda s: s)
-
-        #fallback: treat as word
-        return WORD_TOKENIZER, (lambda s: s.strip())
-
-    def _tokenize(self, content: str, tokenizer: re.Pattern, cleaner: Callable[[str], str]):
-        """Split then clean, dropping empties."""
-        parts = tokenizer.split(content)
-        tokens = []
-        for part in parts:
-            cleaned = cleaner(part)
-            if cleaned:
-                tokens.append(cleaned)
-        return tokens
-
-    async def generate_word_gram(self, model: Model, state: str) -> str:
+    def _tokenize(self, content: str, tokenizer: Tokenizer) -> List[str]:
+        """Split into cleaned, non-empty tokens."""
+        return tokenizer(content)
+
+    async def generate_word_gram(self, sampler: Sampler, state: State) -> Tuple[int, str]:
         """Generate text for word-mode vectorization."""
-        gram = await self.choose_gram(model, state)
+        gram = await self.choose_gram(sampler, state)
+        text = sampler.tokens[gram]
+        previous = sampler.tokens[state[-1]]
         needs_space = all(
             (
-                state != CONTROL_TOKEN,
-                gram and (gram[-1].isalnum() or gram in "\"([{|"),
-                state and (state[-1] not in "\"([{'/-_"),
+                state[-1] != CONTROL_ID,
+                text and (text[-1].isalnum() or text in "\"([{|"),
+                previous and (previous[-1] not in "\"([{'/-_"),
             )
         )
-        return f"{' ' if needs_space else ''}{gram}"
+        return gram, f"{' ' if needs_space else ''}{text}"
 
-    async def generate_chunk_gram(self, model: Model, state: str) -> str:
+    async def generate_chunk_gram(self, sampler: Sampler, state: State) -> Tuple[int, str]:
         """Generate text for chunk-mode vectorization."""
-        return await self.choose_gram(model, state)
-
-    async def choose_gram(self, model: Model, state: str) -> str:
-        """Choose a next gram based on weighted transitions from a state."""
-        gram = self._choose_from_state(model, state)
-        if gram is not None:					   
-            return gram
-
-        gram = self._choose_from_state(model, state.replace(" ", ""))
-        if gram is not None:
-            return gram
-
-        all_grams = []
-        for transitions in model.values():
-            all_grams.extend(transitions.keys())
-
-        if not all_grams:
-            return CONTROL_TOKEN
-
-        return random.choice(all_grams)
+        gram = await self.choose_gram(sampler, state)
+        return gram, sampler.tokens[gram]
 
-    def _choose_from_state(self, model: Model, state: str) -> Optional[str]:
-        transitions = model.get(state)
-        if not transitions:
-            return None
+    async def choose_gram(self, sampler: Sampler, state: State) -> int:
+        """Choose a next gram id, backing off to shorter contexts when a state is unseen."""
+        for start in range(len(state)):
+            gram = sampler.choose(state[start:])
+            if gram is not None:
+                return gram
 
-        grams = list(transitions.keys())
-        weights = list(transitions.values())
-        return random.choices(population=grams, weights=weights, k=1)[0]
+        return CONTROL_ID
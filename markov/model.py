@@ -0,0 +1,348 @@
+import base64
+import random
+import sys
+import time
+import zlib
+from array import array
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+UNIQUE_ID = 0x6D61726B6F76
+CONTROL_TOKEN = f"{UNIQUE_ID}"
+CONTROL_ID = 0
+START_STATE = (CONTROL_ID,)
+FORMAT_VERSION = 3                         # 2: one model per mode as JSON lists, 3: packed arrays
+MULTI_ORDER_FORMAT = 2                     # first format with one multi-order model per mode
+
+State = Tuple[int, ...]
+LegacyModel = Dict[str, Dict[str, int]]    # state -> (gram -> weight)
+
+COMPACT_CHUNK = 2000                       # rows compacted between yields
+
+
+def current_day() -> int:
+    """Days since the epoch, the resolution transitions are timestamped at."""
+    return int(time.time() // 86400)
+
+
+def _pack(values: array) -> str:
+    """Store an array as its typecode and its little-endian bytes, deflated and base64 encoded."""
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return f"{values.typecode}:{base64.b64encode(zlib.compress(values.tobytes())).decode('ascii')}"
+
+
+def _unpack(data: str) -> array:
+    typecode, encoded = data.split(":", 1)
+    values = array(typecode)
+    values.frombytes(zlib.decompress(base64.b64decode(encoded)))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _split(values: array, lengths: array) -> List[array]:
+    rows, start = [], 0
+    for length in lengths:
+        rows.append(values[start : start + length])
+        start += length
+    return rows
+
+
+class TokenModel:
+    """Markov model over interned tokens.
+
+    Every distinct token is stored once and referenced by its integer id, states are
+    tuples of ids, and each state's transitions live in parallel unsigned int arrays
+    (gram ids, counts, day last seen). Id 0 is reserved for CONTROL_TOKEN.
+
+    One model holds every context length from 1 up to `order`, so `states` is an
+    n-gram trie flattened into a hash table keyed by the context path. Contexts are
+    taken from the message with a leading CONTROL_ID, so message starts are states too.
+    """
+
+    __slots__ = ("order", "tokens", "ids", "states", "grams", "counts", "seen", "decayed", "transitions")
+
+    def __init__(self, order: int = 1):
+        self.order = order
+        self.tokens: List[str] = [CONTROL_TOKEN]
+        self.ids: Dict[str, int] = {CONTROL_TOKEN: CONTROL_ID}
+        self.states: Dict[State, int] = {}  # state -> row
+        self.grams: List[array] = []
+        self.counts: List[array] = []
+        self.seen: List[array] = []
+        self.decayed = current_day()
+        self.transitions = 0
+
+    def intern(self, token: str) -> int:
+        token_id = self.ids.get(token)
+        if token_id is None:
+            token_id = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return token_id
+
+    def add(self, state: State, gram: int, count: int = 1, day: Optional[int] = None) -> bool:
+        """Add `count` to `state -> gram`, returning True if the transition is new."""
+        if day is None:
+            day = current_day()
+        row = self.states.get(state)
+        if row is None:
+            row = self.states[state] = len(self.grams)
+            self.grams.append(array("I"))
+            self.counts.append(array("I"))
+            self.seen.append(array("H"))
+
+        grams = self.grams[row]
+        try:
+            idx = grams.index(gram)
+        except ValueError:
+            grams.append(gram)
+            self.counts[row].append(count)
+            self.seen[row].append(day)
+            self.transitions += 1
+            return True
+        self.counts[row][idx] += count
+        if self.seen[row][idx] < day:
+            self.seen[row][idx] = day
+        return False
+
+    def learn(self, tokens: List[str], touched: Optional[Callable[[State], None]] = None, day: Optional[int] = None):
+        """Count every context of length 1..order in one pass over a tokenized message."""
+        if day is None:
+            day = current_day()
+        history = [CONTROL_ID]
+        for gram in [self.intern(token) for token in tokens] + [CONTROL_ID]:
+            for size in range(1, min(self.order, len(history)) + 1):
+                state = tuple(history[-size:])
+                self.add(state, gram, day=day)
+                if touched is not None:
+                    touched(state)
+            history.append(gram)
+
+    def merge(self, other: "TokenModel", touched: Optional[Callable[[State], None]] = None):
+        """Add every count from another model into this one."""
+        self.order = max(self.order, other.order)
+        ids = [self.intern(token) for token in other.tokens]
+        for state, row in other.states.items():
+            mapped = tuple(ids[x] for x in state)
+            for gram, count, day in zip(other.grams[row], other.counts[row], other.seen[row]):
+                self.add(mapped, ids[gram], count, day)
+            if touched is not None:
+                touched(mapped)
+
+    def compact(
+        self, max_states: int, max_transitions: int, prune_days: int = 0, half_life: int = 0
+    ) -> Iterator[None]:
+        """Decay, prune and cap the model in place.
+
+        Counts are decayed by the half-life (in days) elapsed since the last decay, with
+        stochastic rounding so small counts still fade. Transitions seen once and not
+        for `prune_days` are dropped, then the least used transitions and the longest
+        unused states go until both caps hold, and tokens nothing refers to any more are
+        forgotten. This is a generator that yields between chunks of rows, so the event
+        loop can keep ingesting while a big model shrinks. Token ids change when tokens
+        are forgotten, so compiled samplers of the model must be dropped afterwards.
+        """
+        today = current_day()
+        factor = 1.0
+        if half_life and today > self.decayed:
+            factor = 0.5 ** ((today - self.decayed) / half_life)
+            self.decayed = today
+        cutoff = today - prune_days if prune_days else -1
+
+        rows = list(self.states.values())
+        for n, row in enumerate(rows, 1):
+            keep = []
+            for gram, count, seen in zip(self.grams[row], self.counts[row], self.seen[row]):
+                if factor < 1:
+                    count = int(count * factor + random.random())
+                if count == 0 or (count == 1 and seen < cutoff):
+                    continue
+                keep.append((gram, count, seen))
+            self._set_row(row, keep)
+            if n % COMPACT_CHUNK == 0:
+                yield
+
+        transitions = sum(map(len, self.grams))
+        if transitions > max_transitions:
+            #rank by count then age, ties broken by row and position, and drop exactly the excess
+            ranks = sorted(
+                ((count << 16) | seen, row, idx)
+                for row, (counts, seen_days) in enumerate(zip(self.counts, self.seen))
+                for idx, (count, seen) in enumerate(zip(counts, seen_days))
+            )
+            dropped: Dict[int, Set[int]] = {}
+            for _, row, idx in ranks[: transitions - max_transitions]:
+                dropped.setdefault(row, set()).add(idx)
+            del ranks
+            yield
+            #rows only ever gain transitions at the end, so the positions still hold after yielding
+            for n, (row, gone) in enumerate(dropped.items(), 1):
+                keep = [
+                    transition
+                    for idx, transition in enumerate(zip(self.grams[row], self.counts[row], self.seen[row]))
+                    if idx not in gone
+                ]
+                self._set_row(row, keep)
+                if n % COMPACT_CHUNK == 0:
+                    yield
+
+        doomed = {state for state, row in self.states.items() if not self.grams[row]}
+        live = len(self.states) - len(doomed)
+        if live > max_states:
+            #evict the states that went unused the longest, longer contexts first
+            ranked = sorted(
+                (state for state in self.states if state not in doomed),
+                key=lambda state: (max(self.seen[self.states[state]]), -len(state)),
+            )
+            doomed.update(ranked[: live - max_states])
+        self._drop_states(doomed)
+        #no yield from here on, the ids must be renumbered in one go
+        self._drop_tokens()
+
+    def _set_row(self, row: int, transitions: List[Tuple[int, int, int]]):
+        self.grams[row] = array("I", (gram for gram, _, _ in transitions))
+        self.counts[row] = array("I", (count for _, count, _ in transitions))
+        self.seen[row] = array("H", (seen for _, _, seen in transitions))
+
+    def _drop_states(self, doomed):
+        states, grams, counts, seen = {}, [], [], []
+        for state, row in self.states.items():
+            if state in doomed:
+                continue
+            states[state] = len(grams)
+            grams.append(self.grams[row])
+            counts.append(self.counts[row])
+            seen.append(self.seen[row])
+        self.states, self.grams, self.counts, self.seen = states, grams, counts, seen
+        self.transitions = sum(map(len, grams))
+
+    def _drop_tokens(self):
+        used = {CONTROL_ID}
+        for state in self.states:
+            used.update(state)
+        for grams in self.grams:
+            used.update(grams)
+        if len(used) == len(self.tokens):
+            return
+        #ids are renumbered in their old order, so CONTROL_ID stays 0
+        remap = {old: new for new, old in enumerate(sorted(used))}
+        self.tokens = [self.tokens[old] for old in sorted(used)]
+        self.ids = {token: token_id for token_id, token in enumerate(self.tokens)}
+        self.states = {tuple(remap[x] for x in state): row for state, row in self.states.items()}
+        self.grams = [array("I", (remap[gram] for gram in grams)) for grams in self.grams]
+
+    def total(self, state: State) -> int:
+        """Return the summed counts leaving a state, 0 if it is unseen."""
+        row = self.states.get(state)
+        return 0 if row is None else sum(self.counts[row])
+
+    def row(self, state: State) -> Optional[Tuple[array, array]]:
+        """Return the (gram ids, counts) arrays for a state, if it has been seen."""
+        row = self.states.get(state)
+        if row is None:
+            return None
+        return self.grams[row], self.counts[row]
+
+    def to_json(self) -> dict:
+        """Serialize the model with every state and row flattened into one packed array each.
+
+        Row `n` belongs to the `n`th state, so the lengths of the states and of the rows are
+        enough to split the flat arrays again.
+        """
+        states, state_lengths = array("I"), array("B")
+        for state in self.states:
+            states.extend(state)
+            state_lengths.append(len(state))
+        grams, counts, seen, row_lengths = array("I"), array("I"), array("H"), array("I")
+        for row_grams, row_counts, row_seen in zip(self.grams, self.counts, self.seen):
+            grams.extend(row_grams)
+            counts.extend(row_counts)
+            seen.extend(row_seen)
+            row_lengths.append(len(row_grams))
+        return {
+            "format": FORMAT_VERSION,
+            "order": self.order,
+            "tokens": self.tokens[1:],
+            "states": _pack(states),
+            "state_lengths": _pack(state_lengths),
+            "row_lengths": _pack(row_lengths),
+            "grams": _pack(grams),
+            "counts": _pack(counts),
+            "seen": _pack(seen),
+            "decayed": self.decayed,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "TokenModel":
+        model = cls(data.get("order", 1))
+        for token in data["tokens"]:
+            model.intern(token)
+        if data.get("format", 1) >= 3:
+            states = _split(_unpack(data["states"]), _unpack(data["state_lengths"]))
+            row_lengths = _unpack(data["row_lengths"])
+            model.states = {tuple(state): row for row, state in enumerate(states)}
+            model.grams = _split(_unpack(data["grams"]), row_lengths)
+            model.counts = _split(_unpack(data["counts"]), row_lengths)
+            model.seen = _split(_unpack(data["seen"]), row_lengths)
+            model.decayed = data["decayed"]
+            model.transitions = sum(row_lengths)
+            return model
+
+        for row, state in enumerate(data["states"]):
+            model.states[tuple(state)] = row
+        model.grams = [array("I", grams) for grams in data["grams"]]
+        model.counts = [array("I", counts) for counts in data["counts"]]
+        if "seen" in data:
+            model.seen = [array("H", seen) for seen in data["seen"]]
+            model.decayed = data["decayed"]
+        else:
+            model.seen = [array("H", [model.decayed] * len(grams)) for grams in model.grams]
+        model.transitions = sum(map(len, model.grams))
+        return model
+
+    @classmethod
+    def from_legacy(cls, legacy: LegacyModel, depth: int) -> "TokenModel":
+        """Convert a string-keyed model from the old `chains` layout.
+
+        Old state keys are the grams of the state joined without a separator, so they
+        are rebuilt by walking the chain from the control state and replaying how the
+        listener advanced its window. The first token tuple found for a key wins.
+        The result is a single-depth model; pass it through `from_depth_models`.
+        """
+        model = cls()
+        keys = {CONTROL_TOKEN: START_STATE}
+        queue = deque([(CONTROL_TOKEN, START_STATE)])
+        while queue:
+            key, state = queue.popleft()
+            for gram, count in legacy.get(key, {}).items():
+                gram_id = model.intern(gram)
+                model.add(state, gram_id, count)
+                if gram_id == CONTROL_ID:
+                    continue
+
+                next_state = (gram_id,) if state == START_STATE else (state + (gram_id,))[-depth:]
+                next_key = "".join(model.tokens[x] for x in next_state)
+                if next_key in legacy and next_key not in keys:
+                    keys[next_key] = next_state
+                    queue.append((next_key, next_state))
+        return model
+
+    @classmethod
+    def from_depth_models(cls, models: List[Tuple[int, "TokenModel"]]) -> "TokenModel":
+        """Build a multi-order model from the old per-depth models of one mode.
+
+        Each depth model only learned the messages seen while the user had that depth set,
+        so all of them are kept: the counts of every state of every depth model are added to
+        each suffix of that state, which gives the counts for all the shorter contexts too.
+        """
+        model = cls(max(depth for depth, _ in models))
+        for _, source in models:
+            ids = [model.intern(token) for token in source.tokens]
+            for state, row in source.states.items():
+                mapped = tuple(ids[x] for x in state)
+                for start in range(len(mapped)):
+                    for gram, count, day in zip(source.grams[row], source.counts[row], source.seen[row]):
+                        model.add(mapped[start:], ids[gram], count, day)
+        return model
@@ -0,0 +1,95 @@
+import random
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .model import CONTROL_ID, CONTROL_TOKEN, State, TokenModel
+
+Table = Tuple[Sequence[int], List[int]]    # (gram ids, cumulative weights)
+
+#compiled rows are cheap to rebuild, so only keep the most recently compiled ones
+MAX_COMPILED_ROWS = 50_000
+
+
+class Sampler:
+    """Compiled sampling tables for a single model.
+
+    Rows are compiled lazily into (gram ids, cumulative weights) pairs and looked up
+    with bisect. Pass `touched` to `TokenModel.learn` so stale rows are dropped.
+    """
+
+    def __init__(self, model: TokenModel):
+        self.model = model
+        self.tokens = model.tokens
+        self._rows: Dict[State, Table] = {}
+
+    def touched(self, state: State):
+        """Invalidate the compiled row of a state that gained a count."""
+        self._rows.pop(state, None)
+
+    def choose(self, state: State) -> Optional[int]:
+        """Pick a next gram id for `state`, or None if the state is unseen."""
+        row = self._rows.get(state)
+        if row is None:
+            transitions = self.model.row(state)
+            if transitions is None:
+                return None
+            grams, counts = transitions
+            row = self._store(state, (grams, list(accumulate(counts))))
+        return self._pick(row)
+
+    def _store(self, state: State, row: Table) -> Table:
+        if len(self._rows) >= MAX_COMPILED_ROWS:
+            del self._rows[next(iter(self._rows))]
+        self._rows[state] = row
+        return row
+
+    @staticmethod
+    def _pick(row: Table) -> int:
+        grams, cumulative = row
+        return grams[bisect_right(cumulative, random.randrange(cumulative[-1]))]
+
+
+class BlendedSampler(Sampler):
+    """Samples from several models as if they had been merged into one.
+
+    The merged model is never built: a row is merged from the matching rows of every
+    component the first time its state is sampled, then kept until one of the
+    components gains a count for that state. Grams use the blend's own token ids.
+    """
+
+    def __init__(self, models: List[TokenModel]):
+        self.models = models
+        self.tokens: List[str] = [CONTROL_TOKEN]
+        self._ids: Dict[str, int] = {CONTROL_TOKEN: CONTROL_ID}
+        self._rows: Dict[State, Table] = {}
+
+    def touched_in(self, model: TokenModel, state: State):
+        """Invalidate the merged row for a state that gained a count in a component model."""
+        blended = tuple(self._ids.get(model.tokens[x], -1) for x in state)
+        self._rows.pop(blended, None)
+
+    def choose(self, state: State) -> Optional[int]:
+        row = self._rows.get(state)
+        if row is None:
+            tokens = [self.tokens[x] for x in state]
+            merged: Dict[int, int] = {}
+            for model in self.models:
+                mapped = tuple(model.ids.get(token, -1) for token in tokens)
+                transitions = model.row(mapped)
+                if transitions is None:
+                    continue
+                for gram, count in zip(*transitions):
+                    gram = self._intern(model.tokens[gram])
+                    merged[gram] = merged.get(gram, 0) + count
+            if not merged:
+                return None
+            row = self._store(state, (list(merged.keys()), list(accumulate(merged.values()))))
+        return self._pick(row)
+
+    def _intern(self, token: str) -> int:
+        token_id = self._ids.get(token)
+        if token_id is None:
+            token_id = self._ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return token_id
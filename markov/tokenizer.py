@@ -0,0 +1,90 @@
+import string
+from functools import lru_cache, partial
+from typing import Callable, List
+
+Tokenizer = Callable[[str], List[str]]
+
+DEFAULT_CHUNK = 3
+#ascii punctuation that is not a word character, for the "word," fast path
+TRAILING_PUNCTUATION = string.punctuation.replace("_", "")
+
+
+def word_tokens(content: str) -> List[str]:
+    """Split into runs of word characters and runs of everything else, stripped.
+
+    Equivalent to splitting on `(\\W+)` and stripping each part, except that whitespace
+    inside a punctuation run (". . .") is normalised to single spaces. Whitespace
+    separated words are taken whole with `isalnum`, as are words followed by ascii
+    punctuation; only the remaining mixed ones are scanned character by character.
+    """
+    tokens = []
+    glue = False  # the last token is punctuation that ran into whitespace
+    for chunk in content.split():
+        if chunk.isalnum():
+            tokens.append(chunk)
+            glue = False
+            continue
+
+        head = chunk.rstrip(TRAILING_PUNCTUATION)
+        if head.isalnum():
+            tokens.append(head)
+            tokens.append(chunk[len(head):])
+            glue = True
+            continue
+
+        start = 0
+        word = chunk[0].isalnum() or chunk[0] == "_"
+        for idx in range(1, len(chunk)):
+            char = chunk[idx]
+            if (char.isalnum() or char == "_") != word:
+                glue = _emit(tokens, chunk[start:idx], word, glue and start == 0)
+                start = idx
+                word = not word
+        glue = _emit(tokens, chunk[start:], word, glue and start == 0)
+    return tokens
+
+
+def _emit(tokens: List[str], run: str, word: bool, glue: bool) -> bool:
+    if glue and not word:
+        tokens[-1] = f"{tokens[-1]} {run}"
+    else:
+        tokens.append(run)
+    return not word
+
+
+def chunk_tokens(content: str, size: int) -> List[str]:
+    """Split into `size`-character slices within each line.
+
+    Line remainders and the line breaks after them become their own tokens, the same
+    way splitting on `(.{size})` leaves them between matches.
+    """
+    tokens = []
+    pending = ""
+    lines = content.split("\n")
+    for idx, line in enumerate(lines):
+        full = len(line) - len(line) % size
+        if full:
+            if pending:
+                tokens.append(pending)
+            tokens.extend(line[start : start + size] for start in range(0, full, size))
+            pending = line[full:]
+        else:
+            pending += line
+        if idx < len(lines) - 1:
+            pending += "\n"
+    if pending:
+        tokens.append(pending)
+    return tokens
+
+
+@lru_cache(maxsize=64)
+def get_tokenizer(mode: str) -> Tokenizer:
+    """Return the tokenizer for a token mode ("word", "chunk", "chunk5", ...)."""
+    if mode.startswith("chunk"):
+        #mode can be "chunk" or "chunk5", etc.
+        raw_len = mode[5:]
+        chunk_len = DEFAULT_CHUNK if raw_len == "" else int(raw_len)
+        return partial(chunk_tokens, size=max(1, min(50, chunk_len)))
+
+    #"word", and the fallback for anything unknown
+    return word_tokens
@@ -0,0 +1,155 @@
+import random
+from itertools import accumulate
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class WeightedSampler:
+    """Picks the item a random item turns into, weighted on cost.
+
+    Random items, sold out items and items without a cost are never picked. The
+    cumulative weights are computed once, so a pick is a single bisect.
+    """
+
+    __slots__ = ("names", "cum_weights")
+
+    def __init__(self, items: dict):
+        pool = [
+            (name, data["Cost"])
+            for name, data in items.items()
+            if data["Type"] != "random" and data["Qty"] != 0 and data["Cost"] > 0
+        ]
+        self.names: List[str] = [name for name, _ in pool]
+        self.cum_weights: List[int] = list(accumulate(cost for _, cost in pool))
+
+    def choice(self) -> Optional[str]:
+        if not self.names:
+            return None
+        return random.choices(self.names, cum_weights=self.cum_weights)[0]
+
+
+class SamplerCache:
+    """Caches a WeightedSampler per shop, keyed by (scope, shop name).
+
+    The scope is the guild id, or None for the global shop. Entries must be invalidated
+    whenever an item is added, removed, renamed, re-typed, re-priced or sells out. An
+    invalidation also drops the loads in flight for what it invalidates, so a sampler built
+    from data that changed while it was being loaded is used once but never cached.
+    """
+
+    def __init__(self):
+        self._samplers: Dict[Tuple[Hashable, str], WeightedSampler] = {}
+        self._loading: Dict[Tuple[Hashable, str], object] = {}
+
+    async def choice(self, instance, scope: Hashable, shop: str) -> Optional[str]:
+        key = (scope, shop)
+        sampler = self._samplers.get(key)
+        if sampler is None:
+            token = self._loading[key] = object()
+            try:
+                sampler = WeightedSampler(await instance.Shops.get_raw(shop, "Items", default={}))
+            finally:
+                fresh = self._loading.get(key) is token
+                if fresh:
+                    del self._loading[key]
+            if fresh:
+                self._samplers[key] = sampler
+        return sampler.choice()
+
+    def invalidate(self, scope: Hashable, shop: Optional[str] = None) -> None:
+        """Drops the sampler of a shop, or of every shop in the scope when no shop is given."""
+        if shop is None:
+            for cache in (self._samplers, self._loading):
+                for key in [key for key in cache if key[0] == scope]:
+                    del cache[key]
+            return
+        key = (scope, shop)
+        self._samplers.pop(key, None)
+        self._loading.pop(key, None)
+
+    def clear(self) -> None:
+        self._samplers.clear()
+        self._loading.clear()
+
+
+def sort_items(items: dict, sorting: str) -> List[Tuple[str, dict]]:
+    """Sorts (name, data) pairs by name, by price (highest first) or by quantity (infinite first)."""
+    if sorting == "name":
+        return sorted(items.items())
+    elif sorting == "price":
+        return sorted(items.items(), key=lambda x: x[1]["Cost"], reverse=True)
+    else:
+        return sorted(items.items(), key=lambda x: x[1]["Qty"] if x[1]["Qty"] != "--" else float("inf"), reverse=True)
+
+
+class ShopEntry:
+    """A shop's role and items, with its item list sorted once per sorting style."""
+
+    __slots__ = ("role", "items", "_sorted")
+
+    def __init__(self, data: dict):
+        self.role: str = data["Role"]
+        self.items: dict = data["Items"]
+        self._sorted: Dict[str, List[Tuple[str, dict]]] = {}
+
+    def sorted(self, sorting: str) -> List[Tuple[str, dict]]:
+        if sorting not in self._sorted:
+            self._sorted[sorting] = sort_items(self.items, sorting)
+        return self._sorted[sorting]
+
+
+class ShopIndex:
+    """Caches every shop of a scope as a ShopEntry, keyed by scope then shop name.
+
+    A scope is loaded whole on first use. After that, `invalidate` only marks a shop as
+    stale and the next `get` reloads that one shop, so purchases and item edits never
+    cause the whole catalog to be read again. Entries are shared and must not be mutated.
+    Any invalidation of a scope drops its load in flight, so a catalog read while it was
+    changing is used once but never cached.
+    """
+
+    def __init__(self):
+        self._shops: Dict[Hashable, Dict[str, ShopEntry]] = {}
+        self._stale: Dict[Hashable, set] = {}
+        self._loading: Dict[Hashable, object] = {}
+
+    async def get(self, instance, scope: Hashable) -> Dict[str, ShopEntry]:
+        shops = self._shops.get(scope)
+        if shops is None:
+            token = self._loading[scope] = object()
+            try:
+                shops = {name: ShopEntry(data) for name, data in (await instance.Shops.all()).items()}
+            finally:
+                fresh = self._loading.get(scope) is token
+                if fresh:
+                    del self._loading[scope]
+            if not fresh:
+                return shops
+            self._shops[scope] = shops
+            self._stale.pop(scope, None)
+
+        for name in self._stale.pop(scope, ()):
+            try:
+                shops[name] = ShopEntry(await instance.Shops.get_raw(name))
+            except KeyError:
+                shops.pop(name, None)
+        return shops
+
+    def invalidate(self, scope: Hashable, shop: Optional[str] = None) -> None:
+        """Marks a shop as stale, or drops the whole scope when no shop is given."""
+        self._loading.pop(scope, None)
+        if shop is None:
+            self._shops.pop(scope, None)
+            self._stale.pop(scope, None)
+        elif scope in self._shops:
+            self._stale.setdefault(scope, set()).add(shop)
+
+    def clear(self) -> None:
+        self._shops.clear()
+        self._stale.clear()
+        self._loading.clear()
+
+    @staticmethod
+    def visible(shops: Dict[str, ShopEntry], roles: Iterable[str], admin: bool = False) -> List[str]:
+        """Names of the shops that have items and that a member with `roles` may browse."""
+        roles = set(roles)
+        return [name for name, entry in shops.items() if entry.items and (admin or entry.role in roles)]
@@ -1,180 +1,239 @@
-import asyncio
+from functools import partial
+
 import discord
 from tabulate import tabulate
 from redbot.core.utils.chat_formatting import box
 
+PAGE_SIZE = 5
 
-class ShopMenu:
-    def __init__(self, ctx, origin, mode=0, sorting="price"):
+
+class Pages:
+    """Splits a sequence of rows into pages, slicing a page only when it is shown."""
+
+    def __init__(self, rows, size=PAGE_SIZE):
+        self.rows = rows
+        self.size = size
+
+    def __len__(self):
+        return max(1, -(-len(self.rows) // self.size))
+
+    def __getitem__(self, page):
+        if not 0 <= page < len(self):
+            raise IndexError(page)
+        return self.rows[page * self.size : (page + 1) * self.size]
+
+
+class Menu(discord.ui.View):
+    """Base for button driven menus over pages of rows.
+
+    The menu lives on a single message: a button press edits that message in place,
+    and only the command author's presses are accepted. Subclasses provide the rows
+    and the embed, and decide in `select` whether a row opens a sub menu or is the
+    result. `display` returns the result, or raises RuntimeError on exit or timeout.
+    """
+
+    has_parent = False
+    timeout_msg = "No response. Menu exited."
+    exit_msg = "Exited menu."
+
+    def __init__(self, ctx, timeout=35.0):
+        super().__init__(timeout=timeout)
         self.ctx = ctx
+        self.page = 0
+        self.pages = Pages([])
+        self.message = None
+        self.result = None
+        self.exited = False
+
+        self.choices = []
+        for idx in range(PAGE_SIZE):
+            button = discord.ui.Button(
+                label=str(idx + 1), style=discord.ButtonStyle.primary, custom_id=f"shop:menu:{idx + 1}", row=0
+            )
+            button.callback = partial(self.choose, idx)
+            self.choices.append(button)
+            self.add_item(button)
+
+        self.back_btn = discord.ui.Button(label="<", custom_id="shop:menu:back", row=1)
+        self.next_btn = discord.ui.Button(label=">", custom_id="shop:menu:next", row=1)
+        self.prev_btn = discord.ui.Button(label="Previous menu", custom_id="shop:menu:prev", row=1)
+        self.exit_btn = discord.ui.Button(
+            label="Exit", style=discord.ButtonStyle.danger, custom_id="shop:menu:exit", row=1
+        )
+        self.back_btn.callback = partial(self.turn, -1)
+        self.next_btn.callback = partial(self.turn, 1)
+        self.prev_btn.callback = self.parent
+        self.exit_btn.callback = self.exit
+        for button in (self.back_btn, self.next_btn, self.prev_btn, self.exit_btn):
+            self.add_item(button)
+
+    async def display(self):
+        self.load()
+        self.message = await self.ctx.send(self.ctx.author.mention, embed=self.build_menu(), view=self)
+        timed_out = await self.wait()
+        if timed_out:
+            await self.close()
+            await self.ctx.send(self.timeout_msg)
+            raise RuntimeError
+        await self.close()
+        if self.exited:
+            await self.ctx.send(self.exit_msg)
+            raise RuntimeError
+        return self.result
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id == self.ctx.author.id:
+            return True
+        await interaction.response.send_message("This menu isn't for you.", ephemeral=True)
+        return False
+
+    def load(self, page=0):
+        """Re-reads the rows of the current level and syncs the buttons with the page shown."""
+        self.pages = Pages(self.rows())
+        self.page = page
+        self.sync()
+
+    def sync(self):
+        shown = len(self.pages[self.page])
+        for idx, button in enumerate(self.choices):
+            button.disabled = idx >= shown
+        self.back_btn.disabled = self.page <= 0
+        self.next_btn.disabled = self.page >= len(self.pages) - 1
+        self.prev_btn.disabled = not self.has_parent
+
+    async def refresh(self, interaction: discord.Interaction):
+        await interaction.response.edit_message(embed=self.build_menu(), view=self)
+
+    async def choose(self, idx, interaction: discord.Interaction):
+        if await self.select(self.pages[self.page][idx]):
+            self.load()
+            return await self.refresh(interaction)
+        await interaction.response.defer()
+        self.stop()
+
+    async def turn(self, step, interaction: discord.Interaction):
+        self.page = min(max(self.page + step, 0), len(self.pages) - 1)
+        self.sync()
+        await self.refresh(interaction)
+
+    async def parent(self, interaction: discord.Interaction):
+        self.up()
+        self.load()
+        await self.refresh(interaction)
+
+    async def exit(self, interaction: discord.Interaction):
+        self.exited = True
+        await interaction.response.defer()
+        self.stop()
+
+    async def close(self):
+        try:
+            await self.message.delete()
+        except (discord.NotFound, discord.Forbidden):
+            pass
+
+    def footer(self):
+        return "You are viewing page {} of {}.".format(self.page + 1, len(self.pages))
+
+    def rows(self):
+        raise NotImplementedError
+
+    def build_menu(self):
+        raise NotImplementedError
+
+    async def select(self, row) -> bool:
+        """Handles a chosen row. Returns True when it opened a sub menu, False once `result` is set."""
+        raise NotImplementedError
+
+    def up(self):
+        pass
+
+
+class ShopMenu(Menu):
+    """Menu for browsing shops (mode 0) or pending items (mode 1).
+
+    In mode 0, origin maps the shops the author may browse to their ShopEntry. In mode 1,
+    it is the pending data, keyed by user id and then by order id.
+    """
+
+    def __init__(self, ctx, origin, mode=0, sorting="price"):
+        super().__init__(ctx)
         self.origin = origin
+        self.data = origin
         self.shop = None
         self.user = None
-        self.enabled = True
         self.mode = mode
         self.sorting = sorting
 
+    @property
+    def has_parent(self):
+        return self.data is not self.origin
+
     async def display(self):
-        data = self.origin
-        msg, groups, page, maximum = await self.setup(data)
-        try:
-            item = await self.menu_loop(data, groups, page, maximum, msg)
-        except asyncio.TimeoutError:
-            await msg.delete()
-            await self.ctx.send("No response. Menu exited.")
-            raise RuntimeError
-        except MenuExit:
-            await msg.delete()
-            await self.ctx.send("Exited menu.")
-            raise RuntimeError
+        item = await super().display()
+        if self.mode == 0:
+            return self.shop, item
         else:
-            if self.mode == 0:
-                return self.shop, item
-            else:
-                return self.user, item
-
-    async def setup(self, data=None, msg=None):
-        if data is None:
-            data = self.origin
-        if (self.shop is None and self.mode == 0) or (self.user is None and self.mode == 1):
-            data = await self.parse_data(data)
-
-        groups = self.group_data(data)
-        page, maximum = 0, len(groups) - 1
-        e = await self.build_menu(groups, page)
-
-        if msg is None:
-            msg = await self.ctx.send(self.ctx.author.mention, embed=e)
+            return self.user, item
+
+    async def select(self, row):
+        if self.has_parent:
+            self.result = row[0]
+            return False
+        if self.mode == 0:
+            self.shop = row
+            self.data = self.origin[row]
         else:
-            await msg.edit(embed=e)
-        return msg, groups, page, maximum
-
-    async def menu_loop(self, data, groups, page, maximum, msg):
-        while True:
-            check = MenuCheck(self.ctx, groups, page, maximum)
-            choice = await self.ctx.bot.wait_for("message", timeout=35.0, check=check.predicate)
-            if choice.content.isdigit() and int(choice.content) in range(1, len(groups[page]) + 1):
-                selection = groups[page][int(choice.content) - 1]
-                try:
-                    await choice.delete()
-                except (discord.NotFound, discord.Forbidden):
-                    pass
-                if self.mode == 0:
-                    item = await self.next_menu(data, selection, msg)
-                    if not self.enabled:
-                        try:
-                            await msg.delete()
-                        except (discord.NotFound, discord.Forbidden):
-                            pass
-                        return item
-                else:
-                    pending_id = await self.pending_menu(data, selection, msg)
-                    if not self.enabled:
-                        try:
-                            await msg.delete()
-                        except (discord.NotFound, discord.Forbidden):
-                            pass
-                        return pending_id
-            if choice.content.lower() in (">", "n", "next"):
-                page += 1
-            elif choice.content.lower() in ("b", "<", "back"):
-                page -= 1
-            elif choice.content.lower() in ("p", "prev"):
-                if (self.shop and self.mode == 0) or (self.user and self.mode == 1):
-                    try:
-                        await choice.delete()
-                    except (discord.NotFound, discord.Forbidden):
-                        pass
-                    if self.mode == 0:
-                        self.shop = None
-                    else:
-                        self.user = None
-                    break
-                pass
-            elif choice.content.lower() in ("e", "x", "exit"):
-                try:
-                    await choice.delete()
-                except (discord.NotFound, discord.Forbidden):
-                    pass
-                raise MenuExit
-
-            try:
-                await choice.delete()
-            except discord.NotFound:
-                msg, groups, page, maximum = await self.setup(msg=msg)
-            except discord.Forbidden:
-                pass
-            embed = await self.build_menu(groups, page=page)
-            await msg.edit(embed=embed)
-
-    async def parse_data(self, data):
-        if self.shop is None and self.mode == 0:
-            perms = self.ctx.author.guild_permissions.administrator
-            author_roles = [r.name for r in self.ctx.author.roles]
-            return [x for x, y in data.items() if (y["Role"] in author_roles or perms) and y["Items"]]
+            self.user = discord.utils.get(self.ctx.bot.users, id=int(row[0]))
+            self.data = row[1]
+        return True
+
+    def up(self):
+        self.data = self.origin
+        self.shop = self.user = None
+
+    def rows(self):
+        """The rows listed by the current menu, in display order."""
+        if self.mode == 0 and not self.has_parent:
+            return list(self.data)
+        elif self.mode == 0:
+            return self.data.sorted(self.sorting)
         else:
-            try:
-                return list(data.items())
-            except AttributeError:
-                return data
+            return list(self.data.items())
 
-    async def build_menu(self, groups, page):
-        footer = "You are viewing page {} of {}.".format(page + 1 if page > 0 else 1, len(groups))
-        if self.shop is None and self.mode == 0:
-            output = ["{} - {}".format(idx, ele) for idx, ele in enumerate(groups[page], 1)]
+    def build_menu(self):
+        rows = self.pages[self.page]
+        if self.mode == 0 and not self.has_parent:
+            output = ["{} - {}".format(idx, ele) for idx, ele in enumerate(rows, 1)]
         elif self.mode == 0:
             header = f"{'#':<3} {'Name':<29} {'Qty':<7} {'Cost':<8}\n{'--':<3} {'-'*29:<29} {'-'*4:<7} {'-'*8:<8}"
             fmt = [header]
-            for idx, x in enumerate(groups[page], 1):
+            for idx, x in enumerate(rows, 1):
                 line_one = f"{f'{idx}.': <{3}} {x[0]: <{29}s} {x[1]['Qty']:<{8}}{x[1]['Cost']: < {7}}"
                 fmt.append(line_one)
                 fmt.append(f'< {x[1]["Info"][:50]} >' if len(x[1]["Info"]) < 50 else f'< {x[1]["Info"][:47]}... >')
                 fmt.append("",)
             output = box("\n".join(fmt), "md")
-        elif self.mode == 1 and self.user is None:
+        elif self.mode == 1 and not self.has_parent:
             headers = ("#", "User", "Pending Items")
             fmt = [
                 (idx, discord.utils.get(self.ctx.bot.users, id=int(x[0])).name, len(x[1]))
-                for idx, x in enumerate(groups[page], 1)
+                for idx, x in enumerate(rows, 1)
             ]
             output = box(tabulate(fmt, headers=headers, numalign="left"), lang="md")
         elif self.mode == 1:
             headers = ("#", "Item", "Order ID", "Timestamp")
-            fmt = [(idx, x[1]["Item"], x[0], x[1]["Timestamp"]) for idx, x in enumerate(groups[page], 1)]
+            fmt = [(idx, x[1]["Item"], x[0], x[1]["Timestamp"]) for idx, x in enumerate(rows, 1)]
 
             output = box(tabulate(fmt, headers=headers, numalign="left"), lang="md")
         else:
             output = None
-        return self.build_embed(output, footer)
-
-    def sorter(self, groups):
-        if self.sorting == "name":
-            return sorted(groups, key=lambda x: x[0])
-        elif self.sorting == "price":
-            return sorted(groups, key=lambda x: x[1]["Cost"], reverse=True)
-        else:
-            return sorted(groups, key=lambda x: x[1]["Quantity"], reverse=True)
-
-    def group_data(self, data):
-        grouped = []
-        for idx in range(0, len(data), 5):
-            if len(data) > 5:
-                grouped.append(self.sorter(data[idx : idx + 5]))
-            else:
-                if not isinstance(data, dict):
-                    grouped.append(data)
-                else:
-                    grouped.append([self.sorter(data)])
-        return grouped
+        return self.build_embed(output, self.footer())
 
     def build_embed(self, options, footer):
         instructions = (
-            "Type the number for your selection or one of the words below "
-            "for page navigation if there are multiple pages available.\n"
-            "Next page: Type n, next, or >\n"
-            "Previous page: Type b, back, or <\n"
-            "Return to previous menu: Type p or prev\n"
-            "Exit menu system: Type e, x, or exit"
+            "Press the number of your selection. Use < and > to change pages, "
+            "Previous menu to go back, or Exit to close the menu."
         )
 
         if self.shop is None and self.mode == 0:
@@ -190,57 +249,3 @@ class ShopMenu:
         embed.set_footer(text="\n".join([instructions, footer]))
 
         return embed
-
-    async def next_menu(self, data, selection, msg):
-        try:
-            items = data[selection]["Items"]
-        except TypeError:
-            self.enabled = False
-            return selection[0]
-        else:
-            self.shop = selection
-            new_data = await self.parse_data(items)
-            msg, groups, page, maximum = await self.setup(data=new_data, msg=msg)
-            return await self.menu_loop(new_data, groups, page, maximum, msg)
-
-    async def pending_menu(self, data, selection, msg):
-        try:
-            items = data[selection[0]]
-        except TypeError:
-            self.enabled = False
-            return selection[0]
-        else:
-            self.user = discord.utils.get(self.ctx.bot.users, id=int(selection[0]))
-            new_data = await self.parse_data(items)
-            msg, groups, page, maximum = await self.setup(data=new_data, msg=msg)
-            return await self.menu_loop(new_data, groups, page, maximum, msg)
-
-
-class MenuCheck:
-    """Special check class for menu.py"""
-
-    def __init__(self, ctx, data, page, maximum):
-        self.ctx = ctx
-        self.page = page
-        self.maximum = maximum
-        self.data = data
-
-    def predicate(self, m):
-        choices = list(map(str, range(1, len(self.data[self.page]) + 1)))
-        if self.ctx.author == m.author:
-            if m.content in choices:
-                return True
-            elif m.content.lower() in ("exit", "prev", "p", "x", "e"):
-                return True
-            elif m.content.lower() in ("n", ">", "next") and (self.page + 1) <= self.maximum:
-                return True
-            elif m.content.lower() in ("b", "<", "back") and (self.page - 1) >= 0:
-                return True
-            else:
-                return False
-        else:
-            return False
-
-
-class MenuExit(Exception):
-    pass
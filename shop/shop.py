@@ -4,18 +4,21 @@
 import asyncio
 import csv
 import logging
-import random
 import textwrap
 import uuid
-from bisect import bisect
+import weakref
+from contextlib import AsyncExitStack, asynccontextmanager
 from copy import deepcopy
+from functools import partial
 from itertools import zip_longest
-from typing import Literal
+from typing import Literal, Optional
 
 # Shop
+from .cache import SamplerCache, ShopIndex
 from .menu import ShopMenu
 from .inventory import Inventory
 from .checks import Checks
+from .views import Confirm, OfferView
 
 # Discord.py
 import discord
@@ -23,7 +26,7 @@ import discord
 # Red
 from redbot.core import Config, bank, commands
 from redbot.core.utils import AsyncIter
-from redbot.core.utils.chat_formatting import humanize_list
+from redbot.core.utils.chat_formatting import humanize_list, text_to_file
 from redbot.core.data_manager import bundled_data_path
 from redbot.core.errors import BalanceTooHigh
 
@@ -158,12 +161,12 @@ class Shop(commands.Cog):
             instance = await self.get_instance(ctx, settings=True)
         except AttributeError:
             return await ctx.send("You can't use this command in DMs when not in global mode.")
-        if not await instance.Shops():
+        shops = await ItemManager(ctx, instance).shops()
+        if not shops:
             return await ctx.send("No shops have been created yet.")
         if await instance.Settings.Closed():
             return await ctx.send("The shop system is currently closed.")
 
-        shops = await instance.Shops.all()
         col = await self.check_availability(ctx, shops)
         if not col:
             return await ctx.send(
@@ -180,7 +183,7 @@ class Shop(commands.Cog):
 
         else:
             style = await instance.Settings.Sorting()
-            menu = ShopMenu(ctx, shops, sorting=style)
+            menu = ShopMenu(ctx, {name: shops[name] for name in col}, sorting=style)
             try:
                 shop, item = await menu.display()
             except RuntimeError:
@@ -221,7 +224,6 @@ class Shop(commands.Cog):
         Cooldown is a static 60 seconds to prevent abuse.
         Cooldown will trigger regardless of the outcome.
         """
-        cancel = ctx.prefix + "cancel"
         author_instance = await self.get_instance(ctx, user=ctx.author)
         author_inventory = await author_instance.Inventory.all()
         user_instance = await self.get_instance(ctx, user=user)
@@ -236,64 +238,28 @@ class Shop(commands.Cog):
         if 0 < author_inventory[item]["Qty"] < quantity:
             return await ctx.send("You don't have that many {}".format(item))
 
+        offer = OfferView(ctx.author, user, user_inv)
         await ctx.send(
             "{} has requested a trade with {}.\n"
             "They are offering {}x {}.\n Do wish to trade?\n"
-            "*This trade can be canceled at anytime by typing `{}`.*"
-            "".format(ctx.author.mention, user.mention, quantity, item, cancel)
+            "*Either of you can cancel this trade by pressing Decline.*"
+            "".format(ctx.author.mention, user.mention, quantity, item),
+            view=offer,
         )
-
-        def check(m):
-            return (m.author == user and m.content.lower() in ("yes", "no", cancel)) or (
-                m.author == ctx.author and m.content.lower() == cancel
-            )
-
-        try:
-            decision = await ctx.bot.wait_for("message", timeout=25, check=check)
-        except asyncio.TimeoutError:
+        if await offer.wait():
             return await ctx.send("Trade request timed out. Canceled trade.")
-
-        if decision.content.lower() in ("no", cancel):
+        if offer.offer is None:
             return await ctx.send("Trade canceled.")
-        await ctx.send("{} What is your counter offer?\n" '*Example: 3 "Healing Potions"*'.format(user.mention))
-
-        def predicate(m):
-            if m.author in (user, ctx.author) and m.content == cancel:
-                return True
-            if m.author != user:
-                return False
-            try:
-                q, i = [x.strip() for x in m.content.split('"')[:2] if x]
-            except ValueError:
-                return False
-            else:
-                if i not in user_inv:
-                    return False
-                return 0 < user_inv[i]["Qty"] <= int(q)
 
-        try:
-            offer = await ctx.bot.wait_for("message", timeout=25, check=predicate)
-        except asyncio.TimeoutError:
-            return await ctx.send("Trade request timed out. Canceled trade.")
-        if offer.content.lower() == cancel:
-            return await ctx.send("Trade canceled.")
-        qty, item2 = [x.strip() for x in offer.content.split('"')[:2] if x]
-        await ctx.send(
+        qty, item2 = offer.offer
+        final = await Confirm(ctx.author, cancellers=(user,)).ask(
+            ctx,
             "{} Do you wish to trade {}x {} for {}'s {}x {}?"
-            "".format(ctx.author.mention, quantity, item, user.mention, qty, item2)
+            "".format(ctx.author.mention, quantity, item, user.mention, qty, item2),
         )
-
-        def check2(m):
-            return (m.author == ctx.author and m.content.lower() in ("yes", "no", cancel)) or (
-                m.author == user and m.content.lower() == cancel
-            )
-
-        try:
-            final = await ctx.bot.wait_for("message", timeout=25, check=check2)
-        except asyncio.TimeoutError:
+        if final is None:
             return await ctx.send("Trade request timed out. Canceled trade.")
-
-        if final.content.lower() in ("no", cancel):
+        if not final:
             return await ctx.send("Trade canceled.")
 
         sm1 = ShopManager(ctx, instance=None, user_data=author_instance)
@@ -337,6 +303,7 @@ class Shop(commands.Cog):
 
         if choice.content.lower() == "yes":
             await self.config.clear_all()
+            ItemManager.clear()
             msg = "{0.name} ({0.id}) wiped all shop data.".format(ctx.author)
             log.info(msg)
             await ctx.send(msg)
@@ -429,15 +396,15 @@ class Shop(commands.Cog):
             return await ctx.send('Must be a `"Shop Name" "Item Name"` format.')
 
         instance = await self.get_instance(ctx, settings=True)
-        shops = await instance.Shops.all()
+        shops = await ItemManager(ctx, instance).shops()
         if shop not in shops:
             return await ctx.send("Invalid shop name.")
-        elif item not in shops[shop]["Items"]:
+        elif item not in shops[shop].items:
             return await ctx.send("That item in not in the {} shop.".format(shop))
-        elif shops[shop]["Items"][item]["Type"] not in ("basic", "role"):
+        elif shops[shop].items[item]["Type"] not in ("basic", "role"):
             return await ctx.send("You can only give basic or role type items.")
         else:
-            data = deepcopy(shops[shop]["Items"][item])
+            data = deepcopy(shops[shop].items[item])
             user_instance = await self.get_instance(ctx, user=user)
             sm = ShopManager(ctx, None, user_instance)
             await sm.add(item, data, quantity)
@@ -499,7 +466,7 @@ class Shop(commands.Cog):
         """
         instance = await self.get_instance(ctx, settings=True)
         shop = shop_name
-        if shop not in await instance.Shops():
+        if shop not in await ItemManager(ctx, instance).shops():
             return await ctx.send("That shop does not exist.")
         await ctx.send(
             "Are you sure you wish to increase the quantity of all "
@@ -512,13 +479,15 @@ class Shop(commands.Cog):
             return await ctx.send("Response timed out.")
 
         if choice.content.lower() == "yes":
-            async with instance.Shops() as shops:
-                for item in shops[shop]["Items"].values():
-                    if item["Type"] != "auto":
-                        try:
-                            item["Qty"] += amount
-                        except TypeError:
-                            continue
+            im = ItemManager(ctx, instance)
+            async with im.batch(shop) as items:
+                if items is None:
+                    return await ctx.send("That shop does not exist.")
+                for data in items.values():
+                    if data["Type"] != "auto" and data["Qty"] != "--":
+                        data["Qty"] += amount
+                await instance.Shops.set_raw(shop, "Items", value=items)
+            im.invalidate(shop)
             await ctx.send("All items in {} have had their quantities increased by {}.".format(shop, amount))
         else:
             await ctx.send("Restock canceled.")
@@ -526,12 +495,16 @@ class Shop(commands.Cog):
     @shop.command()
     @global_permissions()
     @commands.guild_only()
-    async def bulkadd(self, ctx, style: str, *, entry: str):
+    async def bulkadd(self, ctx, style: str, dry_run: Optional[Literal["--dry-run"]] = None, *, entry: str):
         """Add multiple items and shops.
 
         Bulk accepts two styles: text or a file. If you choose
         file, then the next argument is your file name.
 
+        Pass `--dry-run` before the entry to check the rows and see
+        what would be added without saving anything. Rejected rows
+        are listed in an attached report either way.
+
         Files should be saved in your CogManager/cogs/shop/data path.
 
         If you choose text, then each line will be parsed.
@@ -549,6 +522,8 @@ class Shop(commands.Cog):
         Holy Temple, Divine Training, role, 20, 500, Gives Priest role., Priest
         Junkyard, Mystery Box, random, 20, 500, Random piece of junk.
 
+        [p]shop bulkadd file --dry-run Example
+
         For more information on the parameters visit the shop wiki.
         """
         if style.lower() not in ("file", "text"):
@@ -556,9 +531,9 @@ class Shop(commands.Cog):
 
         msg = await ctx.send("Beginning bulk upload process for shop. This may take a while...")
         instance = await self.get_instance(ctx, settings=True)
-        parser = Parser(ctx, instance, msg)
+        parser = Parser(ctx, instance, msg, dry_run=bool(dry_run))
         if style.lower() == "file":
-            if not ctx.bot.is_owner(ctx.author):
+            if not await ctx.bot.is_owner(ctx.author):
                 return await ctx.send("Only the owner can add items via csv files.")
             fp = bundled_data_path(self) / f"{entry}.csv"
             await parser.search_csv(fp)
@@ -680,18 +655,19 @@ class Shop(commands.Cog):
     async def check_availability(ctx, shops):
         if ctx.guild:
             perms = ctx.author.guild_permissions.administrator
-            author_roles = [r.name for r in ctx.author.roles]
-            return [x for x, y in shops.items() if (y["Role"] in author_roles or perms) and y["Items"]]
+            return ShopIndex.visible(shops, (r.name for r in ctx.author.roles), perms)
 
     @staticmethod
     async def clear_single_pending(ctx, instance, data, item, user):
         item_name = data[str(user.id)][item]["Item"]
-        await ctx.send(
+        choice = await Confirm(ctx.author).ask(
+            ctx,
             "You are about to clear a pending {} for {}.\nAre you sure "
-            "you wish to clear this item?".format(item_name, user.name)
+            "you wish to clear this item?".format(item_name, user.name),
         )
-        choice = await ctx.bot.wait_for("message", timeout=25, check=Checks(ctx).confirm)
-        if choice.content.lower() == "yes":
+        if choice is None:
+            raise asyncio.TimeoutError
+        if choice:
             async with instance.Pending() as p:
                 del p[str(user.id)][item]
                 if not p[str(user.id)]:
@@ -703,9 +679,12 @@ class Shop(commands.Cog):
 
     @staticmethod
     async def clear_all_pending(ctx, instance, user):
-        await ctx.send("You are about to clear all pending items from {}.\nAre you sure you wish to do this?")
-        choice = await ctx.bot.wait_for("message", timeout=25, check=Checks(ctx).confirm)
-        if choice.content.lower() == "yes":
+        choice = await Confirm(ctx.author).ask(
+            ctx, "You are about to clear all pending items from {}.\nAre you sure you wish to do this?"
+        )
+        if choice is None:
+            raise asyncio.TimeoutError
+        if choice:
             async with instance.Pending() as p:
                 del p[user.id]
             await ctx.send("All pending items have been cleared for {}.".format(user.name))
@@ -773,6 +752,7 @@ class Shop(commands.Cog):
 
     async def change_mode(self, mode):
         await self.config.clear_all()
+        ItemManager.clear()
         if mode == "global":
             await self.config.Global.set(True)
 
@@ -780,7 +760,7 @@ class Shop(commands.Cog):
         return await self.config.Global()
 
     async def edit_shop(self, ctx, instance):
-        shops = await instance.Shops.all()
+        shops = await ItemManager(ctx, instance).shops()
         await ctx.send("What shop would you like to edit?")
         name = await ctx.bot.wait_for("message", timeout=25, check=Checks(ctx, custom=shops).content)
 
@@ -791,16 +771,18 @@ class Shop(commands.Cog):
             new_name = await ctx.bot.wait_for("message", timeout=25, check=Checks(ctx, length=25).length_under)
             async with instance.Shops() as shops:
                 shops[new_name.content] = shops.pop(name.content)
+            ItemManager(ctx, instance).invalidate(name.content)
+            ItemManager(ctx, instance).invalidate(new_name.content)
             return await ctx.send("Name changed to {}.".format(new_name.content))
         else:
             await ctx.send("What is the new role for this shop?")
             role = await ctx.bot.wait_for("message", timeout=25, check=Checks(ctx).role)
-            async with instance.Shops() as shops:
-                shops[name.content]["Role"] = role.content
+            await instance.Shops.set_raw(name.content, "Role", value=role.content)
+            ItemManager(ctx, instance).invalidate(name.content)
             await ctx.send("{} is now restricted to only users with the {} role.".format(name.content, role.content))
 
     async def delete_shop(self, ctx, instance):
-        shops = await instance.Shops.all()
+        shops = await ItemManager(ctx, instance).shops()
         await ctx.send("What shop would you like to delete?")
         name = await ctx.bot.wait_for("message", timeout=25, check=Checks(ctx, custom=shops).content)
         await ctx.send("Are you sure you wish to delete {} and all of its items?".format(name.content))
@@ -810,6 +792,7 @@ class Shop(commands.Cog):
             return await ctx.send("Shop deletion canceled.")
         async with instance.Shops() as shops:
             del shops[name.content]
+        ItemManager(ctx, instance).invalidate(name.content)
         await ctx.send("{} was deleted.".format(name.content))
 
     async def create_shop(self, ctx, instance):
@@ -819,7 +802,7 @@ class Shop(commands.Cog):
         if name.content.startswith(ctx.prefix):
             return await ctx.send("Closing shop creation. Please don't run commands while attempting to create a shop.")
 
-        if name.content in await instance.Shops():
+        if name.content in await ItemManager(ctx, instance).shops():
             return await ctx.send("A shop with this name already exists.")
 
         msg = (
@@ -853,6 +836,7 @@ class Shop(commands.Cog):
         role_name = role.content if role.content != "all" else "@everyone"
         async with instance.Shops() as shops:
             shops[name.content] = {"Items": {}, "Role": role_name}
+        ItemManager(ctx, instance).invalidate(name.content)
         await ctx.send(
             "Added {} to the list of shops.\n"
             "**NOTE:** This shop will not show up until an item is added to it's "
@@ -862,27 +846,24 @@ class Shop(commands.Cog):
     async def pending_prompt(self, ctx, instance, data, item):
         e = discord.Embed(color=await ctx.embed_colour())
         e.add_field(name=item, value=data[item]["Info"], inline=False)
-        if data[item]["Type"].lower() == "Role":
-            await ctx.send(
+        if data[item]["Type"].lower() == "role":
+            msg = (
                 "{} Do you wish to redeem {}? This will grant you the role assigned to "
                 "this item and it will be removed from your inventory "
-                "permanently.".format(ctx.author.mention, item),
-                embed=e,
+                "permanently.".format(ctx.author.mention, item)
             )
         else:
-            await ctx.send(
+            msg = (
                 "{} Do you wish to redeem {}? This will add the item to the pending "
                 "list for an admin to review and grant. The item will be removed from "
                 "your inventory while this is "
-                "processing.".format(ctx.author.mention, item),
-                embed=e,
+                "processing.".format(ctx.author.mention, item)
             )
-        try:
-            choice = await ctx.bot.wait_for("message", timeout=25, check=Checks(ctx).confirm)
-        except asyncio.TimeoutError:
+        choice = await Confirm(ctx.author).ask(ctx, msg, embed=e)
+        if choice is None:
             return await ctx.send("No Response. Item redemption canceled.")
 
-        if choice.content.lower() != "yes":
+        if not choice:
             return await ctx.send("Canceled item redemption.")
 
         if data[item]["Type"].lower() == "role":
@@ -900,31 +881,7 @@ class ShopManager:
         self.instance = instance
         self.user_data = user_data
 
-    @staticmethod
-    def weighted_choice(choices):
-        """Stack Overflow: https://stackoverflow.com/a/4322940/6226473"""
-        values, weights = zip(*choices)
-        total = 0
-        cum_weights = []
-        for w in weights:
-            total += w
-            cum_weights.append(total)
-        x = random.random() * total
-        i = bisect(cum_weights, x)
-        return values[i]
-
-    async def random_item(self, shop):
-        async with self.instance.Shops() as shops:
-            try:
-                return self.weighted_choice(
-                    [(x, y["Cost"]) for x, y in shops[shop]["Items"].items() if y["Type"] != "random"]
-                )
-            except IndexError:
-                return
-
-    async def auto_handler(self, shop, item, amount):
-        async with self.instance.Shops() as shops:
-            msgs = [shops[shop]["Items"][item]["Messages"].pop() for _ in range(amount)]
+    async def auto_handler(self, msgs):
         msg = "\n".join(msgs)
         if len(msg) < 2000:
             await self.ctx.author.send(msg)
@@ -934,10 +891,15 @@ class ShopManager:
                 await asyncio.sleep(2)  # At least a little buffer to prevent rate limiting
                 await self.ctx.author.send(chunk)
 
+    async def refund(self, cost):
+        try:
+            await bank.deposit_credits(self.ctx.author, cost)
+        except BalanceTooHigh as e:
+            await bank.set_balance(self.ctx.author, e.max_balance)
+
     async def order(self, shop, item):
         try:
-            async with self.instance.Shops() as shops:
-                item_data = deepcopy(shops[shop]["Items"][item])
+            item_data = await self.instance.Shops.get_raw(shop, "Items", item)
         except KeyError:
             return await self.ctx.send("Could not locate that shop or item.")
 
@@ -982,30 +944,26 @@ class ShopManager:
                 "You cannot afford {}x {} for {} {}. Transaction ended.".format(num.content, item, cost, cur)
             )
         im = ItemManager(self.ctx, self.instance)
-        if _type == "auto":
-            await self.auto_handler(shop, item, amount)
-            await im.remove(shop, item, stock, amount)
-            return await self.ctx.send("Message sent.")
-
         if _type == "random":
-            new_item = await self.random_item(shop)
+            new_item = await im.random_item(shop)
             if new_item is None:
-                try:
-                    await bank.deposit_credits(self.ctx.author, cost)
-                except BalanceTooHigh as e:
-                    await bank.set_balance(self.ctx.author, e.max_balance)
+                await self.refund(cost)
                 return await self.ctx.send(
                     "There aren't any non-random items available in {}, "
                     "so {} cannot be purchased.".format(shop, item)
                 )
-            else:
-                await im.remove(shop, item, stock, amount)
-                item = new_item
-                async with self.instance.Shops() as shops:
-                    item_data = deepcopy(shops[shop]["Items"][new_item])
-                stock = item_data["Qty"]
+            item_data = await im.remove_random(shop, item, new_item, amount)
+        else:
+            item_data = await im.remove(shop, item, amount)
+        if item_data is None:
+            await self.refund(cost)
+            return await self.ctx.send("Sorry, {} sold out before your order went through.".format(item))
+        if _type == "random":
+            item = new_item
+        if _type == "auto":
+            await self.auto_handler(item_data["Messages"])
+            return await self.ctx.send("Message sent.")
 
-        await im.remove(shop, item, stock, amount)
         await self.add(item, item_data, amount)
         await self.ctx.send("{} purchased {}x {} for {} {}.".format(self.ctx.author.mention, amount, item, cost, cur))
 
@@ -1026,10 +984,71 @@ class ShopManager:
 
 
 class ItemManager:
+    # Stock is read and written back per item, so changes to the same item are serialized.
+    # Adding items takes the shop's lock, and rewriting a shop's items at once takes the
+    # shop's lock and then every item lock, always in name order. A lock is only kept while
+    # something holds or waits on it, so deleted, renamed and sold out items leave nothing behind.
+    _locks = weakref.WeakValueDictionary()
+    samplers = SamplerCache()
+    index = ShopIndex()
+
     def __init__(self, ctx, instance):
         self.ctx = ctx
         self.instance = instance
 
+    @property
+    def scope(self):
+        return None if isinstance(self.instance, Config) else self.ctx.guild.id
+
+    def lock(self, shop, item):
+        return self._lock((self.scope, shop, item))
+
+    def shop_lock(self, shop):
+        return self._lock((self.scope, shop))
+
+    def _lock(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def locked(self, shop, items):
+        """Holds the locks of several items of a shop at once."""
+        async with AsyncExitStack() as stack:
+            for item in sorted(set(items)):
+                await stack.enter_async_context(self.lock(shop, item))
+            yield
+
+    @asynccontextmanager
+    async def batch(self, shop):
+        """Locks a whole shop and yields its items, or None if the shop doesn't exist.
+
+        Nothing else can change the items until the block ends, so they can be written
+        back with a single `set_raw`.
+        """
+        async with self.shop_lock(shop):
+            names = await self.instance.Shops.get_raw(shop, "Items", default={})
+            async with self.locked(shop, names):
+                yield await self.instance.Shops.get_raw(shop, "Items", default=None)
+
+    def invalidate(self, shop=None):
+        """Drops the cached sampler and index entry of a shop, or of every shop when none is given."""
+        self.samplers.invalidate(self.scope, shop)
+        self.index.invalidate(self.scope, shop)
+
+    @classmethod
+    def clear(cls):
+        cls.samplers.clear()
+        cls.index.clear()
+
+    async def shops(self):
+        """Every shop in scope, as a ShopEntry keyed by shop name."""
+        return await self.index.get(self.instance, self.scope)
+
+    async def random_item(self, shop):
+        return await self.samplers.choice(self.instance, self.scope, shop)
+
     async def run(self, action):
 
         if action.lower() == "create":
@@ -1061,7 +1080,7 @@ class ItemManager:
         }
 
         msg = "What shop would you like to add this item to?\n"
-        shops = await self.instance.Shops()
+        shops = await self.shops()
         msg += "Current shops are: "
         msg += humanize_list([f"`{shopname}`" for shopname in sorted(shops.keys())])
         await self.ctx.send(msg)
@@ -1070,7 +1089,7 @@ class ItemManager:
         await self.ctx.send("Item creation complete. Check your logs to ensure it went to the approriate shop.")
 
     async def delete(self):
-        shop_list = await self.instance.Shops.all()
+        shop_list = await self.shops()
 
         def predicate(m):
             if self.ctx.author != m.author:
@@ -1083,15 +1102,16 @@ class ItemManager:
         def predicate2(m):
             if self.ctx.author != m.author:
                 return False
-            return m.content in shop_list[shop.content]["Items"]
+            return m.content in shop_list[shop.content].items
 
         await self.ctx.send("What item would you like to delete from this shop?")
         item = await self.ctx.bot.wait_for("message", timeout=25, check=predicate2)
         await self.ctx.send("Are you sure you want to delete {} from {}?".format(item.content, shop.content))
         choice = await self.ctx.bot.wait_for("message", timeout=25, check=Checks(self.ctx).confirm)
         if choice.content.lower() == "yes":
-            async with self.instance.Shops() as shops:
-                del shops[shop.content]["Items"][item.content]
+            async with self.lock(shop.content, item.content):
+                await self.instance.Shops.clear_raw(shop.content, "Items", item.content)
+            self.invalidate(shop.content)
             await self.ctx.send("{} was deleted from the {}.".format(item.content, shop.content))
         else:
             await self.ctx.send("Item deletion canceled.")
@@ -1154,9 +1174,12 @@ class ItemManager:
         msgs = await self.ctx.bot.wait_for("message", timeout=120, check=Checks(self.ctx).same)
         auto_msgs = [x.strip() for x in msgs.content.strip("`").split("\n") if x]
         if item:
-            async with self.instance.Shops() as shops:
-                shops[shop]["Items"][item]["Messages"].extend(auto_msgs)
-                shops[shop]["Items"][item]["Qty"] += len(auto_msgs)
+            async with self.lock(shop, item):
+                msgs = await self.instance.Shops.get_raw(shop, "Items", item, "Messages", default=None) or []
+                msgs.extend(auto_msgs)
+                await self.instance.Shops.set_raw(shop, "Items", item, "Messages", value=msgs)
+                await self.instance.Shops.set_raw(shop, "Items", item, "Qty", value=len(msgs))
+            self.invalidate(shop)
             return await self.ctx.send("{} messages were added to {}.".format(len(auto_msgs), item))
         return auto_msgs
 
@@ -1169,8 +1192,11 @@ class ItemManager:
             return None
 
         if item:
-            async with self.instance.Shops() as shops:
-                shops[shop]["Items"][name.content] = shops[shop]["Items"].pop(item)
+            async with self.shop_lock(shop), self.lock(shop, item):
+                data = await self.instance.Shops.get_raw(shop, "Items", item)
+                await self.instance.Shops.set_raw(shop, "Items", name.content, value=data)
+                await self.instance.Shops.clear_raw(shop, "Items", item)
+            self.invalidate(shop)
             return await self.ctx.send("{}'s name was changed to {}.".format(item, name.content))
         return name.content
 
@@ -1179,8 +1205,8 @@ class ItemManager:
         cost = await self.ctx.bot.wait_for("message", timeout=25, check=Checks(self.ctx).positive)
 
         if item:
-            async with self.instance.Shops() as shops:
-                shops[shop]["Items"][item]["Cost"] = int(cost.content)
+            await self.instance.Shops.set_raw(shop, "Items", item, "Cost", value=int(cost.content))
+            self.invalidate(shop)
             return await self.ctx.send("This item now costs {}.".format(cost.content))
         return int(cost.content)
 
@@ -1200,8 +1226,8 @@ class ItemManager:
         )
         role = await self.ctx.bot.wait_for("message", timeout=25, check=self.hierarchy_check)
         if item:
-            async with self.instance.Shops() as shops:
-                shops[shop]["Items"][item]["Role"] = role.content
+            await self.instance.Shops.set_raw(shop, "Items", item, "Role", value=role.content)
+            self.invalidate(shop)
             return await self.ctx.send("This item now assigns the {} role.".format(role.content))
         return role.content
 
@@ -1219,8 +1245,9 @@ class ItemManager:
         qty = await self.ctx.bot.wait_for("message", timeout=25, check=check)
         qty = int(qty.content) if int(qty.content) > 0 else "--"
         if item:
-            async with self.instance.Shops() as shops:
-                shops[shop]["Items"][item]["Qty"] = qty
+            async with self.lock(shop, item):
+                await self.instance.Shops.set_raw(shop, "Items", item, "Qty", value=qty)
+            self.invalidate(shop)
             return await self.ctx.send(
                 "Quantity for {} now set to {}.".format(item, "infinite." if qty == "--" else qty)
             )
@@ -1249,174 +1276,242 @@ class ItemManager:
                 return "role", role, None
         else:
             if item:
-                async with self.instance.Shops() as shops:
-                    shops[shop]["Items"][item]["Type"] = _type.content.lower()
-                    try:
-                        del shops[shop]["Items"][item]["Messages"]
-                        del shops[shop]["Items"][item]["Role"]
-                    except KeyError:
-                        pass
+                async with self.lock(shop, item):
+                    data = await self.instance.Shops.get_raw(shop, "Items", item)
+                    data["Type"] = _type.content.lower()
+                    data.pop("Messages", None)
+                    data.pop("Role", None)
+                    await self.instance.Shops.set_raw(shop, "Items", item, value=data)
+                self.invalidate(shop)
                 return await self.ctx.send("Item type set to {}.".format(_type.content.lower()))
             return _type.content.lower(), None, None
-        async with self.instance.Shops() as shops:
-            shops[shop]["Items"][item]["Type"] = _type.content.lower()
+        await self.instance.Shops.set_raw(shop, "Items", item, "Type", value=_type.content.lower())
+        self.invalidate(shop)
 
     async def set_info(self, item=None, shop=None):
         await self.ctx.send("Specify the info text for this item.\n*Note* cannot be longer than 500 characters.")
         info = await self.ctx.bot.wait_for("message", timeout=40, check=Checks(self.ctx, length=500).length_under)
         if item:
-            async with self.instance.Shops() as shops:
-                shops[shop]["Items"][item]["Info"] = info.content
-                return await self.ctx.send("Info now set to:\n{}".format(info.content))
+            await self.instance.Shops.set_raw(shop, "Items", item, "Info", value=info.content)
+            self.invalidate(shop)
+            return await self.ctx.send("Info now set to:\n{}".format(info.content))
         return info.content
 
     async def get_item(self):
-        shops = await self.instance.Shops.all()
+        shops = await self.shops()
 
         await self.ctx.send("What shop is the item you would like to edit in?")
         shop = await self.ctx.bot.wait_for("message", timeout=25.0, check=Checks(self.ctx, custom=shops).content)
 
-        items = shops[shop.content]["Items"]
+        items = shops[shop.content].items
         await self.ctx.send("What item would you like to edit?")
         item = await self.ctx.bot.wait_for("message", timeout=25.0, check=Checks(self.ctx, custom=items).content)
 
-        return shop.content, item.content, shops[shop.content]["Items"][item.content]
+        return shop.content, item.content, items[item.content]
 
     async def add(self, data, shop, item, new_allowed=False):
-        async with self.instance.Shops() as shops:
-            if shop not in shops:
+        async with self.shop_lock(shop):
+            try:
+                items = await self.instance.Shops.get_raw(shop, "Items")
+            except KeyError:
                 if new_allowed:
-                    shops[shop] = {"Items": {item: data}, "Role": "@everyone"}
+                    await self.instance.Shops.set_raw(shop, value={"Items": {item: data}, "Role": "@everyone"})
+                    self.invalidate(shop)
                     return log.info("Created the shop: {} and added {}.".format(shop, item))
-                log.error("{} could not be added to {}, because it does not exist.".format(item, shop))
-            elif item in shops[shop]["Items"]:
-                log.error("{} was not added because that item already exists in {}.".format(item, shop))
-            else:
-                shops[shop]["Items"][item] = data
-                log.info("{} added to {}.".format(item, shop))
+                return log.error("{} could not be added to {}, because it does not exist.".format(item, shop))
+            if item in items:
+                return log.error("{} was not added because that item already exists in {}.".format(item, shop))
+            await self.instance.Shops.set_raw(shop, "Items", item, value=data)
+        self.invalidate(shop)
+        log.info("{} added to {}.".format(item, shop))
+
+    async def remove(self, shop, item, amount):
+        """Takes `amount` of an item out of a shop's stock.
+
+        Only the item's own entry is read and written, and the item is deleted once
+        it sells out. Returns the item's data with `Messages` narrowed down to the
+        messages handed out for auto items, or None if there wasn't enough stock left.
+        """
+        async with self.lock(shop, item):
+            return await self._take(shop, item, amount)
 
-    async def remove(self, shop, item, stock, amount):
+    async def remove_random(self, shop, item, picked, amount):
+        """Takes `amount` of a random item and of the item it was picked as, or of neither.
+
+        Returns the picked item's data like `remove`, or None if either ran out first.
+        """
+        async with self.locked(shop, (item, picked)):
+            try:
+                qty = await self.instance.Shops.get_raw(shop, "Items", item, "Qty")
+            except KeyError:
+                return None
+            if qty != "--" and qty < amount:
+                return None
+            data = await self._take(shop, picked, amount)
+            if data is not None:
+                await self._take(shop, item, amount)
+        return data
+
+    async def _take(self, shop, item, amount):
         try:
-            remainder = stock - amount
-            async with self.instance.Shops() as shops:
-                if remainder > 0:
-                    shops[shop]["Items"][item]["Qty"] = remainder
-                else:
-                    del shops[shop]["Items"][item]
-        except TypeError:
-            pass
-        return
+            data = await self.instance.Shops.get_raw(shop, "Items", item)
+        except KeyError:
+            return None
+        if data["Qty"] == "--":
+            return data
+        if data["Qty"] < amount:
+            return None
+
+        remainder = data["Qty"] - amount
+        msgs = data.get("Messages") or []
+        if data["Type"] == "auto":
+            data["Messages"] = [msgs.pop() for _ in range(min(amount, len(msgs)))]
+        if remainder > 0:
+            await self.instance.Shops.set_raw(shop, "Items", item, "Qty", value=remainder)
+            if data["Type"] == "auto":
+                await self.instance.Shops.set_raw(shop, "Items", item, "Messages", value=msgs)
+            self.index.invalidate(self.scope, shop)
+        else:
+            await self.instance.Shops.clear_raw(shop, "Items", item)
+            self.invalidate(shop)
+        return data
 
 
 class Parser:
-    def __init__(self, ctx, instance, msg):
+    keys = ("Shop", "Item", "Type", "Qty", "Cost", "Info", "Role", "Messages")
+
+    def __init__(self, ctx, instance, msg, dry_run=False):
         self.ctx = ctx
         self.instance = instance
         self.msg = msg
+        self.dry_run = dry_run
+        self.errors = []
+        # Rows are validated in a worker thread, so role lookups use a snapshot taken here.
+        self.roles = {r.name: r for r in ctx.guild.roles}
+        self.top_role = ctx.author.top_role
 
     @staticmethod
-    def basic_checks(idx, row):
+    def basic_checks(row):
         if len(row["Shop"]) > 25:
-            log.warning("Row {} was not added because shop name was too long.".format(idx))
-            return False
+            return "shop name was too long"
         elif len(row["Item"]) > 30:
-            log.warning("Row {} was not added because item name was too long.".format(idx))
-            return False
+            return "item name was too long"
         elif not row["Cost"].isdigit() or int(row["Cost"]) < 0:
-            log.warning("Row {} was not added because the cost was lower than 0.".format(idx))
-            return False
+            return "the cost was lower than 0"
         elif not row["Qty"].isdigit() or int(row["Qty"]) < 0:
-            log.warning("Row {} was not added because the quantity was lower than 0.".format(idx))
-            return False
+            return "the quantity was lower than 0"
         elif len(row["Info"]) > 500:
-            log.warning("Row {} was not added because the info was too long.".format(idx))
-            return False
-        else:
-            return True
+            return "the info was too long"
+
+    def type_checks(self, row, messages):
+        _type = row["Type"].lower()
+        if _type not in ("basic", "random", "auto", "role"):
+            return "of an invalid type"
+        elif _type == "role" and not row["Role"]:
+            return "the type is a role, but no role was set"
+        elif _type == "role" and row["Role"] not in self.roles:
+            return "the {} role does not exist on the server".format(row["Role"])
+        elif _type == "role" and self.roles[row["Role"]] > self.top_role:
+            return "the {} role is higher than the shopkeeper's highest role".format(row["Role"])
+        elif _type == "auto" and int(row["Qty"]) == 0:
+            return "auto items cannot have an infinite quantity"
+        elif _type == "auto" and int(row["Qty"]) != len(messages):
+            return "auto items must have an equal number of messages and quantity"
+        elif _type == "auto" and any(len(x) > 2000 for x in messages):
+            return "one of the messages exceeds 2000 characters"
+
+    def validate(self, reader):
+        """Checks every row and groups the valid ones by shop, then by item name.
+
+        Runs in a worker thread. Rejected rows are collected in `errors` as (row, reason).
+        """
+        bulk = {}
+        for idx, row in enumerate(reader, 1):
+            try:
+                messages = [x.strip() for x in (row["Messages"] or "").split(",") if x]
+                error = self.basic_checks(row) or self.type_checks(row, messages)
+            except (AttributeError, KeyError, TypeError, ValueError):
+                error = "the row is missing fields"
+            if error:
+                self.errors.append((idx, error))
+                continue
 
-    def type_checks(self, idx, row, messages):
-        if row["Type"].lower() not in ("basic", "random", "auto", "role"):
-            log.warning("Row {} was not added because of an invalid type.".format(idx))
-            return False
-        elif row["Type"].lower() == "role" and not row["Role"]:
-            log.warning("Row {} was not added because the type is a role, but no role was set.".format(idx))
-            return False
-        elif (
-            row["Type"].lower() == "role" and discord.utils.get(self.ctx.message.guild.roles, name=row["Role"]) is None
-        ):
-            log.warning(
-                "Row {} was not added because the {} role does not exist on the server.".format(idx, row["Role"])
-            )
-            return False
-        elif row["Type"].lower() == "auto" and int(row["Qty"]) == 0:
-            log.warning("Row {} was not added because auto items cannot have an infinite quantity.".format(idx))
-            return False
-        elif row["Type"].lower() == "auto" and int(row["Qty"]) != len(messages):
-            log.warning(
-                "Row {} was not added because auto items must have an equal number of "
-                "messages and quantity.".format(idx)
-            )
-            return False
-        elif row["Type"].lower() == "auto" and any(len(x) > 2000 for x in messages):
-            log.warning("Row {} was not added because one of the messages exceeds 2000 characters.".format(idx))
-            return False
-        elif row["Type"].lower() == "role":
-            if discord.utils.get(self.ctx.message.guild.roles, name=row["Role"]) > self.ctx.author.top_role:
-                log.warning(
-                    "Row {} was not added because the {} role is higher than the "
-                    "shopkeeper's highest role.".format(idx, row["Role"])
-                )
-                return False
+            data = {key: row.get(key) for key in ("Type", "Info", "Role")}
+            data.update(Cost=int(row["Cost"]), Qty=int(row["Qty"]) or "--", Messages=messages)
+            items = bulk.setdefault(row["Shop"], {})
+            if row["Item"] in items:
+                self.errors.append((idx, "the item appears more than once in {}".format(row["Shop"])))
             else:
-                return True
-        else:
-            return True
+                items[row["Item"]] = (idx, data)
+        return bulk
+
+    def read_csv(self, file_path):
+        with file_path.open("rt") as f:
+            return self.validate(csv.DictReader(f, delimiter=","))
+
+    def read_text(self, text):
+        lines = (x.split(",") for x in text.strip("`").split("\n") if x)
+        rows = (dict(zip_longest(self.keys, (f.strip() for f in x))) if 6 <= len(x) <= 8 else {} for x in lines)
+        return self.validate(rows)
 
     async def parse_text_entry(self, text):
-        keys = ("Shop", "Item", "Type", "Qty", "Cost", "Info", "Role", "Messages")
-        raw_data = [
-            [f.strip() for f in y] for y in [x.split(",") for x in text.strip("`").split("\n") if x] if 6 <= len(y) <= 8
-        ]
-        bulk = [{key: value for key, value in zip_longest(keys, x)} for x in raw_data]
+        bulk = await self.ctx.bot.loop.run_in_executor(None, partial(self.read_text, text))
         await self.parse_bulk(bulk)
 
     async def search_csv(self, file_path):
         try:
-            with file_path.open("rt") as f:
-                reader = csv.DictReader(f, delimiter=",")
-                await self.parse_bulk(reader)
+            bulk = await self.ctx.bot.loop.run_in_executor(None, partial(self.read_csv, file_path))
         except FileNotFoundError:
-            await self.msg.edit(content="The specified filename could not be found.")
+            return await self.msg.edit(content="The specified filename could not be found.")
+        await self.parse_bulk(bulk)
 
-    async def parse_bulk(self, reader):
-        if not reader:
-            return await self.msg.edit(content="Data was faulty. No data was added.")
+    async def parse_bulk(self, bulk):
+        """Adds the validated rows with a single write per shop, then reports the results.
 
-        keys = ("Cost", "Qty", "Type", "Info", "Role", "Messages")
-        for idx, row in enumerate(reader, 1):
-            try:
-                messages = [x.strip() for x in row["Messages"].split(",") if x]
-            except AttributeError:
-                messages = []
-
-            if not self.basic_checks(idx, row):
-                continue
-            elif not self.type_checks(idx, row, messages):
-                continue
-            else:
-                data = {
-                    key: row.get(key, None)
-                    if key not in ("Cost", "Qty", "Messages")
-                    else int(row[key])
-                    if key != "Messages"
-                    else messages
-                    for key in keys
-                }
-                if data["Qty"] == 0:
-                    data["Qty"] = "--"
-                item_manager = ItemManager(self.ctx, self.instance)
-                await item_manager.add(data, row["Shop"], row["Item"], new_allowed=True)
-        await self.msg.edit(content="Bulk process finished. Please check your console for more information.")
+        Each shop is locked while its items are merged, so purchases and edits made
+        meanwhile aren't overwritten.
+        """
+        added, shops, created = 0, 0, 0
+        item_manager = ItemManager(self.ctx, self.instance)
+        for shop, rows in bulk.items():
+            async with item_manager.batch(shop) as items:
+                new_items = {}
+                for item, (idx, data) in rows.items():
+                    if items is not None and item in items:
+                        self.errors.append((idx, "that item already exists in {}".format(shop)))
+                    else:
+                        new_items[item] = data
+                if not new_items:
+                    continue
+
+                added, shops, created = added + len(new_items), shops + 1, created + (items is None)
+                if self.dry_run:
+                    continue
+                if items is None:
+                    await self.instance.Shops.set_raw(shop, value={"Items": new_items, "Role": "@everyone"})
+                    log.info("Created the shop: {}.".format(shop))
+                else:
+                    items.update(new_items)
+                    await self.instance.Shops.set_raw(shop, "Items", value=items)
+            item_manager.invalidate(shop)
+            log.info("{} items added to {}.".format(len(new_items), shop))
+        await self.report(added, shops, created)
+
+    async def report(self, added, shops, created):
+        self.errors.sort()
+        for idx, error in self.errors:
+            log.warning("Row {} was not added because {}.".format(idx, error))
+        summary = "{} {} item(s) to {} shop(s), {} of them new. {} row(s) were rejected.".format(
+            "Dry run finished, nothing was saved. Bulk upload would add" if self.dry_run else "Bulk upload added",
+            added,
+            shops,
+            created,
+            len(self.errors),
+        )
+        await self.msg.edit(content=summary)
+        if self.errors:
+            report = "\n".join("Row {}: not added because {}.".format(idx, error) for idx, error in self.errors)
+            await self.ctx.send(file=text_to_file(report, filename="bulkadd_errors.txt"))
 
 
 class ExitProcess(Exception):
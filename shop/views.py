@@ -0,0 +1,118 @@
+from functools import partial
+
+import discord
+
+
+class Confirm(discord.ui.View):
+    """Yes/No buttons answered by `user`.
+
+    Members in `cancellers` may press No as well, to call the whole thing off. After
+    `ask`, `value` is True or False, or None if nobody answered in time.
+    """
+
+    def __init__(self, user, cancellers=(), timeout=25.0):
+        super().__init__(timeout=timeout)
+        self.user = user
+        self.allowed = {user.id, *(member.id for member in cancellers)}
+        self.value = None
+        self.message = None
+
+        yes = discord.ui.Button(label="Yes", style=discord.ButtonStyle.success, custom_id="shop:confirm:yes")
+        no = discord.ui.Button(label="No", style=discord.ButtonStyle.danger, custom_id="shop:confirm:no")
+        yes.callback = partial(self.answer, True)
+        no.callback = partial(self.answer, False)
+        self.add_item(yes)
+        self.add_item(no)
+
+    async def ask(self, ctx, content, **kwargs):
+        self.message = await ctx.send(content, view=self, **kwargs)
+        if await self.wait():
+            await close(self, self.message)
+        return self.value
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id in self.allowed:
+            return True
+        await interaction.response.send_message("This isn't for you.", ephemeral=True)
+        return False
+
+    async def answer(self, value, interaction: discord.Interaction):
+        if value and interaction.user.id != self.user.id:
+            return await interaction.response.send_message(
+                "Only {} can answer this.".format(self.user.display_name), ephemeral=True
+            )
+        self.value = value
+        await finish(self, interaction)
+
+
+class OfferView(discord.ui.View):
+    """Lets `user` answer a trade with a counter offer from their inventory.
+
+    Either side may decline. After `wait`, `offer` is a (quantity, item) tuple, or None
+    if the trade was declined or timed out.
+    """
+
+    def __init__(self, author, user, inventory, timeout=60.0):
+        super().__init__(timeout=timeout)
+        self.author = author
+        self.user = user
+        self.inventory = inventory
+        self.offer = None
+
+        make = discord.ui.Button(label="Make an offer", style=discord.ButtonStyle.primary, custom_id="shop:trade:offer")
+        decline = discord.ui.Button(label="Decline", style=discord.ButtonStyle.danger, custom_id="shop:trade:decline")
+        make.callback = self.make_offer
+        decline.callback = self.decline
+        self.add_item(make)
+        self.add_item(decline)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id in (self.author.id, self.user.id):
+            return True
+        await interaction.response.send_message("This trade isn't for you.", ephemeral=True)
+        return False
+
+    async def make_offer(self, interaction: discord.Interaction):
+        if interaction.user.id != self.user.id:
+            return await interaction.response.send_message("You can't counter your own trade.", ephemeral=True)
+        await interaction.response.send_modal(OfferModal(self))
+
+    async def decline(self, interaction: discord.Interaction):
+        await finish(self, interaction)
+
+
+class OfferModal(discord.ui.Modal, title="Counter offer"):
+    quantity = discord.ui.TextInput(label="Quantity", max_length=10, custom_id="shop:trade:quantity")
+    item = discord.ui.TextInput(label="Item", max_length=30, custom_id="shop:trade:item")
+
+    def __init__(self, view):
+        super().__init__()
+        self.view = view
+
+    async def on_submit(self, interaction: discord.Interaction):
+        qty, item = self.quantity.value.strip(), self.item.value.strip()
+        if item not in self.view.inventory:
+            return await interaction.response.send_message("You don't own {}.".format(item), ephemeral=True)
+        if not qty.isdigit() or not 0 < int(qty) <= self.view.inventory[item]["Qty"]:
+            return await interaction.response.send_message(
+                "You can offer between 1 and {} {}.".format(self.view.inventory[item]["Qty"], item), ephemeral=True
+            )
+        self.view.offer = (int(qty), item)
+        await finish(self.view, interaction)
+
+
+async def finish(view, interaction: discord.Interaction):
+    """Disables the view's buttons in the same edit that acknowledges the press, then stops it."""
+    for child in view.children:
+        child.disabled = True
+    await interaction.response.edit_message(view=view)
+    view.stop()
+
+
+async def close(view, message):
+    for child in view.children:
+        child.disabled = True
+    try:
+        await message.edit(view=view)
+    except (discord.NotFound, discord.Forbidden):
+        pass